@@ -1,56 +1,93 @@
+import argparse
 import json
 import logging
-import pandas as pd
-import requests
-import base64
-from google.cloud import pubsub_v1
+import os
+import sys
 import time 
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pipeline.cache import from_env
+from pipeline.fetch import Fetcher
+from pipeline import config, metrics
+from pipeline.publish import BatchPublisher
+
 logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(_name_)
+logger = logging.getLogger(__name__)
+
+# Topic and vehicle file come from the [archive] and [vehicles] config sections or BUSDATA_* variables
+settings = config.section('archive', project_id="dataeng-project-420102", topic_id="my-topic")
+topic_path = f"projects/{settings['project_id']}/topics/{settings['topic_id']}"
 
-project_id = "dataeng-project-420102"
-topic_id = "my-topic"
-topic_path = f"projects/{project_id}/topics/{topic_id}"
-publisher = pubsub_v1.PublisherClient()
+# Pub/Sub client and fetcher, created in main() so importing this module stays cheap
+publisher = None
+fetcher = None
 processed_vehicle_ids = set()
 
+# Compact columnar messages by default; --encoding json sends the response as plain JSON
+encoding = 'columnar'
+
 def get_vehicle_ids(filename, column):
-    df = pd.read_csv(filename)
-    return df[column].tolist()
+    return config.vehicle_ids(filename, column)
 
 def get_response(vehicle_id):
-    url = f"https://busdata.cs.pdx.edu/api/getBreadCrumbs?vehicle_id={vehicle_id}"
     try:
-        response = requests.get(url)
-        response.raise_for_status()  
-        return response.status_code, response.json()
-    except requests.RequestException as e:
+        content = fetcher.get('getBreadCrumbs', {'vehicle_id': vehicle_id})
+        return 200, content
+    except (OSError, LookupError, ValueError) as e:
+        # ValueError: a body that is not valid JSON
         logger.error(f"Error fetching data for vehicle ID {vehicle_id}: {e}")
         return None, None
 
 def publish_to_topic(vehicle_id, content):
     try:
-        message_data = json.dumps(content).encode("utf-8")
-        encoded_message_data = base64.b64encode(message_data)
-        future = publisher.publish(topic_path, data=encoded_message_data, vehicle_id=str(vehicle_id))
-        future.result()  # Block until the message is published
-        logger.info(f"Published message for vehicle ID: {vehicle_id}")
+        if encoding == 'json':
+            message_data = json.dumps(content).encode("utf-8")
+            attributes = {'encoding': 'json'}
+        else:
+            # Imported here: wire needs numpy, which --encoding json never loads
+            from pipeline import wire
+            message_data = wire.encode_records(content)
+            attributes = {'encoding': wire.ENCODING, 'records': str(len(content))}
+        # Queued on the batching publisher; failures are counted and reported by drain()
+        publisher.publish(message_data, vehicle_id=str(vehicle_id), **attributes)
+        logger.info(f"Queued message for vehicle ID: {vehicle_id}")
     except Exception as e:
         logger.error(f"Error publishing message for vehicle ID {vehicle_id}: {e}")
 
-def main():
-    filename = 'vehicle_ids.csv'
-    column = 'Quest'
-    vehicle_ids = get_vehicle_ids(filename, column)
+def main(argv=None):
+    global publisher, fetcher, encoding
+    vehicles = config.section('vehicles', file='vehicle_ids.csv', column='Quest')
+    parser = argparse.ArgumentParser(description="Publish each vehicle's raw breadcrumb response to Pub/Sub.")
+    parser.add_argument('--vehicles', default=vehicles['file'], help="CSV file of vehicle ids")
+    parser.add_argument('--column', default=vehicles['column'], help="column holding the vehicle ids")
+    parser.add_argument('--encoding', choices=('columnar', 'json'),
+                        default=os.environ.get('BUSDATA_ENCODING') or encoding,
+                        help="message encoding (default $BUSDATA_ENCODING or columnar)")
+    args = parser.parse_args(argv)
+    encoding = args.encoding
+
+    # Stage metrics when BUSDATA_METRICS is set (a :port for Prometheus or a JSON file path)
+    metrics.configure()
+
+    # Raw responses are cached on disk when BUSDATA_CACHE is set; BUSDATA_REPLAY=1 replays them offline
+    cache, replay, service_date = from_env()
+
+    # A replay publishes whatever was cached for the day
+    if replay:
+        vehicle_ids = cache.vehicles('getBreadCrumbs', service_date)
+    else:
+        vehicle_ids = get_vehicle_ids(args.vehicles, args.column)
     
     # Take only the two vehicle IDs
     # vehicle_ids = vehicle_ids[:2]
 
     if not vehicle_ids:
-        logger.warning("No vehicle IDs found in CSV file.")
+        logger.warning("No vehicle IDs found in the cache." if replay else "No vehicle IDs found in CSV file.")
         return
 
+    publisher = BatchPublisher(topic_path)
+    fetcher = Fetcher(workers=1, cache=cache, offline=replay, service_date=service_date)
+
     for vehicle_id in vehicle_ids:
         if vehicle_id in processed_vehicle_ids:
             logger.info(f"Data for vehicle ID {vehicle_id} has already been sent. Skipping.")
@@ -59,11 +96,15 @@ def main():
         status_code, content = get_response(vehicle_id)
         if status_code == 200 and content:
             logger.info(f"Vehicle ID: {vehicle_id}, Response Status: {status_code}")
-            logger.info(f"Raw data for vehicle ID {vehicle_id}: {content}")
+            # Formatting a whole day of breadcrumbs is costly, so only do it when debugging
+            logger.debug("Raw data for vehicle ID %s: %s", vehicle_id, content)
             publish_to_topic(vehicle_id, content)  # Publish entire content for the vehicle ID
             processed_vehicle_ids.add(vehicle_id)  # Mark vehicle ID as processed
         else:
             logger.warning(f"Failed to fetch data for vehicle ID {vehicle_id}. Status Code: {status_code}")
 
-if _name_ == "_main_":
+    errors = publisher.drain()
+    logger.info(f"Published {publisher.published} messages, {errors} failed")
+
+if __name__ == "__main__":
     main()
@@ -1,39 +1,57 @@
+import argparse
 import os
-import base64
-import json
-from google.cloud import pubsub_v1
-
-project_id = "dataeng-project-420102"
-subscription_id = "my-sub"
-
-subscriber = pubsub_v1.SubscriberClient()
-subscription_path = subscriber.subscription_path(project_id, subscription_id)
-
-if not os.path.exists("data"):
-    os.makedirs("data")
-
-def callback(message):
-    try:
-        vehicle_id = message.attributes['vehicle_id']
-        data = base64.b64decode(message.data)
-        data_json = json.loads(data)
-        
-       
-        file_path = os.path.join("data", f"{vehicle_id}.json")
-        with open(file_path, "w") as json_file:
-            json.dump(data_json, json_file, indent=4)
-            print(f"Saved data for vehicle {vehicle_id} to {file_path}")
-        
-        message.ack()
-    except Exception as e:
-        print(f"Error processing message: {e}")
-
-subscriber.subscribe(subscription_path, callback=callback)
-print(f"Listening for messages on {subscription_path}..")
-
-print("Press Ctrl+C to exit")
-try:
-    while True:
-        continue
-except KeyboardInterrupt:
-    subscriber.close()
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pipeline import config, metrics
+from pipeline.archive import RawArchive
+from pipeline.microbatch import MicroBatcher
+
+# Subscription comes from the [archive] config section or BUSDATA_ARCHIVE_* variables
+settings = config.section('archive', project_id="dataeng-project-420102", subscription_id="my-sub",
+                          directory="data")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Append raw breadcrumbs from Pub/Sub to the compressed NDJSON archive.")
+    parser.add_argument('--directory', default=settings['directory'], help="archive root directory")
+    parser.add_argument('--max-rows', type=int, default=50000, help="records per written batch")
+    parser.add_argument('--max-age', type=float, default=5.0, help="seconds before a partial batch is written")
+    args = parser.parse_args(argv)
+
+    # Imported here so that loading this module (e.g. for --help from the CLI) stays fast
+    from google.cloud import pubsub_v1
+
+    # Stage metrics when BUSDATA_METRICS is set (a :port for Prometheus or a JSON file path)
+    metrics.configure()
+
+    subscriber = pubsub_v1.SubscriberClient()
+    subscription_path = subscriber.subscription_path(settings['project_id'], settings['subscription_id'])
+
+    # Raw records are appended to data/service_date=.../vehicle=.../part-NNNNN.ndjson.gz
+    archive = RawArchive(args.directory)
+
+    # Messages are acked only once their batch has been written and fsynced
+    batcher = MicroBatcher(archive.write, max_rows=args.max_rows, max_age=args.max_age)
+
+    # Unacked messages count against flow control, so this bounds memory
+    flow_control = pubsub_v1.types.FlowControl(max_messages=1000)
+
+    streaming_pull_future = subscriber.subscribe(
+        subscription_path, callback=batcher.add, flow_control=flow_control)
+    print(f"Listening for messages on {subscription_path}..")
+
+    print("Press Ctrl+C to exit")
+    with subscriber:
+        try:
+            # Blocks without spinning until the stream fails or Ctrl+C
+            streaming_pull_future.result()
+        except KeyboardInterrupt:
+            streaming_pull_future.cancel()
+            streaming_pull_future.result()
+        finally:
+            batcher.close()
+            archive.close()
+            print(f"Archived {batcher.flushed_rows} records in {batcher.flushed_batches} batches")
+
+if __name__ == "__main__":
+    main()
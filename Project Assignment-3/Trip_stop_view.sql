@@ -1,4 +1,30 @@
-CREATE VIEW trip_stop_view as 
-SELECT  DISTINCT t.trip_id, t.vehicle_id, s.route_number, s.service_key, s.direction 
-FROM trip t, stopevent s 
-WHERE s.trip_id = t.trip_id;
\ No newline at end of file
+-- trip_stop_view used to run SELECT DISTINCT over the whole trip/stopevent join on
+-- every query, joining on s.trip_id, which stopevent does not have. Stop events carry
+-- the trip as pdx_trip (the breadcrumbs' EVENT_NO_TRIP). The join is now kept in the
+-- indexed trip_stop table, refreshed per service date by the stop-event subscriber
+-- (pipeline/views.py), and trip_stop_view reads from it.
+CREATE TABLE IF NOT EXISTS trip_stop (
+    service_date DATE NOT NULL,
+    trip_id INT NOT NULL,
+    vehicle_id INT,
+    route_number INT,
+    service_key VARCHAR,
+    direction INT
+);
+CREATE INDEX IF NOT EXISTS trip_stop_service_date_idx ON trip_stop (service_date);
+CREATE INDEX IF NOT EXISTS trip_stop_trip_id_idx ON trip_stop (trip_id);
+CREATE INDEX IF NOT EXISTS trip_stop_route_idx ON trip_stop (route_number, service_date);
+CREATE INDEX IF NOT EXISTS stopevent_date_idx ON stopevent (date);
+
+CREATE OR REPLACE VIEW trip_stop_view as 
+SELECT trip_id, vehicle_id, route_number, service_key, direction 
+FROM trip_stop;
+
+-- Refresh one service date by hand:
+-- BEGIN;
+-- DELETE FROM trip_stop WHERE service_date = '2024-05-01';
+-- INSERT INTO trip_stop (service_date, trip_id, vehicle_id, route_number, service_key, direction)
+-- SELECT DISTINCT s.date, t.trip_id, t.vehicle_id, s.route_number, s.service_key, s.direction
+-- FROM stopevent s JOIN trip t ON t.trip_id = s.pdx_trip
+-- WHERE s.date = '2024-05-01';
+-- COMMIT;
\ No newline at end of file
@@ -1,9 +1,38 @@
-import http.server
-import socketserver
+import os
+import re
+import sys
 
-PORT = 8000
-Handler = http.server.SimpleHTTPRequestHandler
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from pipeline.server import StaticHandler, serve
+from pipeline.tiles import TileStore
 
-with socketserver.TCPServer(("", PORT), Handler) as http:
-    print("serving at port", PORT)
-    http.serve_forever()
+PORT = int(os.environ.get('PORT', 8000))
+# Built with: python -m pipeline.tiles --day YYYY-MM-DD --out speed.mbtiles
+TILES = os.environ.get('BUSDATA_TILES', 'speed.mbtiles')
+TILE_PATH = re.compile(r'^/tiles/(\d+)/(\d+)/(\d+)\.pbf$')
+
+store = TileStore(TILES) if os.path.exists(TILES) else None
+
+
+class Handler(StaticHandler):
+    """Static files from this directory, plus speed grid tiles from the MBTiles file."""
+
+    def do_GET(self):
+        match = TILE_PATH.match(self.path)
+        if not match:
+            return super().do_GET()
+        data = store.get(*map(int, match.groups())) if store else None
+        if data is None:
+            # No breadcrumbs in this tile; the map treats 204 as empty
+            self.send_response(204)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-protobuf')
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+serve(os.path.dirname(os.path.abspath(__file__)), PORT, Handler)
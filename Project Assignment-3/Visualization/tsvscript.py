@@ -1,36 +1,28 @@
 #!/usr/bin/python3
-import csv, json
-from geojson import Feature, FeatureCollection, Point
-features = []
+"""Export top3.tsv (x, y, speed) to vis_5c.geojson for the map in index.html.
 
-with open('top3.tsv', newline='') as csvfile:
-    reader = csv.reader(csvfile, delimiter='\t')
-    data = csvfile.readlines()
-    for line in data[1:len(data)-1]:
-        line.strip()
-        row = line.split("\\t")
-        
-        # skip the rows where speed is missing
-        print(row)
-        x = row[0]
-        y = row[1]
-        speed = row[2]
-        if speed is None or speed == "":
-            continue
-     
-        try:
-            latitude, longitude = map(float, (y, x))
-            features.append(
-                Feature(
-                    geometry = Point((longitude,latitude)),
-                    properties = {
-                        'speed': (int(speed))
-                    }
-                )
-            )
-        except ValueError:
-            continue
+A thin wrapper around pipeline.export, which streams the file in chunks
+instead of building the whole FeatureCollection in memory. Any
+pipeline.export option can be passed to override the defaults, e.g. to
+export straight from Postgres:
 
-collection = FeatureCollection(features)
-with open("vis_5c.geojson", "w") as f:
-    f.write('%s' % collection)
+    python tsvscript.py --query "SELECT longitude, latitude, speed::int AS speed FROM breadcrumb
+        WHERE trip_id = %(trip)s" --param trip=170521360 --dsn "dbname=postgres" --out vis_trip.geojson
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from pipeline.export import main
+
+DEFAULTS = ['--lon', 'x', '--lat', 'y', '--properties', 'speed', '--required', 'speed']
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if '--query' not in args and '--tsv' not in args:
+        args = ['--tsv', 'top3.tsv'] + args
+    if '--query' not in args:
+        args = DEFAULTS + args
+    if '--out' not in args:
+        args += ['--out', 'vis_5c.geojson']
+    main(args)
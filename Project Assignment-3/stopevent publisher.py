@@ -1,93 +1,102 @@
-import requests
-from bs4 import BeautifulSoup
-from datetime import datetime
-import json
-from google.cloud import pubsub_v1
+import argparse
+import functools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
-# GCP Configuration
-project_id = 'dataeng-project-420102'
-topic_id = 'stop-topic'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pipeline import config, metrics
+from pipeline.cache import ResponseCache, from_env
+from pipeline.fetch import BASE_URL, Fetcher
+from pipeline.ingest import fleet_stages, ingest, parse_stop_events_page
+from pipeline.publish import ENCODINGS, BatchPublisher
+from pipeline.stopevents import BACKENDS
 
-# Publisher client
-publisher = pubsub_v1.PublisherClient()
-topic_path = publisher.topic_path(project_id, topic_id)
+# GCP Configuration, from the [stopevents] config section or BUSDATA_STOPEVENTS_* variables
+settings = config.section('stopevents', project_id='dataeng-project-420102', topic_id='stop-topic')
 
-vehicle_nums = [
-    3951, 3235, 3010, 3042, 2919, 4048, 3548, 3750, 3056, 4062,
-    3228, 3320, 4017, 4020, 3023, 3722, 3012, 4041, 3577, 3252,
-    3608, 3241, 3954, 4068, 3749, 3904, 4014, 3950, 4061, 3617,
-    3632, 4203, 3963, 3735, 3229, 4228, 3953, 3316, 3623, 3301,
-    3234, 3007, 3207, 3403, 3538, 4221, 3014, 3232, 3029, 3933,
-    3113, 4050, 3751, 3918, 4021, 3219, 3128, 3732, 3707, 3004,
-    4519, 3558, 3047, 2908, 3609, 3201, 3929, 4508, 3906, 3650,
-    3570, 3118, 4001, 3145, 3258, 3624, 3621, 3054, 3634, 4045,
-    3519, 3757, 3716, 3641, 3739, 3556, 3602, 2904, 3545, 3614,
-    3931, 4037, 3329, 3405, 3744, 3955, 4018, 3743, 3223, 3034
-]
+# Batching publisher client, created in main()
+topic_path = f"projects/{settings['project_id']}/topics/{settings['topic_id']}"
+publisher = None
 
-def publish_to_pubsub(messages, vehicle_num):
-    """Publish messages to the configured GCP Pub/Sub topic."""
-    try:
-        for message in messages:
-            message_bytes = message.encode('utf-8')
-            future = publisher.publish(topic_path, message_bytes)
-        print(f"Published messages for vehicle {vehicle_num}")
-    except Exception as e:
-        print(f"An error occurred while publishing: {e}")
+# The fleet, or the [vehicles] file and column when one is configured
+vehicles = config.section('vehicles', file='', column='Quest')
+vehicle_nums = config.vehicle_ids(vehicles['file'], vehicles['column'])
 
 def main():
-    for vehicle_num in vehicle_nums:
-        # Construct the URL for the current vehicle_num
-        url = f'https://busdata.cs.pdx.edu/api/getStopEvents?vehicle_num={vehicle_num}'
+    parser = argparse.ArgumentParser(description="Publish TriMet stop events to Pub/Sub.")
+    parser.add_argument('--workers', type=int, default=8,
+                        help="concurrent fetches (default 8)")
+    parser.add_argument('--parse-workers', type=int, default=2,
+                        help="threads parsing pages (default 2)")
+    parser.add_argument('--parse-processes', type=int, default=0,
+                        help="parse pages in this many processes instead of threads")
+    parser.add_argument('--encode-workers', type=int, default=1,
+                        help="threads encoding messages (default 1)")
+    parser.add_argument('--publish-workers', type=int, default=1,
+                        help="threads handing messages to the Pub/Sub client (default 1)")
+    parser.add_argument('--queue-size', type=int, default=None,
+                        help="vehicles waiting in front of each stage (default twice its workers)")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="max requests per second to the API host")
+    parser.add_argument('--base-url', default=BASE_URL,
+                        help="busdata API root, e.g. a local stub server")
+    parser.add_argument('--parser', choices=sorted(BACKENDS),
+                        default=os.environ.get('STOPEVENT_PARSER') or None,
+                        help="HTML parser backend: lxml, stream (stdlib html.parser) or bs4 "
+                             "(default $STOPEVENT_PARSER, else lxml if installed)")
+    parser.add_argument('--encoding', choices=ENCODINGS,
+                        default=os.environ.get('BUSDATA_ENCODING') or 'columnar',
+                        help="columnar: one compact message per vehicle; json: one JSON "
+                             "message per stop event (default $BUSDATA_ENCODING or columnar)")
+    parser.add_argument('--cache-dir',
+                        help="keep raw API responses here (default $BUSDATA_CACHE)")
+    parser.add_argument('--replay', action='store_true',
+                        help="publish from the cache only, without network access")
+    parser.add_argument('--service-date',
+                        help="service date to cache under or replay (default today)")
+    parser.add_argument('--metrics', default=os.environ.get('BUSDATA_METRICS', ''),
+                        help="serve stage metrics on :PORT or dump them to a JSON file "
+                             "(default $BUSDATA_METRICS)")
+    args = parser.parse_args()
+    metrics.configure(args.metrics)
 
-        # Send a GET request to fetch the raw HTML content
-        response = requests.get(url)
-        if response.status_code == 200:
-            # Parse the HTML content
-            soup = BeautifulSoup(response.text, 'html.parser')
+    # Raw pages are cached on disk with --cache-dir or $BUSDATA_CACHE; --replay publishes them offline
+    cache, replay, service_date = from_env()
+    if args.cache_dir:
+        cache = ResponseCache(args.cache_dir)
+    replay = replay or args.replay
+    service_date = args.service_date or service_date
+    if replay and cache is None:
+        parser.error("--replay needs --cache-dir or $BUSDATA_CACHE")
 
-            # Find all tables with stop event data
-            tables = soup.find_all('table')
+    global publisher
+    publisher = BatchPublisher(topic_path, encoding=args.encoding)
 
-            messages = []
-            for table in tables:
-                # Extract rows
-                pdx_trip = table.find_previous_sibling('h2').text.split()[-1]
-                for row in table.find_all('tr')[1:]:  # Skip the header row
-                    cells = row.find_all('td')
-                    row_data = {
-                        'pdx_trip': pdx_trip,
-                        'date': datetime.now().strftime("%Y-%m-%d"),
-                        'vehicle_num': cells[0].text,  # Assuming the first cell contains the vehicle number
-                        'leave_time': cells[1].text,
-                        'train': cells[2].text,
-                        'route_number': cells[3].text,
-                        'direction': cells[4].text,
-                        'service_key': cells[5].text,
-                        'trip_number': cells[6].text,
-                        'stop_time': cells[7].text,
-                        'arrive_time': cells[8].text,
-                        'dwell': cells[9].text,
-                        'location_id': cells[10].text,
-                        'door': cells[11].text,
-                        'lift': cells[12].text,
-                        'ons': cells[13].text,
-                        'offs': cells[14].text,
-                        'estimated_load': cells[15].text,
-                        'maximum_speed': cells[16].text,
-                        'train_mileage': cells[17].text,
-                        'pattern_distance': cells[18].text,
-                        'location_distance': cells[19].text,
-                        'x_coordinate': cells[20].text,
-                        'y_coordinate': cells[21].text,
-                        'data_source': cells[22].text,
-                        'schedule_status': cells[23].text
-                    }
-                    messages.append(json.dumps(row_data))
-                    
-            publish_to_pubsub(messages, vehicle_num)
-        else:
-            print(f"Failed to retrieve data for vehicle {vehicle_num}")
+    # A replay publishes whatever was cached for the day
+    vehicles = cache.vehicles('getStopEvents', service_date) if replay else vehicle_nums
+
+    # Pages are fetched, parsed, encoded and published as overlapping stages with bounded queues
+    parse = functools.partial(parse_stop_events_page, date=service_date, backend=args.parser)
+    parse_executor = ProcessPoolExecutor(args.parse_processes) if args.parse_processes else None
+    with Fetcher(base_url=args.base_url, workers=args.workers, rate=args.rate, cache=cache,
+                 offline=replay, service_date=service_date) as fetcher:
+        stages = fleet_stages(fetcher, 'getStopEvents', parse, publisher, param='vehicle_num',
+                              parse_workers=max(args.parse_workers, args.parse_processes),
+                              encode_workers=args.encode_workers,
+                              publish_workers=args.publish_workers,
+                              queue_size=args.queue_size, parse_executor=parse_executor)
+        try:
+            failures = ingest(vehicles, stages,
+                              on_result=lambda vehicle_num, _: print(f"Published messages for vehicle {vehicle_num}"))
+        finally:
+            if parse_executor is not None:
+                parse_executor.shutdown()
+    for stage, vehicle_num, error in failures:
+        print(f"Failed to {stage} data for vehicle {vehicle_num}: {error}")
+
+    errors = publisher.drain()
+    print(f"Published {publisher.published} messages, {errors} failed")
 
 if __name__ == "__main__":
     main()
@@ -23,5 +23,10 @@ CREATE TABLE stopevent (
     x_coordinate FLOAT,
     y_coordinate FLOAT,
     data_source INT,
-    schedule_status INT
+    schedule_status INT,
+    PRIMARY KEY (trip_number, stop_time, location_id)
 );
+
+CREATE INDEX stopevent_date_idx ON stopevent (date);
+CREATE INDEX stopevent_pdx_trip_idx ON stopevent (pdx_trip);
+
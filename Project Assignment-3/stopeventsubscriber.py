@@ -1,128 +1,264 @@
-from io import StringIO
 import psycopg2
-from google.cloud import pubsub_v1
+from concurrent.futures import TimeoutError
+import argparse
 import json
+import os
+import signal
+import sys
 import pandas as pd
-import time
 
-# Project and subscription details
-project_id = "dataeng-project-420102"
-subscription_id = "stop-topic-sub"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pipeline import config, metrics
+from pipeline.publish import unpack_records
+from pipeline.quarantine import open_quarantine, replay
+from pipeline.routes import TripRouteIndex, ensure_trip_route
+from pipeline.load import copy_dataframe, ensure_unique_key
+from pipeline.microbatch import MicroBatcher
+from pipeline.stopevents import STOPEVENT_COLUMNS, STOPEVENT_KEY, STOPEVENT_RULES, TABLE_COLUMNS
+from pipeline.schema import ensure_schema
+from pipeline.validation import gate
+from pipeline.views import TripStopRefresher, ensure_trip_stop
 
-# Database credentials
-DB_name = "postgres"
-DB_user = "postgres"
-DB_pwd = "Bhuvana@26"
+# Project and subscription details, from the [stopevents] config section or BUSDATA_STOPEVENTS_* variables
+settings = config.section('stopevents', project_id="dataeng-project-420102", subscription_id="stop-topic-sub")
 
-subscriber = pubsub_v1.SubscriberClient()
-subscription_path = subscriber.subscription_path(project_id, subscription_id)
+# Database credentials, from the [database] config section or BUSDATA_DATABASE_* variables
+database = config.section('database', host="localhost", name="postgres", user="postgres",
+                          password="Bhuvana@26")
+
+# Pub/Sub client, created by make_subscriber() only when a mode reads from Pub/Sub
+subscriber = None
+subscription_path = None
 json_list = []
 
-def process_message(message: pubsub_v1.subscriber.message.Message) -> None:
-    json_message = json.loads(message.data.decode('utf-8'))
-    json_list.append(json_message)
-    message.ack()
+# Parquet landing zone for raw stop events, set up in main() when BUSDATA_LANDING or --landing is given
+landing = None
+
+# Where rejected rows and failed batches are kept for replay, set up in main() from --quarantine
+quarantine = None
+
+def make_subscriber():
+    """Create the Pub/Sub client; google.cloud is imported here as replays don't need it"""
+    from google.cloud import pubsub_v1
 
-streaming_pull_future = subscriber.subscribe(subscription_path, callback=process_message)
+    global subscriber, subscription_path
+    subscriber = pubsub_v1.SubscriberClient()
+    subscription_path = subscriber.subscription_path(settings['project_id'], settings['subscription_id'])
+    return pubsub_v1
 
-print(f"Listening for messages on {subscription_path}..\n")
+def process_message(message: 'pubsub_v1.subscriber.message.Message') -> None:
+    with metrics.timer('parse'):
+        records = unpack_records(message.data, message.attributes)
+    json_list.extend(records)
+    metrics.count('parse', rows=len(records), messages=1, nbytes=len(message.data))
+    message.ack()
+
+def connect():
+    """Establish a connection to the database, with the tables and indexes the load needs"""
+    conn = psycopg2.connect(
+        host=database['host'],
+        database=database['name'],
+        user=database['user'],
+        password=database['password']
+    )
+    ensure_schema(conn)
+    ensure_unique_key(conn, 'stopevent', STOPEVENT_KEY)
+    ensure_trip_stop(conn)
+    ensure_trip_route(conn)
+    return conn
 
-# Loop to keep listening for messages
-while True:
+# Define function to copy data to stopevent table
+def copy_to_stopevent_table(conn, stopevent_data):
     try:
-        with subscriber:
-            streaming_pull_future.result(timeout=60.0)
-    except TimeoutError:
-        if json_list:
-            break
-        print("No messages received in the last 60 seconds, retrying...")
-        # Re-subscribe to continue listening for messages
-        streaming_pull_future = subscriber.subscribe(subscription_path, callback=process_message)
-
-# Check if messages were received
-if not json_list:
-    print("No messages received. Exiting.")
-    exit()
-
-df = pd.DataFrame(json_list)
-
-# Data validations
-if len(df) > 0:
-    # Check for necessary columns
-    expected_columns = {'vehicle_num', 'pdx_trip', 'date', 'leave_time', 'train', 'route_number', 'direction', 'service_key', 'trip_number', 'stop_time', 'arrive_time', 'dwell', 'location_id', 'door', 'lift', 'ons', 'offs', 'estimated_load', 'maximum_speed', 'train_mileage', 'pattern_distance', 'location_distance', 'x_coordinate', 'y_coordinate', 'data_source', 'schedule_status'}
-    if not expected_columns.issubset(df.columns):
-        print("Error: Missing expected columns in the dataset.")
-        exit()
-
-    # Check for missing values
-    if df.isnull().values.any():
-        print("Missing values found in the dataset. Handling missing values...")
-        df = df.dropna()
-
-        # Check if there are still missing values
-        if df.isnull().values.any():
-            print("Error: Missing values found in the dataset after handling them.")
-            exit()
-
-    # Check for duplicate rows
-    duplicate_rows = df[df.duplicated()]
-    if duplicate_rows.empty:
-        print("There are no duplicate rows in the dataset.")
-    else:
-        print("Duplicate rows found in the dataset:")
-        print(duplicate_rows)
+        result = copy_dataframe(conn, 'stopevent',
+                                stopevent_data[STOPEVENT_COLUMNS].rename(columns=TABLE_COLUMNS),
+                                merge_key=STOPEVENT_KEY)
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        # Lost connections are retried by redelivery, not quarantined
+        raise
+    except (Exception, psycopg2.DatabaseError) as error:
+        print("Error: %s" % error)
+        conn.rollback()
+        return 1
+    if result.failed and quarantine is not None:
+        # Back to record column names, so a replay validates them like any other stop events
+        refused = result.failed_rows().rename(columns={v: k for k, v in TABLE_COLUMNS.items()})
+        quarantine.put('stopevent', 'load_stopevent', refused)
+    print(f"Loading of stopevent table completed: {result}")
 
-    print("Ran Assertion successfully")
+class StopEventLoader:
+    """Validate and load batches of stop events, refreshing trip_stop every refresh_interval seconds.
 
-    # Group the DataFrame by vehicle_num and check if both trip_number and stop_time exist for each group
-    grouped = df.groupby('vehicle_num')
-    for vehicle_num, group in grouped:
-        has_event_no_trip = 'trip_number' in group.columns
-        has_event_no_stop = 'stop_time' in group.columns
-        if not (has_event_no_trip and has_event_no_stop):
-            print(f"Missing trip_number or stop_time data for Vehicle Number {vehicle_num}.")
+    Rebuilding a service date's trip_stop rows costs the whole date, so
+    loaded dates are handed to a TripStopRefresher, which refreshes them
+    together on its own timer rather than after every micro-batch. A lost
+    database connection is reopened on the next batch; the failed batch is
+    raised so its messages are redelivered.
+    """
 
-    print("Ran Assertion successfully")
+    def __init__(self, refresh_interval=300.0):
+        self.conn = None
+        # Route, direction and service key of the trips seen so far, copied onto trip as they arrive
+        self.routes = TripRouteIndex()
+        self.trip_stop = TripStopRefresher(connect, refresh_interval)
 
-    # Check the speed of a TriMet bus should not exceed 100 miles per hour
-    excessive_speed_rows = df[df['maximum_speed'] > 100]
+    def __call__(self, records):
+        if self.conn is None or self.conn.closed:
+            self.conn = connect()
+        try:
+            self.load(records)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.conn.close()
+            raise
 
-    if excessive_speed_rows.empty:
-        print("All bus speeds are within the allowed limit of 100 miles per hour.")
-    else:
-        print("Warning: Some buses are exceeding the maximum allowed speed of 100 miles per hour:")
-        print(excessive_speed_rows)
+    def load(self, records):
+        df = pd.DataFrame(records)
+        if len(df) == 0:
+            return
+        # Land the raw stop events as Parquet before validation
+        if landing is not None:
+            landing.write_stop_events(df)
+        # Data validations: rows failing a quarantining rule are set aside, the rest are loaded
+        df, rejected, report = gate(df, STOPEVENT_RULES)
+        print(report)
+        if len(rejected) and quarantine is not None:
+            quarantine.put('stopevent', 'validate', rejected)
+        if len(df) == 0:
+            return
+        if copy_to_stopevent_table(self.conn, df) == 1:
+            raise RuntimeError("stopevent load failed")
+        self.routes.apply(self.conn, df, quarantine)
+        self.trip_stop.add(df['date'].unique())
 
-    print("Ran Assertion successfully")
+    def close(self):
+        try:
+            self.trip_stop.close()
+        finally:
+            if self.conn is not None:
+                self.conn.close()
 
-# Database connection
-conn = psycopg2.connect(
-    host="localhost",
-    database=DB_name,
-    user=DB_user,
-    password=DB_pwd
-)
+def collect_and_process(window):
+    """Collect messages until a window passes with nothing new, then load them all at once."""
+    loader = StopEventLoader()
+    make_subscriber()
+    with subscriber:
+        while True:
+            received = len(json_list)
+            streaming_pull_future = subscriber.subscribe(subscription_path, callback=process_message)
+            try:
+                streaming_pull_future.result(timeout=window)
+            except TimeoutError:
+                streaming_pull_future.cancel()
+                streaming_pull_future.result()
+            if json_list and len(json_list) == received:
+                break
+            if not json_list:
+                print(f"No messages received in the last {window:g} seconds, retrying...")
 
-# Define function to copy data to stopevent table
-def copy_to_stopevent_table(conn, stopevent_data):
-    buffer = StringIO()
-    stopevent_data.to_csv(buffer, index=False, header=False, sep=",")
-    buffer.seek(0)
+    try:
+        loader(json_list)
+    except Exception as error:
+        # The messages are already acked; without a quarantine the batch is lost
+        if quarantine is None:
+            raise
+        quarantine.put('stopevent', 'batch', json_list, reason=f"{type(error).__name__}: {error}")
+    finally:
+        loader.close()
+
+def replay_quarantine():
+    """Validate and load quarantined stop events again; rows that still fail are quarantined anew."""
+    loader = StopEventLoader(refresh_interval=float('inf'))
+
+    def replay_entry(entry, rows):
+        print(f"Replaying {len(rows)} stop events quarantined at {entry.stage}")
+        loader(rows.to_dict('records'))
 
-    cursor = conn.cursor()
     try:
-        cursor.copy_from(buffer, 'stopevent', sep=",")
-        conn.commit()
-    except (Exception, psycopg2.DatabaseError) as error:
-        print("Error: %s" % error)
-        conn.rollback()
-        cursor.close()
-        return 1
-    print("Loading of stopevent table completed")
-    cursor.close()
+        replayed, failed = replay(quarantine, 'stopevent', replay_entry,
+                                  transient=(psycopg2.OperationalError, psycopg2.InterfaceError))
+    finally:
+        loader.close()
+    print(f"Replayed {replayed} quarantined stop events, {failed} entries failed and were quarantined again")
 
-# Copy data to stopevent table
-copy_to_stopevent_table(conn, df)
+def stream(max_rows, max_age, max_messages, max_bytes, refresh_interval):
+    """Load stop events continuously in micro-batches, acking each batch after it commits."""
+    pubsub_v1 = make_subscriber()
+    loader = StopEventLoader(refresh_interval)
+    # A batch that fails for any reason but a lost connection is quarantined and acked
+    dead_letter = None
+    if quarantine is not None:
+        def dead_letter(records, reason):
+            quarantine.put('stopevent', 'batch', records, reason=reason)
+    batcher = MicroBatcher(loader, max_rows=max_rows, max_age=max_age, dead_letter=dead_letter,
+                           transient=(psycopg2.OperationalError, psycopg2.InterfaceError))
+    # Unacked messages count against flow control, so memory stays bounded however long this runs
+    flow_control = pubsub_v1.types.FlowControl(max_messages=max_messages, max_bytes=max_bytes)
+    streaming_pull_future = subscriber.subscribe(
+        subscription_path, callback=batcher.add, flow_control=flow_control)
+
+    # SIGTERM (systemd, docker stop, kill) shuts down the same way as Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    print(f"Streaming messages from {subscription_path} "
+          f"(flush every {max_rows} rows or {max_age}s)..\n")
+
+    with subscriber:
+        try:
+            streaming_pull_future.result()
+        except KeyboardInterrupt:
+            print("Shutting down, flushing the last batch..")
+            streaming_pull_future.cancel()
+            streaming_pull_future.result()
+        finally:
+            batcher.close()
+            loader.close()
+    print(f"Loaded {batcher.flushed_rows} rows in {batcher.flushed_batches} batches, "
+          f"{batcher.failed_batches} batches failed, {batcher.dead_lettered_batches} quarantined")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load TriMet stop events from Pub/Sub into Postgres.")
+    parser.add_argument('--once', action='store_true',
+                        help="collect until a --window passes without messages, load them and exit")
+    parser.add_argument('--window', type=float, default=60.0,
+                        help="seconds without messages that end a --once run")
+    parser.add_argument('--max-rows', type=int, default=20000,
+                        help="stop events per micro-batch")
+    parser.add_argument('--max-age', type=float, default=30.0,
+                        help="seconds before a partial micro-batch is flushed")
+    parser.add_argument('--max-messages', type=int, default=1000,
+                        help="unacked messages held before pulling pauses")
+    parser.add_argument('--max-bytes', type=int, default=100 * 1024 ** 2,
+                        help="unacked message bytes held before pulling pauses")
+    parser.add_argument('--refresh-interval', type=float, default=300.0,
+                        help="seconds between trip_stop refreshes of the dates loaded")
+    parser.add_argument('--landing', default=os.environ.get('BUSDATA_LANDING'),
+                        help="Parquet landing zone for raw stop events (default $BUSDATA_LANDING)")
+    parser.add_argument('--quarantine', default=os.environ.get('BUSDATA_QUARANTINE'),
+                        help="directory, or 'postgres' for the quarantine table, that keeps "
+                             "rejected rows and failed batches (default $BUSDATA_QUARANTINE)")
+    parser.add_argument('--replay-quarantine', action='store_true',
+                        help="validate and load the quarantined stop events again and exit")
+    parser.add_argument('--metrics', default=os.environ.get('BUSDATA_METRICS', ''),
+                        help="serve stage metrics on :PORT or dump them to a JSON file "
+                             "(default $BUSDATA_METRICS)")
+    args = parser.parse_args()
+    metrics.configure(args.metrics)
+
+    global landing
+    if args.landing:
+        from pipeline.landing import LandingZone
+        landing = LandingZone(args.landing)
+    global quarantine
+    quarantine = open_quarantine(args.quarantine, connect)
+    if args.replay_quarantine and quarantine is None:
+        parser.error("--replay-quarantine needs --quarantine or $BUSDATA_QUARANTINE")
+
+    if args.replay_quarantine:
+        replay_quarantine()
+    elif args.once:
+        collect_and_process(args.window)
+    else:
+        stream(args.max_rows, args.max_age, args.max_messages, args.max_bytes, args.refresh_interval)
 
-# Close the database connection
-conn.close()
+if __name__ == "__main__":
+    main()
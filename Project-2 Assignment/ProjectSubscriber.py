@@ -1,248 +1,328 @@
-from io import StringIO
 import psycopg2
 from concurrent.futures import TimeoutError
-from google.cloud import pubsub_v1
-from datetime import datetime, timedelta
+import argparse
+import contextlib
 import os
-import json
+import sys
 import pandas as pd
 
-project_id = "scientific-pad-420219"
-subscription_id = "project_topic-sub"
-
-DB_name = "postgres"
-DB_user = "postgres"
-DB_pwd = "165833"
-
-current_date = datetime.now().strftime("%m%d%Y")
-current_folder = 'project-topic-sub'
-
-subscriber = pubsub_v1.SubscriberClient()
-
-subscription_path = subscriber.subscription_path(project_id, subscription_id)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pipeline import config, metrics
+from pipeline.breadcrumbs import (BREADCRUMB_KEY, BREADCRUMB_RULES, BREADCRUMB_SUMMARY,
+                                  BREADCRUMB_TYPES, TRIP_KEY, TRIP_TYPES, parallel_transform,
+                                  transform_pool)
+from pipeline.load import copy_dataframe, ensure_unique_key
+from pipeline.microbatch import MicroBatcher
+from pipeline.schema import breadcrumb_days, ensure_partitions, ensure_schema
+from pipeline.publish import unpack_records
+from pipeline.quarantine import open_quarantine, replay
+from pipeline.routes import enrich_trips, ensure_trip_route
+from pipeline.validation import gate, validate
+from pipeline.views import TripStopRefresher, stop_event_dates
+
+# Subscription and database, from the [breadcrumbs] and [database] config sections
+# or BUSDATA_BREADCRUMBS_* / BUSDATA_DATABASE_* variables
+settings = config.section('breadcrumbs', project_id="scientific-pad-420219",
+                          subscription_id="project_topic-sub")
+database = config.section('database', host="localhost", name="postgres", user="postgres",
+                          password="165833")
+
+# Pub/Sub client, created by make_subscriber() only when a mode reads from Pub/Sub
+subscriber = None
+subscription_path = None
 json_list = []
 
-def process_message(message: pubsub_v1.subscriber.message.Message) -> None:
-    json_message = json.loads(message.data.decode('utf-8'))
-    json_list.append(json_message)
-    message.ack()
-
-streaming_pull_future = subscriber.subscribe(
-    subscription_path, callback=process_message)
-
-print(f"Listening for messages on {subscription_path}..\n")
-
-with subscriber:
-    try:
-        streaming_pull_future.result(timeout=60.0)
-    except TimeoutError:
-        streaming_pull_future.cancel()
-        streaming_pull_future.result()
-
-df = pd.DataFrame(json_list)
-
-# Get the length of the DataFrame
-length = len(df)
-
-if length > 0:
-    # Check if 'METERS' column contains only positive integers
-    if df['METERS'].dtype != 'int64':
-        print("METERS column should contain integers")
-    elif not (df['METERS'] >= 0).all():
-        print("METERS column should be non-negative")
-    else:
-        print("METERS column are integers and non-negative.")
-
-    print("Ran Assertion #1 successfully")
-
-    # Check for missing values in any column
-    if df.isnull().values.any():
-        print("There are missing values in the dataset.")
-    else:
-        print("No missing values found in any column.")
-
-    print("Ran Assertion #2 successfully")
-
-    # Check if GPS_LONGITUDE values are within the range [-180, 180]
-    if not df['GPS_LONGITUDE'].between(-180, 180).all():
-        print("Some GPS_LONGITUDE values are not within the range [-180, 180].")
-    else:
-        print("All GPS_LONGITUDE values are within the range [-180, 180].")
-
-    print("Ran Assertion #3 successfully")
-
-    # Check if GPS_LATITUDE values are within the range [-90, 90]
-    if not df['GPS_LATITUDE'].between(-90, 90).all():
-        print("Some GPS_LATITUDE values are not within the range [-90, 90].")
-    else:
-        print("All GPS_LATITUDE values are within the range [-90, 90].")
-
-    print("Ran Assertion #4 successfully")
-
-    # Check for duplicate rows
-    duplicate_rows = df[df.duplicated()]
-    if duplicate_rows.empty:
-        print("There are no duplicate rows in the dataset.")
-    else:
-        print("Duplicate rows found in the dataset:")
-        print(duplicate_rows)
-
-    print("Ran Assertion #5 successfully")
-
-    # Check for missing values in GPS_LONGITUDE and GPS_LATITUDE columns
-    missing_longitude = df['GPS_LONGITUDE'].isnull().any()
-    missing_latitude = df['GPS_LATITUDE'].isnull().any()
-
-    if missing_longitude or missing_latitude:
-        print("Null GPS_LATITUDE or GPS_LATITUDE values found.")
-    else:
-        print("No Null GPS_LONGITUDE or GPS_LATITUDE values found.")
-
-    print("Ran Assertion #6 successfully")
-
-    # Group the DataFrame by VEHICLE_ID and check if both Event_No_Trip and Event_No_Stop exist for each group
-    grouped = df.groupby('VEHICLE_ID')
-    for vehicle_id, group in grouped:
-        has_event_no_trip = 'EVENT_NO_TRIP' in group.columns
-        has_event_no_stop = 'EVENT_NO_STOP' in group.columns
-        if not (has_event_no_trip and has_event_no_stop):
-            print(f"Missing Event_No_Trip or Event_No_Stop data for Vehicle ID {vehicle_id}.")
-
-    print("Ran Assertion #7 successfully")
-
-    # Group the DataFrame by 'VEHICLE_ID' and 'OPD_DATE'
-    grouped = df.groupby(['VEHICLE_ID', 'OPD_DATE'])
-
-    # Check if each group has only one unique date
-    for (vehicle_id, opd_date), group in grouped:
-        if len(group['OPD_DATE'].unique()) != 1:
-            print(f"Vehicle ID {vehicle_id} on {opd_date.date()} has data with different dates.")
-
-    print("Ran Assertion #8 successfully")
+# Parquet landing zone for raw batches, created in main() when --landing is given
+landing = None
 
-    grouped = df.groupby('VEHICLE_ID')
-    # Check if any row violates the condition
-    violation_found = False
-    for index, row in df.iterrows():
-        if row['GPS_HDOP'] > 10:
-            violation_found = True
-            break  # Exit the loop once a violation is found
+# Where rejected rows and failed batches are kept for replay, set up in main() from --quarantine
+quarantine = None
 
-    # Print assertion result based on violation flag
-    if violation_found:
-        print("Assertion failed: There are rows where GPS_HDOP values are greater than 10.")
-    else:
-        print("Assertion passed: All rows have GPS_HDOP values less than 10.")
+# Processes the transform shards large batches across, set in main() from --workers
+workers = 1
 
-    print("Ran Assertion #9 successfully")
+# Refreshes trip_stop for the dates whose stop events the loaded trips join, set up in main() unless --append
+trip_stop = None
 
-    # Convert OPD_DATE to datetime
-    df['NEW_OPD_DATE'] = pd.to_datetime(
-        df['OPD_DATE'], format='%d%b%Y:%H:%M:%S')
+def make_subscriber():
+    """Create the Pub/Sub client; google.cloud is imported here as backfills and replays don't need it"""
+    from google.cloud import pubsub_v1
 
-    # Extract day of the week
-    df['DAY_OF_WEEK'] = df['NEW_OPD_DATE'].dt.dayofweek
-
-    # Map day of the week to name
-    day_names = {0: 'Weekday', 1: 'Weekday', 2: 'Weekday',
-                 3: 'Weekday', 4: 'Weekday', 5: 'Saturday', 6: 'Sunday'}
-    df['DAY_NAME'] = df['DAY_OF_WEEK'].map(day_names)
-
-    update_df = df.drop_duplicates(subset=['EVENT_NO_TRIP'], keep='first')
-
-    # Define function to create timestamp
-    def create_timestamp(row):
-        opd_date = datetime.strptime(row['OPD_DATE'], '%d%b%Y:%H:%M:%S')
-        act_time = timedelta(seconds=row['ACT_TIME'])
-        timestamp = opd_date + act_time
-        return pd.Timestamp(timestamp)
-
-    # Apply the function to create the TIMESTAMP column
-    df['TIMESTAMP'] = df.apply(create_timestamp, axis=1)
-
-    df.sort_values(by=['EVENT_NO_TRIP', 'TIMESTAMP',
-                       'VEHICLE_ID'], inplace=True)
-
-    df['SPEED'] = df.groupby('EVENT_NO_TRIP')['METERS'].diff(
-    ) / df.groupby('EVENT_NO_TRIP')['ACT_TIME'].diff()
-
-    # Backfill to handle the first record of each trip
-    df['SPEED'] = df['SPEED'].fillna(method='bfill')
-
-    df['SPEED'] = df['SPEED'].clip(lower=0)  # No negative speeds
-
-    df['GPS_LATITUDE'] = df['GPS_LATITUDE'].fillna(0.0)
-
-    df['GPS_LONGITUDE'] = df['GPS_LONGITUDE'].fillna(0.0)
-
-    # Add dummy columns with default value
-    update_df['ROUTE_ID'] = 0
-    
+    global subscriber, subscription_path
+    subscriber = pubsub_v1.SubscriberClient()
+    subscription_path = subscriber.subscription_path(settings['project_id'], settings['subscription_id'])
+    return pubsub_v1
 
+def process_message(message: 'pubsub_v1.subscriber.message.Message') -> None:
+    with metrics.timer('parse'):
+        records = unpack_records(message.data, message.attributes)
+    json_list.extend(records)
+    metrics.count('parse', rows=len(records), messages=1, nbytes=len(message.data))
+    message.ack()
 
-    # Select only required columns and rename them
-    df_trip = update_df[['EVENT_NO_TRIP', 'ROUTE_ID', 'VEHICLE_ID', 'DAY_NAME']].rename(
-        columns={'EVENT_NO_TRIP': 'trip_id', 'ROUTE_ID': 'route_id', 'VEHICLE_ID': 'vehicle_id', 'DAY_NAME': 'service_key'})
-    # Select only required columns and rename them
-    df_breadcrumb = df[['TIMESTAMP', 'GPS_LATITUDE', 'GPS_LONGITUDE', 'SPEED', 'EVENT_NO_TRIP']].rename(
-        columns={'TIMESTAMP': 'tstamp', 'GPS_LATITUDE': 'latitude', 'GPS_LONGITUDE': 'longitude', 'SPEED': 'speed', 'EVENT_NO_TRIP': 'trip_id'})
+def transform(df, executor=None):
+    """Derive TIMESTAMP and SPEED and split the frame into trip and breadcrumb rows."""
+    # Sharded by trip across the process pool for large batches; speeds are
+    # computed and backfilled within each trip
+    df_trip, df_breadcrumb = parallel_transform(df, executor=executor, workers=workers)
 
-    # Create a new column for the day of the week
-    df['DAY_OF_WEEK'] = df['TIMESTAMP'].dt.dayofweek
+    # Calculate and display average speed for each day of the week
+    summary_input = df_breadcrumb.rename(columns={'tstamp': 'TIMESTAMP', 'speed': 'SPEED'})
+    summary = validate(summary_input, BREADCRUMB_SUMMARY).summaries['average speed by day']
+    print(f"The average speed of the day for summary assertion: {summary}")
+    print("Ran Assertion #10 successfully")
 
-    # Map day of the week to 'Weekday' or 'Weekend'
-    df['DAY_TYPE'] = df['DAY_OF_WEEK'].map({0: 'Weekend', 1: 'Weekday', 2: 'Weekday', 3: 'Weekday', 4: 'Weekday', 5: 'Weekday', 6: 'Weekend'})
+    return df_trip, df_breadcrumb
 
-    # Calculate average speed for each day of the week
-    avg_speed_per_day = df.groupby(['DAY_TYPE', 'DAY_OF_WEEK'])['SPEED'].mean().reset_index()
+def connect():
+    """Establish a connection to the database"""
+    return psycopg2.connect(
+        host=database['host'],
+        database=database['name'],
+        user=database['user'],
+        password=database['password']
+    )
 
-    # Display average speed for each day of the week
-    print(f"The average spped of the day for summary assertion: {avg_speed_per_day}")
-    print("Ran Assertion #10 successfully")
+def copy_to_trip_table(conn, trip_data, merge=True):
+    """
+    Here we stream the dataframe to the table with COPY
+    in committed chunks, using the binary format.
+    With merge, trips already in the table are skipped.
+    Route, direction and service key are then filled in from
+    the stop events already loaded for these trips, and the
+    trip_stop dates those stop events belong to are marked for refresh
+    """
+    trip_data_unique = trip_data.drop_duplicates(subset=['trip_id'])
+    result = copy_dataframe(conn, 'trip', trip_data_unique[['trip_id', 'vehicle_id']],
+                            binary=True, types=TRIP_TYPES,
+                            merge_key=TRIP_KEY if merge else None)
+    quarantine_failed(result, 'load_trip')
+    enriched = enrich_trips(conn, trip_data_unique['trip_id'])
+    if trip_stop is not None:
+        trip_stop.add(stop_event_dates(conn, trip_data_unique['trip_id']))
+    print(f"Trip data copied successfully! {result}, {enriched} trips given routes")
+
+def copy_to_breadcrumb_table(conn, breadcrumb_data, merge=True):
+    """
+    Here we stream the dataframe to the table with COPY
+    in committed chunks, using the binary format.
+    With merge, breadcrumbs already in the table are skipped
+    """
+    try:
+        # breadcrumb is partitioned by day; create the days this batch covers
+        ensure_partitions(conn, breadcrumb_days(breadcrumb_data))
+        result = copy_dataframe(conn, 'breadcrumb', breadcrumb_data,
+                                binary=True, types=BREADCRUMB_TYPES,
+                                merge_key=BREADCRUMB_KEY if merge else None)
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        # Lost connections are retried by redelivery, not quarantined
+        raise
+    except (Exception, psycopg2.DatabaseError) as error:
+        print("Error: %s" % error)
+        conn.rollback()
+        return 1
+    quarantine_failed(result, 'load_breadcrumb')
+    print(f"Loading of breadcrumb table completed: {result}")
+
+def quarantine_failed(result, stage):
+    """Set aside the rows a load refused, so one bad row costs only that row"""
+    if result.failed and quarantine is not None:
+        quarantine.put('breadcrumb', stage, result.failed_rows())
+
+def connect_for_merge():
+    """Connect, create missing tables and make sure the natural keys that merging relies on are indexed."""
+    conn = connect()
+    ensure_schema(conn)
+    ensure_trip_route(conn)
+    ensure_unique_key(conn, 'trip', TRIP_KEY)
+    ensure_unique_key(conn, 'breadcrumb', BREADCRUMB_KEY)
+    return conn
+
+def process_batch(conn, records, merge=True, executor=None, land=True):
+    """Land, validate, transform and load one batch of breadcrumb records."""
+    df = pd.DataFrame(records)
+    if len(df) == 0:
+        return
+    if land and landing is not None:
+        # Raw records are landed before validation so they can be re-validated later
+        landing.write_breadcrumbs(df)
+    df, rejected, report = gate(df, BREADCRUMB_RULES)
+    print(report)
+    if len(rejected) and quarantine is not None:
+        quarantine.put('breadcrumb', 'validate', rejected)
+    if len(df) == 0:
+        return
+    df_trip, df_breadcrumb = transform(df, executor)
+    copy_to_trip_table(conn, df_trip, merge)
+    if copy_to_breadcrumb_table(conn, df_breadcrumb, merge) == 1:
+        raise RuntimeError("breadcrumb load failed")
+
+def collect_and_process(window, merge=True, executor=None):
+    """Collect messages for one window, then process them all at once."""
+    make_subscriber()
+    streaming_pull_future = subscriber.subscribe(
+        subscription_path, callback=process_message)
+
+    print(f"Listening for messages on {subscription_path}..\n")
+
+    with subscriber:
+        try:
+            streaming_pull_future.result(timeout=window)
+        except TimeoutError:
+            streaming_pull_future.cancel()
+            streaming_pull_future.result()
 
-    # Establish a connection to the database
-    conn = psycopg2.connect(
-        host="localhost",
-        database=DB_name,
-        user=DB_user,
-        password=DB_pwd
-    )
- 
-    def copy_to_trip_table(conn, trip_data):
-        """
-        Here we are going save the dataframe in memory
-        and use copy_from() to copy it to the table
-        """
-        cur = conn.cursor()
-        buffer = StringIO()
-        trip_data_unique = trip_data.drop_duplicates(subset=['trip_id'])
-        trip_data[['trip_id', 'vehicle_id']].to_csv(buffer, sep=',', header=False, index=False)
-        buffer.seek(0)
-        cur.copy_from(buffer, 'trip', sep=',', columns=('trip_id', 'vehicle_id'))
-        conn.commit()
-        print("Trip data copied successfully!")
-
-    def copy_to_breadcrumb_table(conn, breadcrumb_data):
-        """
-        Here we are going save the dataframe in memory
-        and use copy_from() to copy it to the table
-        """
-        buffer = StringIO()
-        breadcrumb_data.to_csv(buffer, index=False, header=False)
-        buffer.seek(0)
-
-        cursor = conn.cursor()
+    if json_list:
+        conn = connect_for_merge() if merge else connect()
         try:
-            cursor.copy_from(buffer, 'breadcrumb', sep=",")
-            conn.commit()
-        except (Exception, psycopg2.DatabaseError) as error:
-            print("Error: %s" % error)
-            conn.rollback()
-            cursor.close()
-            return 1
-        print("Loading of breadcrumb table completed")
-        cursor.close()
-
-    copy_to_trip_table(conn, df_trip)
-    copy_to_breadcrumb_table(conn, df_breadcrumb)
+            process_batch(conn, json_list, merge, executor)
+        except Exception as error:
+            # The messages are already acked; without a quarantine the batch is lost
+            if quarantine is None:
+                raise
+            quarantine.put('breadcrumb', 'batch', json_list, reason=f"{type(error).__name__}: {error}")
+        finally:
+            conn.close()
+
+def replay_quarantine(merge=True, executor=None):
+    """Run quarantined breadcrumbs through validation and load again.
+
+    Raw records (rejected by validation, or from a failed batch) go through
+    the whole batch path; rows the database refused are loaded again as they
+    are. Every entry is marked replayed; rows that still fail, and entries
+    whose replay raises, are quarantined again as new entries.
+    """
+    conn = connect_for_merge() if merge else connect()
+
+    def replay_entry(entry, rows):
+        print(f"Replaying {len(rows)} rows quarantined at {entry.stage}")
+        if entry.stage == 'load_trip':
+            copy_to_trip_table(conn, rows, merge)
+        elif entry.stage == 'load_breadcrumb':
+            rows = rows.assign(tstamp=pd.to_datetime(rows['tstamp']))
+            if copy_to_breadcrumb_table(conn, rows, merge) == 1:
+                raise RuntimeError("breadcrumb load failed")
+        else:
+            process_batch(conn, rows, merge, executor, land=False)
 
+    try:
+        replayed, failed = replay(quarantine, 'breadcrumb', replay_entry,
+                                  transient=(psycopg2.OperationalError, psycopg2.InterfaceError))
+    finally:
+        conn.close()
+    print(f"Replayed {replayed} quarantined rows, {failed} entries failed and were quarantined again")
+
+def backfill(service_dates, merge=True, executor=None):
+    """Reload service dates from the landing zone instead of replaying Pub/Sub."""
+    conn = connect_for_merge() if merge else connect()
+    try:
+        for service_date in service_dates:
+            df = landing.breadcrumbs(service_date=service_date).drop(columns=['service_date', 'vehicle'])
+            print(f"Backfilling {len(df)} breadcrumbs for {service_date} from {landing.root}")
+            process_batch(conn, df, merge, executor, land=False)
+    finally:
+        conn.close()
+
+def stream(max_rows, max_age, max_messages, merge=True, executor=None):
+    """Load breadcrumbs continuously in micro-batches, acking each batch after it commits."""
+    pubsub_v1 = make_subscriber()
+    conn = connect_for_merge() if merge else connect()
+    # A batch that fails for any reason but a lost connection is quarantined and acked
+    dead_letter = None
+    if quarantine is not None:
+        def dead_letter(records, reason):
+            quarantine.put('breadcrumb', 'batch', records, reason=reason)
+    batcher = MicroBatcher(lambda records: process_batch(conn, records, merge, executor),
+                           max_rows=max_rows, max_age=max_age, dead_letter=dead_letter,
+                           transient=(psycopg2.OperationalError, psycopg2.InterfaceError))
+    # Unacked messages count against flow control, so this also bounds memory
+    flow_control = pubsub_v1.types.FlowControl(max_messages=max_messages)
+    streaming_pull_future = subscriber.subscribe(
+        subscription_path, callback=batcher.add, flow_control=flow_control)
+
+    print(f"Streaming messages from {subscription_path} "
+          f"(flush every {max_rows} rows or {max_age}s)..\n")
+
+    with subscriber:
+        try:
+            streaming_pull_future.result()
+        except KeyboardInterrupt:
+            streaming_pull_future.cancel()
+            streaming_pull_future.result()
+        finally:
+            batcher.close()
+            conn.close()
+    print(f"Loaded {batcher.flushed_rows} rows in {batcher.flushed_batches} batches, "
+          f"{batcher.failed_batches} batches failed, {batcher.dead_lettered_batches} quarantined")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load TriMet breadcrumbs from Pub/Sub into Postgres.")
+    parser.add_argument('--stream', action='store_true',
+                        help="run continuously, flushing micro-batches")
+    parser.add_argument('--window', type=float, default=60.0,
+                        help="seconds to collect before processing when not streaming")
+    parser.add_argument('--max-rows', type=int, default=5000,
+                        help="rows per micro-batch in streaming mode")
+    parser.add_argument('--max-age', type=float, default=5.0,
+                        help="seconds before a partial micro-batch is flushed")
+    parser.add_argument('--max-messages', type=int, default=10000,
+                        help="unacked messages held before pulling pauses")
+    parser.add_argument('--append', action='store_true',
+                        help="plain COPY without skipping rows already loaded")
+    parser.add_argument('--landing', default=os.environ.get('BUSDATA_LANDING'),
+                        help="Parquet landing zone for raw batches (default $BUSDATA_LANDING)")
+    parser.add_argument('--backfill', nargs='+', metavar='SERVICE_DATE',
+                        help="load these dates (YYYY-MM-DD) from the landing zone and exit")
+    parser.add_argument('--quarantine', default=os.environ.get('BUSDATA_QUARANTINE'),
+                        help="directory, or 'postgres' for the quarantine table, that keeps "
+                             "rejected rows and failed batches (default $BUSDATA_QUARANTINE)")
+    parser.add_argument('--replay-quarantine', action='store_true',
+                        help="validate and load the quarantined breadcrumbs again and exit")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes for the transform stage of large batches "
+                             "(default 1: transform in-process)")
+    parser.add_argument('--refresh-interval', type=float, default=300.0,
+                        help="seconds between trip_stop refreshes of the dates the loaded trips join "
+                             "(not used with --append)")
+    parser.add_argument('--metrics', default=os.environ.get('BUSDATA_METRICS', ''),
+                        help="serve stage metrics on :PORT or dump them to a JSON file "
+                             "(default $BUSDATA_METRICS)")
+    args = parser.parse_args()
+    metrics.configure(args.metrics)
+
+    merge = not args.append
+    global landing
+    if args.landing:
+        from pipeline.landing import LandingZone
+        landing = LandingZone(args.landing)
+    elif args.backfill:
+        parser.error("--backfill needs --landing or $BUSDATA_LANDING")
+    global quarantine
+    quarantine = open_quarantine(args.quarantine, connect)
+    if args.replay_quarantine and quarantine is None:
+        parser.error("--replay-quarantine needs --quarantine or $BUSDATA_QUARANTINE")
+
+    global workers
+    workers = max(1, args.workers)
+    # Pickling shards costs more than it saves on one core, so the pool is only started on request
+    pool = transform_pool(workers) if workers > 1 else contextlib.nullcontext()
+    global trip_stop
+    # Append-only loads do not maintain trip_stop, so they need no refresher or its connection
+    if merge:
+        trip_stop = TripStopRefresher(connect_for_merge, args.refresh_interval)
+    try:
+        with pool as executor:
+            if args.replay_quarantine:
+                replay_quarantine(merge, executor)
+            elif args.backfill:
+                backfill(args.backfill, merge, executor)
+            elif args.stream:
+                stream(args.max_rows, args.max_age, args.max_messages, merge, executor)
+            else:
+                collect_and_process(args.window, merge, executor)
+    finally:
+        if trip_stop is not None:
+            trip_stop.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,148 @@
+import argparse
+import os
+import sys
 import urllib.request
 import json
-from google.cloud import pubsub_v1
-
-# GCP Configuration
-project_id = 'scientific-pad-420219'
-topic_id = 'project_topic'
-
-# Publisher client
-publisher = pubsub_v1.PublisherClient()
-topic_path = publisher.topic_path(project_id, topic_id)
-
-vehicle_ids = [
-        3951, 3235, 3010, 3042, 2919, 4048, 3548, 3750, 3056, 4062,
-        3228, 3320, 4017, 4020, 3023, 3722, 3012, 4041, 3577, 3252,
-        3608, 3241, 3954, 4068, 3749, 3904, 4014, 3950, 4061, 3617,
-        3632, 4203, 3963, 3735, 3229, 4228, 3953, 3316, 3623, 3301,
-        3234, 3007, 3207, 3403, 3538, 4221, 3014, 3232, 3029, 3933,
-        3113, 4050, 3751, 3918, 4021, 3219, 3128, 3732, 3707, 3004,
-        4519, 3558, 3047, 2908, 3609, 3201, 3929, 4508, 3906, 3650,
-        3570, 3118, 4001, 3145, 3258, 3624, 3621, 3054, 3634, 4045,
-        3519, 3757, 3716, 3641, 3739, 3556, 3602, 2904, 3545, 3614,
-        3931, 4037, 3329, 3405, 3744, 3955, 4018, 3743, 3223, 3034
-]
-
-def fetch_and_publish_data(vehicle_id):
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pipeline import config, metrics
+from pipeline.cache import ResponseCache, from_env
+from pipeline.fetch import BASE_URL, Fetcher
+from pipeline.ingest import fleet_stages, ingest, parse_json
+from pipeline.publish import ENCODINGS, BatchPublisher
+
+# GCP Configuration, from the [breadcrumbs] config section or BUSDATA_BREADCRUMBS_* variables
+settings = config.section('breadcrumbs', project_id='scientific-pad-420219', topic_id='project_topic')
+
+topic_path = f"projects/{settings['project_id']}/topics/{settings['topic_id']}"
+
+# Batching publisher, created in main() once the batch settings are known
+publisher = None
+
+# The fleet, or the [vehicles] file and column when one is configured
+vehicles = config.section('vehicles', file='', column='Quest')
+vehicle_ids = config.vehicle_ids(vehicles['file'], vehicles['column'])
+
+def fetch_and_publish_data(vehicle_id, base_url=BASE_URL):
     """Fetch JSON data for a vehicle and publish each record to GCP Pub/Sub."""
-    url = f"https://busdata.cs.pdx.edu/api/getBreadCrumbs?vehicle_id={vehicle_id}"
+    url = f"{base_url}/getBreadCrumbs?vehicle_id={vehicle_id}"
     try:
         with urllib.request.urlopen(url) as response:
             data = json.loads(response.read().decode())
             # Assuming the JSON structure contains a list of records
-            for record in data:
-                publish_to_pubsub(json.dumps(record),vehicle_id)
+            publish_to_pubsub(data, vehicle_id)
             print(f"Processed vehicle ID {vehicle_id}")
     except urllib.error.URLError as e:
         print(f"Failed to fetch data for vehicle ID {vehicle_id}: {e}")
 
-def publish_to_pubsub(message,vehicle_id):
-    """Publish a message to the configured GCP Pub/Sub topic."""
+def publish_to_pubsub(records, vehicle_id):
+    """Queue a vehicle's records on the batching publisher without waiting on each one."""
     try:
-        message_bytes = message.encode('utf-8')
-        future = publisher.publish(topic_path, message_bytes)
-        #print(f"Message published. ID: {future.result()}")
+        publisher.publish_records(records, vehicle_id=vehicle_id)
     except Exception as e:
         print(f"An error occurred while publishing: {e} {vehicle_id}")
 
+def fetch_and_publish_concurrent(vehicle_ids, workers=8, rate=None, base_url=BASE_URL,
+                                 cache=None, replay=False, service_date=None, parse_workers=2,
+                                 encode_workers=1, publish_workers=1, queue_size=None,
+                                 parse_processes=0):
+    """Fetch, parse, encode and publish the fleet as overlapping stages over one pooled session.
+
+    Each stage has its own workers and a bounded queue, so a slow Pub/Sub
+    holds back the fetchers instead of piling up pages in memory.
+    """
+    parse_executor = ProcessPoolExecutor(parse_processes) if parse_processes else None
+    with Fetcher(base_url=base_url, workers=workers, rate=rate, cache=cache,
+                 offline=replay, service_date=service_date) as fetcher:
+        stages = fleet_stages(fetcher, 'getBreadCrumbs', parse_json, publisher,
+                              parse_workers=max(parse_workers, parse_processes),
+                              encode_workers=encode_workers, publish_workers=publish_workers,
+                              queue_size=queue_size, parse_executor=parse_executor)
+        try:
+            failures = ingest(vehicle_ids, stages,
+                              on_result=lambda vehicle_id, _: print(f"Processed vehicle ID {vehicle_id}"))
+        finally:
+            if parse_executor is not None:
+                parse_executor.shutdown()
+    for stage, vehicle_id, error in failures:
+        print(f"Failed to {stage} data for vehicle ID {vehicle_id}: {error}")
+
 def main():
-    for vehicle_id in vehicle_ids:
-        fetch_and_publish_data(vehicle_id)
+    parser = argparse.ArgumentParser(description="Publish TriMet breadcrumbs to Pub/Sub.")
+    parser.add_argument('--workers', type=int, default=8,
+                        help="concurrent fetches (default 8)")
+    parser.add_argument('--parse-workers', type=int, default=2,
+                        help="threads decoding responses (default 2)")
+    parser.add_argument('--parse-processes', type=int, default=0,
+                        help="decode responses in this many processes instead of threads")
+    parser.add_argument('--encode-workers', type=int, default=1,
+                        help="threads encoding messages (default 1)")
+    parser.add_argument('--publish-workers', type=int, default=1,
+                        help="threads handing messages to the Pub/Sub client (default 1)")
+    parser.add_argument('--queue-size', type=int, default=None,
+                        help="vehicles waiting in front of each stage (default twice its workers)")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="max requests per second to the API host")
+    parser.add_argument('--base-url', default=BASE_URL,
+                        help="busdata API root, e.g. a local stub server")
+    parser.add_argument('--sequential', action='store_true',
+                        help="fetch one vehicle at a time with urllib (old behaviour)")
+    parser.add_argument('--pack', type=int, default=1,
+                        help="records packed into each message (default 1)")
+    parser.add_argument('--encoding', choices=ENCODINGS, default='columnar',
+                        help="columnar: one compact message per vehicle (or per --pack "
+                             "records); json: one JSON document per record or ndjson pack")
+    parser.add_argument('--batch-messages', type=int, default=500)
+    parser.add_argument('--batch-bytes', type=int, default=1_000_000)
+    parser.add_argument('--batch-latency', type=float, default=0.05,
+                        help="seconds a batch may wait before it is sent")
+    parser.add_argument('--max-outstanding', type=int, default=1000,
+                        help="messages in flight before publishing blocks")
+    parser.add_argument('--cache-dir',
+                        help="keep raw API responses here (default $BUSDATA_CACHE)")
+    parser.add_argument('--replay', action='store_true',
+                        help="publish from the cache only, without network access")
+    parser.add_argument('--service-date',
+                        help="service date to cache under or replay (default today)")
+    parser.add_argument('--metrics', default=os.environ.get('BUSDATA_METRICS', ''),
+                        help="serve stage metrics on :PORT or dump them to a JSON file "
+                             "(default $BUSDATA_METRICS)")
+    args = parser.parse_args()
+    metrics.configure(args.metrics)
+
+    cache, replay, service_date = from_env()
+    if args.cache_dir:
+        cache = ResponseCache(args.cache_dir)
+    replay = replay or args.replay
+    service_date = args.service_date or service_date
+    if replay and cache is None:
+        parser.error("--replay needs --cache-dir or $BUSDATA_CACHE")
+
+    global publisher
+    publisher = BatchPublisher(topic_path, pack=args.pack, encoding=args.encoding,
+                               max_messages=args.batch_messages,
+                               max_bytes=args.batch_bytes,
+                               max_latency=args.batch_latency,
+                               max_outstanding_messages=args.max_outstanding)
+
+    if args.sequential:
+        for vehicle_id in vehicle_ids:
+            fetch_and_publish_data(vehicle_id, args.base_url)
+    else:
+        # A replay publishes whatever was cached for the day
+        vehicles = cache.vehicles('getBreadCrumbs', service_date) if replay else vehicle_ids
+        fetch_and_publish_concurrent(vehicles, workers=args.workers,
+                                     rate=args.rate, base_url=args.base_url,
+                                     cache=cache, replay=replay, service_date=service_date,
+                                     parse_workers=args.parse_workers,
+                                     encode_workers=args.encode_workers,
+                                     publish_workers=args.publish_workers,
+                                     queue_size=args.queue_size,
+                                     parse_processes=args.parse_processes)
+
+    errors = publisher.drain()
+    print(f"Published {publisher.published} messages, {errors} failed")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,25 @@
+CREATE TABLE trip (
+    trip_id INT PRIMARY KEY,
+    route_id INT,
+    vehicle_id INT,
+    service_key VARCHAR,
+    direction INT
+);
+
+-- One partition per service day, created by the subscriber as it loads each day
+-- (pipeline/schema.py), e.g.
+--   CREATE TABLE breadcrumb_p20221208 PARTITION OF breadcrumb
+--       FOR VALUES FROM ('2022-12-08') TO ('2022-12-09');
+CREATE TABLE breadcrumb (
+    tstamp TIMESTAMP NOT NULL,
+    latitude FLOAT,
+    longitude FLOAT,
+    speed FLOAT,
+    trip_id INT NOT NULL,
+    CONSTRAINT breadcrumb_trip_id_tstamp_key UNIQUE (trip_id, tstamp)
+) PARTITION BY RANGE (tstamp);
+
+CREATE INDEX breadcrumb_tstamp_brin ON breadcrumb USING brin (tstamp);
+-- Finished days get a spatial index for bounding-box queries, e.g.
+--   CREATE INDEX breadcrumb_p20221208_position_gist ON breadcrumb_p20221208
+--       USING gist (point(longitude, latitude));
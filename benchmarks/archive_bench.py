@@ -0,0 +1,76 @@
+"""Compare raw archiving cost: one pretty-printed file per message vs the gzip NDJSON archive.
+
+Feeds synthetic per-vehicle messages through each sink with fake Pub/Sub
+messages and reports records/s, CPU seconds and bytes on disk.
+
+    python benchmarks/archive_bench.py --vehicles 200 --records 2000
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pipeline import wire
+from pipeline.archive import RawArchive
+from pipeline.fakes import FakeMessage
+from pipeline.microbatch import MicroBatcher
+from pipeline.publish import unpack_records
+from pipeline.stub import breadcrumbs
+
+
+def pretty_files(messages, root):
+    """The original callback: decode and rewrite data/{vehicle_id}.json with indent=4."""
+    for message in messages:
+        records = unpack_records(message.data, message.attributes)
+        path = os.path.join(root, f"{message.attributes['vehicle_id']}.json")
+        with open(path, "w") as f:
+            json.dump(records, f, indent=4)
+        message.ack()
+
+
+def archive(messages, root):
+    raw = RawArchive(root)
+    batcher = MicroBatcher(raw.write, max_rows=50000, max_age=5.0)
+    for message in messages:
+        batcher.add(message)
+    batcher.close()
+    raw.close()
+
+
+def disk_bytes(root):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+
+
+def run(name, sink, messages, records):
+    root = tempfile.mkdtemp(prefix='archive_bench_')
+    try:
+        wall, cpu = time.perf_counter(), time.process_time()
+        sink(messages, root)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        print(f"{name:<8} {records / wall:>10.0f} records/s  cpu={cpu:6.2f}s  "
+              f"disk={disk_bytes(root) / 1e6:8.1f} MB")
+    finally:
+        shutil.rmtree(root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vehicles', type=int, default=200)
+    parser.add_argument('--records', type=int, default=2000)
+    args = parser.parse_args()
+
+    messages = []
+    for v in range(args.vehicles):
+        data = wire.encode_records(breadcrumbs(3000 + v, args.records))
+        messages.append(FakeMessage(data, {'vehicle_id': str(3000 + v), 'encoding': wire.ENCODING}))
+    records = args.vehicles * args.records
+    run('pretty', pretty_files, messages, records)
+    run('archive', archive, messages, records)
+
+
+if __name__ == "__main__":
+    main()
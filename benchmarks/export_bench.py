@@ -0,0 +1,126 @@
+"""GeoJSON export of a day of breadcrumbs: whole collection in memory vs streamed in chunks.
+
+Loads a synthetic service day into a scratch schema, then exports it in
+a fresh process per run, so each run's peak RSS is its own: once the way
+tsvscript.py used to (fetch every row, build geojson Features, dump the
+collection) and once through pipeline.export with a server-side cursor.
+The scratch schema is dropped at the end.
+
+    python benchmarks/export_bench.py --dsn "host=localhost dbname=postgres user=postgres" --rows 1000000
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.schema_bench import PLAIN_DDL, synthetic_day
+from pipeline.breadcrumbs import BREADCRUMB_TYPES
+from pipeline.load import copy_dataframe
+
+SCHEMA = 'export_bench'
+QUERY = ("SELECT longitude, latitude, speed::int AS speed FROM breadcrumb "
+         "WHERE tstamp >= %(day)s::date AND tstamp < %(day)s::date + 1")
+
+
+def legacy(dsn, day, out):
+    from geojson import Feature, FeatureCollection, Point
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cursor:
+        cursor.execute(QUERY, {'day': day})
+        rows = cursor.fetchall()
+    conn.close()
+    features = [Feature(geometry=Point((lon, lat)), properties={'speed': speed})
+                for lon, lat, speed in rows]
+    with open(out, 'w') as f:
+        f.write('%s' % FeatureCollection(features))
+    return len(features)
+
+
+def streaming(dsn, day, out, precision, chunk_rows):
+    from pipeline.export import export, query_chunks
+    conn = psycopg2.connect(dsn)
+    with open(out, 'w') as f:
+        count = export(query_chunks(conn, QUERY, {'day': day}, chunk_rows), f, precision=precision)
+    conn.close()
+    return count
+
+
+def child(args):
+    start = time.perf_counter()
+    if args.run == 'legacy':
+        count = legacy(args.dsn, args.day, args.out)
+    else:
+        count = streaming(args.dsn, args.day, args.out, args.precision, args.chunk_rows)
+    elapsed = time.perf_counter() - start
+    print(f"{count} {elapsed} {peak_rss_mb()}")
+
+
+def peak_rss_mb():
+    # ru_maxrss survives exec, so a child spawned by a large parent would
+    # report the parent's size; VmHWM starts afresh with the new image
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dsn', required=True)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--chunk-rows', type=int, default=10_000)
+    parser.add_argument('--precision', type=int, default=None)
+    parser.add_argument('--run', choices=['legacy', 'streaming'], help=argparse.SUPPRESS)
+    parser.add_argument('--day', help=argparse.SUPPRESS)
+    parser.add_argument('--out', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        return child(args)
+
+    day = pd.Timestamp('2022-12-08').date()
+    dsn = f"{args.dsn} options='-csearch_path={SCHEMA}'"
+    conn = psycopg2.connect(args.dsn)
+    out = tempfile.NamedTemporaryFile(suffix='.geojson', delete=False).name
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; "
+                           f"SET search_path TO {SCHEMA}")
+            cursor.execute(PLAIN_DDL)
+        conn.commit()
+        copy_dataframe(conn, 'breadcrumb', synthetic_day(day, args.rows), binary=True,
+                       types=BREADCRUMB_TYPES)
+
+        print(f"{'export':<10} {'features':>10} {'seconds':>8} {'rows/s':>10} {'peak MB':>8} {'file MB':>8}")
+        runs = [('legacy', []),
+                ('streaming', ['--chunk-rows', str(args.chunk_rows)] +
+                 (['--precision', str(args.precision)] if args.precision is not None else []))]
+        for name, extra in runs:
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), '--dsn', dsn,
+                                     '--run', name, '--day', str(day), '--out', out] + extra,
+                                    check=True, capture_output=True, text=True)
+            count, elapsed, peak_mb = result.stdout.split()
+            count, elapsed = int(count), float(elapsed)
+            print(f"{name:<10} {count:>10} {elapsed:>8.2f} {count / elapsed:>10.0f} "
+                  f"{float(peak_mb):>8.0f} {os.path.getsize(out) / 2**20:>8.1f}")
+    finally:
+        os.unlink(out)
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Fleet ingest time, one vehicle at a time vs fetch, parse, encode and publish as overlapping stages.
+
+Runs against pipeline.stub (as a subprocess, with --stub-latency seconds
+added to every request) and the in-process FakePublisherClient (with
+--publish-latency per batch and --message-limit messages in flight).
+For each --fleet size it times:
+
+  network     the fetches alone, --workers at a time
+  cpu         parse and encode of the fetched pages alone, on one thread
+  sequential  fetch, parse, encode and publish per vehicle, in turn
+  staged      pipeline.ingest with the given per-stage workers
+
+Staged should come close to max(network, cpu) rather than their sum.
+"peak held" is the most vehicles fetched but not yet published at once,
+which bounded queues keep flat however large the fleet. Run with a slow
+publisher (--publish-latency 0.2 --message-limit 20) to see backpressure
+hold the fetchers back.
+
+    python benchmarks/ingest_bench.py --fleet 100 500 --endpoint stopevents --stub-latency 0.05
+"""
+import argparse
+import functools
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from benchmarks.serve_bench import free_port
+from pipeline.fakes import FakePublisherClient
+from pipeline.fetch import Fetcher
+from pipeline.ingest import fleet_stages, ingest, parse_json, parse_stop_events_page
+from pipeline.publish import BatchPublisher
+
+SERVICE_DATE = '2022-12-08'
+
+ENDPOINTS = {
+    'breadcrumbs': ('getBreadCrumbs', 'vehicle_id', parse_json),
+    'stopevents': ('getStopEvents', 'vehicle_num',
+                   functools.partial(parse_stop_events_page, date=SERVICE_DATE)),
+}
+
+
+def start_stub(records, latency):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, '-m', 'pipeline.stub', '--port', str(port),
+                                '--records', str(records), '--latency', str(latency)],
+                               cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    process.stdout.readline()
+    return process, f"http://127.0.0.1:{port}/api"
+
+
+def make_publisher(args):
+    client = FakePublisherClient(latency=args.publish_latency, message_limit=args.message_limit)
+    return BatchPublisher('projects/bench/topics/bench', client=client, encoding=args.encoding)
+
+
+def network(args, base_url, endpoint, param, vehicles):
+    start = time.perf_counter()
+    pages = {}
+    with Fetcher(base_url=base_url, workers=args.workers) as fetcher:
+        for vehicle, content in fetcher.fetch_many(endpoint, vehicles, param=param, as_json=False):
+            pages[vehicle] = content.encode('utf-8')
+    return time.perf_counter() - start, pages
+
+
+def cpu(args, parse, pages, param):
+    publisher = make_publisher(args)
+    start = time.perf_counter()
+    for vehicle, content in pages.items():
+        publisher.encode_records(parse(vehicle, content), **{param: vehicle})
+    return time.perf_counter() - start
+
+
+def sequential(args, base_url, endpoint, param, parse, vehicles):
+    publisher = make_publisher(args)
+    start = time.perf_counter()
+    with Fetcher(base_url=base_url, workers=1) as fetcher:
+        for vehicle in vehicles:
+            records = parse(vehicle, fetcher.get_bytes(endpoint, {param: vehicle}))
+            publisher.publish_records(records, **{param: vehicle})
+    publisher.drain()
+    return time.perf_counter() - start, publisher.published
+
+
+def staged(args, base_url, endpoint, param, parse, vehicles):
+    publisher = make_publisher(args)
+    held = {'now': 0, 'peak': 0}
+    lock = threading.Lock()
+    parse_executor = ProcessPoolExecutor(args.parse_processes) if args.parse_processes else None
+    start = time.perf_counter()
+    with Fetcher(base_url=base_url, workers=args.workers) as fetcher:
+        stages = fleet_stages(fetcher, endpoint, parse, publisher, param=param,
+                              parse_workers=max(args.parse_workers, args.parse_processes),
+                              encode_workers=args.encode_workers,
+                              publish_workers=args.publish_workers,
+                              queue_size=args.queue_size, parse_executor=parse_executor)
+        fetch = stages[0].func
+
+        def counted_fetch(key, payload):
+            content = fetch(key, payload)
+            with lock:
+                held['now'] += 1
+                held['peak'] = max(held['peak'], held['now'])
+            return content
+
+        def published(key, payload):
+            with lock:
+                held['now'] -= 1
+
+        stages[0].func = counted_fetch
+        failures = ingest(vehicles, stages, on_result=published)
+    publisher.drain()
+    elapsed = time.perf_counter() - start
+    if parse_executor is not None:
+        parse_executor.shutdown()
+    return elapsed, publisher.published, held['peak'], failures, stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fleet', type=int, nargs='+', default=[100])
+    parser.add_argument('--records', type=int, default=500, help="records per vehicle from the stub")
+    parser.add_argument('--endpoint', choices=ENDPOINTS, default='breadcrumbs')
+    parser.add_argument('--encoding', choices=('json', 'columnar'), default='columnar')
+    parser.add_argument('--stub-latency', type=float, default=0.02, help="seconds added to each request")
+    parser.add_argument('--publish-latency', type=float, default=0.01, help="seconds per published batch")
+    parser.add_argument('--message-limit', type=int, default=1000, help="publisher flow control")
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--parse-workers', type=int, default=2)
+    parser.add_argument('--parse-processes', type=int, default=0)
+    parser.add_argument('--encode-workers', type=int, default=1)
+    parser.add_argument('--publish-workers', type=int, default=1)
+    parser.add_argument('--queue-size', type=int, default=None)
+    parser.add_argument('--skip-sequential', action='store_true', help="sequential takes fleet * latency")
+    args = parser.parse_args()
+
+    endpoint, param, parse = ENDPOINTS[args.endpoint]
+    stub, base_url = start_stub(args.records, args.stub_latency)
+    try:
+        print(f"{'fleet':>6} {'network s':>10} {'cpu s':>8} {'sequential s':>13} {'staged s':>9} "
+              f"{'max(n,c) s':>11} {'n+c s':>7} {'peak held':>10}")
+        for fleet in args.fleet:
+            vehicles = list(range(3000, 3000 + fleet))
+            net, pages = network(args, base_url, endpoint, param, vehicles)
+            cpu_s = cpu(args, parse, pages, param)
+            seq = float('nan')
+            if not args.skip_sequential:
+                seq, _ = sequential(args, base_url, endpoint, param, parse, vehicles)
+            elapsed, published, peak, failures, stages = staged(args, base_url, endpoint, param,
+                                                                parse, vehicles)
+            print(f"{fleet:>6} {net:>10.2f} {cpu_s:>8.2f} {seq:>13.2f} {elapsed:>9.2f} "
+                  f"{max(net, cpu_s):>11.2f} {net + cpu_s:>7.2f} {peak:>10}")
+            for stage in stages:
+                print(f"{'':>6} {stage!r}")
+            if failures:
+                print(f"{'':>6} {len(failures)} vehicles failed, first: {failures[0]}")
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == "__main__":
+    main()
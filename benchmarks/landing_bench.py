@@ -0,0 +1,57 @@
+"""Write a synthetic day to the Parquet landing zone and time filtered, projected reads.
+
+    python benchmarks/landing_bench.py --rows 2000000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.transform_bench import synthetic_day
+from pipeline.landing import LandingZone
+
+
+def timed(name, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {elapsed:8.3f}s {len(result):>10} rows")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--batches', type=int, default=10,
+                        help="write the day as this many subscriber batches")
+    args = parser.parse_args()
+
+    df = synthetic_day(args.rows)
+    root = tempfile.mkdtemp(prefix='landing_bench_')
+    try:
+        zone = LandingZone(root)
+        step = -(-len(df) // args.batches)
+        start = time.perf_counter()
+        for offset in range(0, len(df), step):
+            zone.write_breadcrumbs(df.iloc[offset:offset + step])
+        elapsed = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+        print(f"{'write':<28} {elapsed:8.3f}s {len(df) / elapsed:>10.0f} rows/s {size / 1e6:.1f} MB")
+
+        timed('full scan', lambda: zone.breadcrumbs())
+        timed('one vehicle', lambda: zone.breadcrumbs(vehicle=3042))
+        trip = int(df['EVENT_NO_TRIP'].iloc[0])
+        timed('one trip', lambda: zone.breadcrumbs(trip=trip))
+        timed('bbox, 3 columns', lambda: zone.breadcrumbs(
+            ['GPS_LONGITUDE', 'GPS_LATITUDE', 'EVENT_NO_TRIP'], bbox=(-122.7, 45.4, -122.65, 45.45)))
+        timed('compact', lambda: [None] * zone.compact('breadcrumbs'))
+        timed('one trip after compact', lambda: zone.breadcrumbs(trip=trip))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Breadcrumb COPY throughput: one StringIO copy_from vs chunked CSV vs chunked binary.
+
+Needs a scratch Postgres database; the benchmark creates and drops its own table.
+
+    python benchmarks/load_bench.py --dsn "host=localhost dbname=postgres user=postgres" --rows 1000000
+"""
+import argparse
+import os
+import sys
+import time
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pipeline.breadcrumbs import BREADCRUMB_TYPES
+from pipeline.load import copy_dataframe
+
+TABLE = 'bench_breadcrumb'
+
+
+def synthetic_breadcrumbs(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'tstamp': pd.Timestamp('2022-12-08') + pd.to_timedelta(rng.integers(14000, 90000, rows), unit='s'),
+        'latitude': 45.4 + rng.random(rows) / 5,
+        'longitude': -122.7 + rng.random(rows) / 5,
+        'speed': rng.random(rows) * 25,
+        'trip_id': 230000000 + rng.integers(0, 4000, rows),
+    })
+
+
+def stringio_copy(conn, df):
+    """The original single-buffer load."""
+    buffer = StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    with conn.cursor() as cursor:
+        cursor.copy_from(buffer, TABLE, sep=",")
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dsn', required=True)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--chunk-rows', type=int, default=50_000)
+    args = parser.parse_args()
+
+    df = synthetic_breadcrumbs(args.rows)
+    conn = psycopg2.connect(args.dsn)
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cursor.execute(f"CREATE UNLOGGED TABLE {TABLE} (tstamp timestamp, latitude double precision, "
+                       "longitude double precision, speed double precision, trip_id integer)")
+    conn.commit()
+
+    def truncate():
+        with conn.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {TABLE}")
+        conn.commit()
+
+    start = time.perf_counter()
+    stringio_copy(conn, df)
+    elapsed = time.perf_counter() - start
+    print(f"{'stringio':<8} {args.rows / elapsed:>10.0f} rows/s")
+    for name, binary in (('csv', False), ('binary', True)):
+        truncate()
+        result = copy_dataframe(conn, TABLE, df, chunk_rows=args.chunk_rows,
+                                binary=binary, types=BREADCRUMB_TYPES)
+        print(f"{name:<8} {result.rows_per_second:>10.0f} rows/s  ({result})")
+
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE {TABLE}")
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Cost of pipeline.metrics instrumentation, switched off and on.
+
+Times a bare timer-and-count call, then the two hottest instrumented
+paths: publishing one message per vehicle to a fake Pub/Sub client, and
+receiving single-record messages through MicroBatcher. Each runs with
+metrics off (the default) and on, and the Prometheus text is printed at
+the end so the output can be eyeballed.
+
+    python benchmarks/metrics_bench.py --calls 200000 --messages 50000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pipeline import metrics
+from pipeline.fakes import FakeMessage, FakePublisherClient
+from pipeline.microbatch import MicroBatcher
+from pipeline.publish import BatchPublisher
+
+RECORD = {'EVENT_NO_TRIP': 230416107, 'EVENT_NO_STOP': 230416109, 'OPD_DATE': '08DEC2022:00:00:00',
+          'VEHICLE_ID': 3951, 'METERS': 31, 'ACT_TIME': 16200, 'GPS_LONGITUDE': -122.57,
+          'GPS_LATITUDE': 45.51, 'GPS_SATELLITES': 12.0, 'GPS_HDOP': 0.8}
+
+
+def bare(calls):
+    for _ in range(calls):
+        with metrics.timer('bench'):
+            pass
+        metrics.count('bench', rows=1, messages=1, nbytes=100)
+
+
+def publish(messages):
+    publisher = BatchPublisher('projects/bench/topics/bench', client=FakePublisherClient())
+    data = json.dumps(RECORD).encode()
+    for _ in range(messages):
+        publisher.publish(data)
+    publisher.drain()
+
+
+def receive(messages):
+    batcher = MicroBatcher(lambda records: None, max_rows=5000, max_age=60)
+    data = json.dumps(RECORD).encode()
+    for i in range(messages):
+        batcher.add(FakeMessage(data, message_id=str(i)))
+    batcher.close()
+
+
+def timed(func, n):
+    start = time.perf_counter()
+    func(n)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=200_000)
+    parser.add_argument('--messages', type=int, default=50_000)
+    args = parser.parse_args()
+
+    cases = [('timer + count', bare, args.calls), ('publish', publish, args.messages),
+             ('microbatch receive', receive, args.messages)]
+    off = {name: timed(func, n) for name, func, n in cases}
+    metrics.registry = metrics.Registry()
+    on = {name: timed(func, n) for name, func, n in cases}
+
+    print(f"{'path':<20} {'off us/call':>12} {'on us/call':>12} {'added us':>9}")
+    for name, _, _ in cases:
+        print(f"{name:<20} {off[name]:>12.2f} {on[name]:>12.2f} {on[name] - off[name]:>9.2f}")
+    print()
+    print(metrics.registry.prometheus())
+
+
+if __name__ == "__main__":
+    main()
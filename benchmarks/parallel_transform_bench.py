@@ -0,0 +1,66 @@
+"""Time the breadcrumb transform in-process vs sharded by trip across a process pool.
+
+Checks that every pooled run produces exactly the single-process result,
+and reports how many speeds the old global backfill took from another trip.
+Each worker count is timed twice. The first run allocates the shared memory
+blocks and the second reuses them, as every batch after the first does in
+the subscriber. "ideal" is the in-process time divided by min(workers, cores).
+
+    python benchmarks/parallel_transform_bench.py --rows 2000000 --workers 1 2 4 8
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.transform_bench import synthetic_day
+from pipeline.breadcrumbs import add_timestamp, parallel_transform, transform, transform_pool
+
+
+def global_bfill_speed(df):
+    """SPEED as the original subscriber computed it, backfilled across trips."""
+    df = df.copy()
+    add_timestamp(df)
+    df = df.sort_values(['EVENT_NO_TRIP', 'TIMESTAMP'], kind='stable')
+    grouped = df.groupby('EVENT_NO_TRIP')
+    speed = grouped['METERS'].diff() / grouped['ACT_TIME'].diff()
+    return speed.bfill().clip(lower=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    df = synthetic_day(args.rows)
+    start = time.perf_counter()
+    trips, breadcrumbs = transform(df)
+    baseline = time.perf_counter() - start
+    print(f"in-process  {baseline:8.3f}s {len(df) / baseline:>12.0f} rows/s")
+
+    leaked = (global_bfill_speed(df) != breadcrumbs['speed']).sum()
+    print(f"global bfill: {leaked} speeds differ from per-trip backfill")
+
+    cores = os.cpu_count() or 1
+    for workers in args.workers:
+        with transform_pool(workers) as executor:
+            # Start the workers before timing
+            list(executor.map(abs, range(workers)))
+            times = []
+            for _ in range(2):
+                start = time.perf_counter()
+                pooled = parallel_transform(df, executor=executor, workers=workers, min_rows=0)
+                times.append(time.perf_counter() - start)
+        pd.testing.assert_frame_equal(pooled[0], trips)
+        pd.testing.assert_frame_equal(pooled[1], breadcrumbs)
+        first, elapsed = times
+        print(f"workers={workers:<3} {elapsed:8.3f}s {len(df) / elapsed:>12.0f} rows/s "
+              f"speedup {baseline / elapsed:5.2f}x  ideal {baseline / min(workers, cores):6.3f}s  "
+              f"first run {first:6.3f}s  identical")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""End-to-end pipeline benchmark: stub API -> fetch -> publish -> subscribe -> validate -> transform -> load.
+
+Runs the breadcrumb and stop-event paths the way the publishers and
+subscribers do, against local stand-ins: pipeline.stub (as a subprocess)
+for the busdata API, the in-process FakePublisherClient for Pub/Sub, and
+a scratch schema in a local Postgres for the load (skipped without
+--dsn). The stub generates --records breadcrumbs and stop events per
+vehicle, deterministically per vehicle number, for each --fleet size.
+
+The publisher side runs fetch and publish per vehicle as payloads arrive;
+fetch time is the time spent waiting for the next page.
+The subscriber side unpacks the published messages and processes them in
+batches of --batch-rows, as ProjectSubscriber and stopeventsubscriber do.
+For every stage it reports rows, rows/s of time spent in that stage,
+p50/p99 latency per call (per request for fetch, per vehicle for parse
+and publish, per message for subscribe, per batch for the rest), and
+peak RSS while in the stage.
+
+--save NAME writes the results to benchmarks/baselines/NAME.json.
+--compare NAME prints the change against that baseline and exits 1 when
+a stage's throughput drops, or its peak RSS grows, by more than
+--tolerance. Small fleets finish in seconds and vary by tens of percent
+from run to run; compare at 1000 vehicles or more. Baselines are
+specific to the machine they were recorded on.
+
+    python benchmarks/pipeline_bench.py --fleet 100 1000 --dsn "host=localhost dbname=postgres user=postgres" --save main
+    python benchmarks/pipeline_bench.py --fleet 100 1000 --dsn "..." --compare main
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from benchmarks.serve_bench import free_port
+from pipeline.breadcrumbs import (BREADCRUMB_KEY, BREADCRUMB_RULES, BREADCRUMB_TYPES,
+                                  TRIP_KEY, TRIP_TYPES, parallel_transform, transform_pool)
+from pipeline.fakes import FakeMessage, FakePublisherClient
+from pipeline.fetch import Fetcher
+from pipeline.load import copy_dataframe
+from pipeline.publish import BatchPublisher, unpack_records
+from pipeline.stopevents import (STOPEVENT_COLUMNS, STOPEVENT_KEY, STOPEVENT_RULES, TABLE_COLUMNS,
+                                 parse_stop_events, to_records)
+from pipeline.validation import gate
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+SCHEMA = 'pipeline_bench'
+SERVICE_DATE = '2022-12-08'
+
+
+def reset_peak_rss():
+    """Restart the VmHWM high-water mark (Linux); elsewhere peaks only ever grow."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Stage:
+    """Time, rows, per-call latencies and peak RSS accumulated over a stage's calls."""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.seconds = 0.0
+        self.latencies = []
+        self.peak_mb = 0.0
+
+    @contextlib.contextmanager
+    def measure(self, latency=True):
+        reset_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            self.seconds += elapsed
+            if latency:
+                self.latencies.append(elapsed)
+            self.peak_mb = max(self.peak_mb, peak_rss_mb())
+
+    def result(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+        return {'rows': self.rows, 'seconds': round(self.seconds, 4),
+                'rows_per_second': round(self.rows / self.seconds, 1) if self.seconds else 0.0,
+                'p50_ms': round(percentile(0.5), 3), 'p99_ms': round(percentile(0.99), 3),
+                'calls': len(latencies), 'peak_mb': round(self.peak_mb, 1)}
+
+
+class TimedFetcher(Fetcher):
+    """Fetcher that records the latency of every page it gets."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+        self._latency_lock = threading.Lock()
+
+    def get(self, endpoint, params, as_json=True):
+        start = time.perf_counter()
+        try:
+            return super().get(endpoint, params, as_json)
+        finally:
+            with self._latency_lock:
+                self.latencies.append(time.perf_counter() - start)
+
+
+def start_stub(records):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, '-m', 'pipeline.stub', '--port', str(port),
+                                '--records', str(records)],
+                               cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    process.stdout.readline()
+    return process, f"http://127.0.0.1:{port}/api"
+
+
+def publish_side(stages, fetcher, client, endpoint, vehicles, param, as_json, encoding):
+    """Fetch every vehicle and publish its records; returns the published messages."""
+    fetch, publish = stages['fetch'], stages['publish']
+    parse = stages.get('parse')
+    publisher = BatchPublisher('projects/bench/topics/bench', client=client, encoding=encoding)
+    pages = fetcher.fetch_many(endpoint, vehicles, param=param, as_json=as_json)
+    while True:
+        with fetch.measure(latency=False):
+            item = next(pages, None)
+        if item is None:
+            break
+        vehicle, payload = item
+        if payload is None:
+            continue
+        if parse is not None:
+            with parse.measure():
+                payload = to_records(parse_stop_events(payload, SERVICE_DATE))
+                parse.rows += len(payload)
+        fetch.rows += len(payload)
+        with publish.measure():
+            publisher.publish_records(payload, vehicle=vehicle)
+            publish.rows += len(payload)
+    with publish.measure(latency=False):
+        publisher.drain()
+    fetch.latencies = list(fetcher.latencies)
+    fetcher.latencies.clear()
+    messages, client.messages = client.messages, []
+    return messages
+
+
+def batches(stages, messages, batch_rows):
+    """Unpack messages as a subscriber callback would, yielding lists of batch_rows records."""
+    subscribe = stages['subscribe']
+    records = []
+    for data, attributes in messages:
+        message = FakeMessage(data, attributes)
+        with subscribe.measure():
+            records.extend(unpack_records(message.data, message.attributes))
+            message.ack()
+        if len(records) >= batch_rows:
+            yield records
+            records = []
+    if records:
+        yield records
+
+
+def breadcrumb_batch(stages, records, conn, executor, workers):
+    with stages['subscribe'].measure(latency=False):
+        df = pd.DataFrame(records)
+        stages['subscribe'].rows += len(df)
+    with stages['validate'].measure() as stage:
+        df, rejected, report = gate(df, BREADCRUMB_RULES)
+        stage.rows += len(df) + len(rejected)
+    with stages['transform'].measure() as stage:
+        trips, breadcrumbs = parallel_transform(df, executor=executor, workers=workers)
+        stage.rows += len(df)
+    if conn is None:
+        return
+    from pipeline.schema import breadcrumb_days, ensure_partitions
+    with stages['load'].measure() as stage:
+        copy_dataframe(conn, 'trip', trips.drop_duplicates(subset=['trip_id'])[['trip_id', 'vehicle_id']],
+                       binary=True, types=TRIP_TYPES, merge_key=TRIP_KEY)
+        ensure_partitions(conn, breadcrumb_days(breadcrumbs))
+        copy_dataframe(conn, 'breadcrumb', breadcrumbs, binary=True, types=BREADCRUMB_TYPES,
+                       merge_key=BREADCRUMB_KEY)
+        stage.rows += len(breadcrumbs)
+
+
+def stopevent_batch(stages, records, conn):
+    with stages['subscribe'].measure(latency=False):
+        df = pd.DataFrame(records)
+        stages['subscribe'].rows += len(df)
+    with stages['validate'].measure() as stage:
+        df, rejected, report = gate(df, STOPEVENT_RULES)
+        stage.rows += len(df) + len(rejected)
+    if conn is None:
+        return
+    from pipeline.views import refresh_trip_stop
+    with stages['load'].measure() as stage:
+        copy_dataframe(conn, 'stopevent', df[STOPEVENT_COLUMNS].rename(columns=TABLE_COLUMNS),
+                       merge_key=STOPEVENT_KEY)
+        refresh_trip_stop(conn, df['date'].unique())
+        stage.rows += len(df)
+
+
+def connect(dsn):
+    import psycopg2
+    from pipeline.schema import ensure_schema
+    from pipeline.views import ensure_trip_stop
+
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; "
+                       f"SET search_path TO {SCHEMA}")
+    conn.commit()
+    ensure_schema(conn)
+    ensure_trip_stop(conn)
+    return conn
+
+
+def drop_schema(conn):
+    conn.rollback()
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    conn.commit()
+    conn.close()
+
+
+def run_fleet(args, fleet, executor):
+    """Both paths for one fleet size; returns {stage name: result}."""
+    vehicles = list(range(3000, 3000 + fleet))
+    stub, base_url = start_stub(args.records)
+    conn = connect(args.dsn) if args.dsn else None
+    results = {}
+    try:
+        fetcher = TimedFetcher(base_url, workers=args.workers)
+        client = FakePublisherClient(keep=True)
+
+        stages = {name: Stage(name) for name in ('fetch', 'publish', 'subscribe', 'validate',
+                                                 'transform', 'load')}
+        messages = publish_side(stages, fetcher, client, 'getBreadCrumbs', vehicles,
+                                'vehicle_id', True, args.encoding)
+        for records in batches(stages, messages, args.batch_rows):
+            breadcrumb_batch(stages, records, conn, executor, args.transform_workers)
+        del messages
+        results.update({f"breadcrumb {name}": stage.result() for name, stage in stages.items()
+                        if stage.rows or stage.seconds})
+
+        stages = {name: Stage(name) for name in ('fetch', 'parse', 'publish', 'subscribe',
+                                                 'validate', 'load')}
+        messages = publish_side(stages, fetcher, client, 'getStopEvents', vehicles,
+                                'vehicle_num', False, args.encoding)
+        for records in batches(stages, messages, args.batch_rows):
+            stopevent_batch(stages, records, conn)
+        del messages
+        results.update({f"stopevent {name}": stage.result() for name, stage in stages.items()
+                        if stage.rows or stage.seconds})
+        fetcher.close()
+    finally:
+        stub.terminate()
+        stub.wait()
+        if conn is not None:
+            drop_schema(conn)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print results against baseline; returns the regressions found."""
+    regressions = []
+    print(f"\n{'fleet':>6} {'stage':<22} {'rows/s':>11} {'baseline':>11} {'change':>8} "
+          f"{'peak MB':>8} {'baseline':>8}")
+    for fleet, stages in results.items():
+        for name, result in stages.items():
+            before = baseline.get('results', {}).get(fleet, {}).get(name)
+            if before is None:
+                continue
+            change = (result['rows_per_second'] / before['rows_per_second'] - 1
+                      if before['rows_per_second'] else 0.0)
+            flag = ''
+            if change < -tolerance:
+                flag = '  slower'
+            if before['peak_mb'] and result['peak_mb'] > before['peak_mb'] * (1 + tolerance):
+                flag += '  more memory'
+            if flag:
+                regressions.append((fleet, name, flag.strip()))
+            print(f"{fleet:>6} {name:<22} {result['rows_per_second']:>11.0f} "
+                  f"{before['rows_per_second']:>11.0f} {change:>+8.1%} {result['peak_mb']:>8.0f} "
+                  f"{before['peak_mb']:>8.0f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fleet', type=int, nargs='+', default=[100],
+                        help="fleet sizes (vehicles) to run, e.g. 100 1000 5000")
+    parser.add_argument('--records', type=int, default=500,
+                        help="breadcrumbs and stop events per vehicle")
+    parser.add_argument('--dsn', help="Postgres for the load stages; they are skipped without it")
+    parser.add_argument('--workers', type=int, default=8, help="concurrent fetches")
+    parser.add_argument('--transform-workers', type=int, default=1,
+                        help="transform processes, as ProjectSubscriber.py --workers")
+    parser.add_argument('--encoding', default='columnar', choices=['json', 'columnar'])
+    parser.add_argument('--batch-rows', type=int, default=50_000)
+    parser.add_argument('--save', metavar='NAME', help="save results as a baseline")
+    parser.add_argument('--compare', metavar='NAME', help="compare with a saved baseline")
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args()
+
+    results = {}
+    pool = (transform_pool(args.transform_workers) if args.transform_workers > 1
+            else contextlib.nullcontext())
+    with pool as executor:
+        for fleet in args.fleet:
+            start = time.perf_counter()
+            results[str(fleet)] = run_fleet(args, fleet, executor)
+            print(f"\nfleet of {fleet} vehicles, {args.records} records each: "
+                  f"{time.perf_counter() - start:.1f}s")
+            print(f"{'stage':<22} {'rows':>9} {'seconds':>8} {'rows/s':>11} {'p50 ms':>8} "
+                  f"{'p99 ms':>8} {'peak MB':>8}")
+            for name, r in results[str(fleet)].items():
+                print(f"{name:<22} {r['rows']:>9} {r['seconds']:>8.2f} {r['rows_per_second']:>11.0f} "
+                      f"{r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['peak_mb']:>8.0f}")
+
+    document = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(), 'machine': platform.machine(),
+        'cpus': os.cpu_count(), 'records': args.records, 'encoding': args.encoding,
+        'batch_rows': args.batch_rows, 'load': bool(args.dsn), 'results': results,
+    }
+    if args.save:
+        os.makedirs(BASELINES, exist_ok=True)
+        path = os.path.join(BASELINES, f"{args.save}.json")
+        with open(path, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"\nSaved baseline {path}")
+    if args.compare:
+        with open(os.path.join(BASELINES, f"{args.compare}.json")) as f:
+            baseline = json.load(f)
+        if baseline.get('records') != args.records:
+            print(f"warning: baseline used {baseline.get('records')} records per vehicle")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
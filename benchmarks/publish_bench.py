@@ -0,0 +1,68 @@
+"""Measure breadcrumb publish throughput and bytes, one record per message vs packed.
+
+Uses the in-process fake client by default. With PUBSUB_EMULATOR_HOST set
+and --emulator, publishes to a real topic on the Pub/Sub emulator instead.
+
+    python benchmarks/publish_bench.py --vehicles 100 --records 500 --pack 1 100
+    python benchmarks/publish_bench.py --pack 1 --encoding json columnar
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pipeline.fakes import FakePublisherClient
+from pipeline.publish import ENCODINGS, BatchPublisher
+from pipeline.stub import breadcrumbs
+
+
+def run(records_by_vehicle, topic_path, pack, client, encoding='json'):
+    publisher = BatchPublisher(topic_path, client=client, pack=pack, encoding=encoding)
+    start = time.perf_counter()
+    for vehicle_id, records in records_by_vehicle.items():
+        publisher.publish_records(records, vehicle_id=vehicle_id)
+    errors = publisher.drain()
+    elapsed = time.perf_counter() - start
+    total = sum(len(r) for r in records_by_vehicle.values())
+    print(f"{encoding:<9} pack={pack:<5} messages={publisher.published:<8} errors={errors:<3} "
+          f"bytes={publisher.bytes:<11} {total / elapsed:>10.0f} records/s "
+          f"{publisher.published / elapsed:>9.0f} msgs/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vehicles', type=int, default=100)
+    parser.add_argument('--records', type=int, default=500)
+    parser.add_argument('--pack', type=int, nargs='+', default=[1, 50, 500])
+    parser.add_argument('--encoding', nargs='+', choices=ENCODINGS, default=['json'])
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="simulated round trip per batch for the fake client")
+    parser.add_argument('--emulator', action='store_true')
+    parser.add_argument('--project', default='bench-project')
+    parser.add_argument('--topic', default='bench-topic')
+    args = parser.parse_args()
+
+    records_by_vehicle = {3000 + v: breadcrumbs(3000 + v, args.records)
+                          for v in range(args.vehicles)}
+    topic_path = f"projects/{args.project}/topics/{args.topic}"
+    if args.emulator:
+        if 'PUBSUB_EMULATOR_HOST' not in os.environ:
+            parser.error("--emulator needs PUBSUB_EMULATOR_HOST")
+        from google.api_core.exceptions import AlreadyExists
+        from google.cloud import pubsub_v1
+        try:
+            pubsub_v1.PublisherClient().create_topic(name=topic_path)
+        except AlreadyExists:
+            pass
+    for encoding in args.encoding:
+        for pack in args.pack:
+            if args.emulator:
+                client = None
+            else:
+                client = FakePublisherClient(latency=args.latency)
+            run(records_by_vehicle, topic_path, pack, client, encoding)
+
+
+if __name__ == "__main__":
+    main()
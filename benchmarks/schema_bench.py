@@ -0,0 +1,118 @@
+"""Breadcrumb load and query speed as history grows: original table vs partitioned schema.
+
+Loads one synthetic service day at a time into both layouts in a scratch
+schema (the original unindexed table, and the daily-partitioned table from
+pipeline.schema), then times a trip lookup and a one-hour window on the
+latest day and a bounding box over all days. The scratch schema is
+dropped at the end.
+
+    python benchmarks/schema_bench.py --dsn "host=localhost dbname=postgres user=postgres" --days 10
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pipeline.breadcrumbs import BREADCRUMB_KEY, BREADCRUMB_TYPES
+from pipeline.load import copy_dataframe
+from pipeline.schema import BREADCRUMB_DDL, breadcrumb_days, ensure_partitions
+
+SCHEMA = 'schema_bench'
+
+PLAIN_DDL = """
+CREATE TABLE breadcrumb (
+    tstamp TIMESTAMP, latitude FLOAT, longitude FLOAT, speed FLOAT, trip_id INT
+)
+"""
+
+QUERIES = {
+    'trip': "SELECT * FROM breadcrumb WHERE trip_id = %(trip)s",
+    'hour window': "SELECT count(*) FROM breadcrumb WHERE tstamp >= %(start)s AND tstamp < %(end)s",
+    'bbox': "SELECT count(*) FROM breadcrumb WHERE point(longitude, latitude) "
+            "<@ box(point(-122.70, 45.40), point(-122.69, 45.41))",
+}
+
+
+def synthetic_day(day, rows, trips=4000, seed=0):
+    """One service day of breadcrumbs in the breadcrumb table's columns, in arrival order."""
+    rng = np.random.default_rng(seed + day.toordinal())
+    trip = (day.toordinal() % 100000) * 10000 + rng.integers(0, trips, rows)
+    seconds = rng.integers(4 * 3600, 26 * 3600, rows)
+    df = pd.DataFrame({
+        'tstamp': pd.Timestamp(day) + pd.to_timedelta(seconds, unit='s'),
+        'latitude': 45.4 + rng.random(rows) / 5,
+        'longitude': -122.7 + rng.random(rows) / 5,
+        'speed': rng.random(rows) * 25,
+        'trip_id': trip,
+    })
+    df = df.drop_duplicates(subset=['trip_id', 'tstamp'])
+    return df.sort_values('tstamp', kind='stable').reset_index(drop=True)
+
+
+def latency(cursor, sql, params, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dsn', required=True)
+    parser.add_argument('--days', type=int, default=10)
+    parser.add_argument('--rows', type=int, default=200_000, help="breadcrumbs per day")
+    args = parser.parse_args()
+
+    connections = {name: psycopg2.connect(args.dsn) for name in ('original', 'partitioned')}
+    try:
+        for name, conn in connections.items():
+            with conn.cursor() as cursor:
+                cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}_{name}; "
+                               f"SET search_path TO {SCHEMA}_{name}; DROP TABLE IF EXISTS breadcrumb")
+                cursor.execute(PLAIN_DDL if name == 'original' else BREADCRUMB_DDL)
+            conn.commit()
+
+        print(f"{'layout':<12} {'days':>4} {'load rows/s':>12} " +
+              " ".join(f"{q + ' ms':>14}" for q in QUERIES))
+        first = pd.Timestamp('2022-12-01').date()
+        for d in range(args.days):
+            day = first + pd.Timedelta(days=d)
+            df = synthetic_day(day, args.rows)
+            params = {'trip': int(df['trip_id'].iloc[0]),
+                      'start': pd.Timestamp(day) + pd.Timedelta(hours=8),
+                      'end': pd.Timestamp(day) + pd.Timedelta(hours=9)}
+            for name, conn in connections.items():
+                if name == 'partitioned':
+                    ensure_partitions(conn, breadcrumb_days(df))
+                    result = copy_dataframe(conn, 'breadcrumb', df, binary=True,
+                                            types=BREADCRUMB_TYPES, merge_key=BREADCRUMB_KEY)
+                else:
+                    result = copy_dataframe(conn, 'breadcrumb', df, binary=True, types=BREADCRUMB_TYPES)
+                if d + 1 not in (1, args.days) and (d + 1) % 5:
+                    continue
+                with conn.cursor() as cursor:
+                    cursor.execute("ANALYZE breadcrumb")
+                    cells = [latency(cursor, sql, params) for sql in QUERIES.values()]
+                conn.commit()
+                print(f"{name:<12} {d + 1:>4} {result.rows_per_second:>12.0f} " +
+                      " ".join(f"{c:>14.2f}" for c in cells))
+    finally:
+        for name, conn in connections.items():
+            conn.rollback()
+            with conn.cursor() as cursor:
+                cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA}_{name} CASCADE")
+            conn.commit()
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
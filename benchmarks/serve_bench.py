@@ -0,0 +1,171 @@
+"""Load test for the visualization server: the original single-threaded one vs pipeline.server.
+
+Serves a scratch directory holding index.html and a GeoJSON export of a
+synthetic day from each server in turn (as a subprocess), and drives it
+with --clients client processes for --seconds per scenario. Each client
+keeps its connection alive when the server allows it. Reports requests
+per second, p50 and p99 latency, and MB/s on the wire.
+
+Every scenario is requested once before timing, so the threaded
+server's one-off load and compression of a file is not counted.
+The "stalled client" scenario first opens one connection that sends half
+a request line and then waits, as a slow or dead browser would.
+
+    python benchmarks/serve_bench.py --clients 8 --seconds 5 --rows 200000
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from benchmarks.schema_bench import synthetic_day
+
+ORIGINAL = """
+import http.server, os, socketserver, sys
+os.chdir(sys.argv[1])
+with socketserver.TCPServer(("", int(sys.argv[2])), http.server.SimpleHTTPRequestHandler) as httpd:
+    httpd.serve_forever()
+"""
+
+SCENARIOS = {
+    'small file': ('/index.html', {}),
+    'geojson, gzip accepted': ('/day.geojson', {'Accept-Encoding': 'gzip, br'}),
+    'geojson revalidation': ('/day.geojson', {'Accept-Encoding': 'gzip, br', 'If-None-Match': None}),
+    'geojson 1 MB range': ('/day.geojson', {'Range': 'bytes=1048576-2097151'}),
+    'small file, stalled client': ('/index.html', {}),
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(kind, directory, port):
+    if kind == 'original':
+        command = [sys.executable, '-c', ORIGINAL, directory, str(port)]
+    else:
+        command = [sys.executable, '-m', 'pipeline.server', '--directory', directory,
+                   '--port', str(port), '--quiet']
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"{kind} server did not start")
+
+
+def client(port, path, headers, seconds, timeout):
+    """Request path until seconds have passed; returns (latencies, bytes, errors)."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    latencies, received, errors = [], 0, 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            received += len(response.read())
+            if response.status >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    conn.close()
+    return latencies, received, errors
+
+
+def run(port, path, headers, clients, seconds, timeout):
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.starmap(client, [(port, path, headers, seconds, timeout)] * clients)
+    latencies = sorted(l for r in results for l in r[0])
+    received = sum(r[1] for r in results)
+    errors = sum(r[2] for r in results)
+    return latencies, received, errors
+
+
+def warm_up(port, path, headers):
+    """Request path once; returns its ETag."""
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.request('GET', path, headers={k: v for k, v in headers.items() if v is not None})
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    return response.getheader('ETag')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--rows', type=int, default=200_000, help="breadcrumbs in day.geojson")
+    parser.add_argument('--timeout', type=float, default=2, help="client timeout in seconds")
+    parser.add_argument('--servers', nargs='*', default=['original', 'threaded'])
+    args = parser.parse_args()
+
+    from pipeline.export import export
+
+    directory = tempfile.mkdtemp(prefix='serve_bench_')
+    try:
+        shutil.copy(os.path.join(ROOT, 'Project Assignment-3', 'Visualization', 'index.html'), directory)
+        df = synthetic_day(pd.Timestamp('2022-12-08').date(), args.rows)[['longitude', 'latitude', 'speed']]
+        with open(os.path.join(directory, 'day.geojson'), 'w') as f:
+            export([df], f, precision=6)
+        size = os.path.getsize(os.path.join(directory, 'day.geojson'))
+        print(f"day.geojson: {size / 2**20:.1f} MB, {args.clients} clients, {args.seconds:g}s per scenario")
+        print(f"{'server':<9} {'scenario':<28} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+              f"{'MB/s':>8} {'errors':>7}")
+
+        for kind in args.servers:
+            port = free_port()
+            server = start_server(kind, directory, port)
+            try:
+                for name, (path, headers) in SCENARIOS.items():
+                    headers = dict(headers)
+                    tag = warm_up(port, path, headers)
+                    if 'If-None-Match' in headers:
+                        headers['If-None-Match'] = tag or '"none"'
+                    stalled = None
+                    if 'stalled' in name:
+                        stalled = socket.create_connection(('127.0.0.1', port))
+                        stalled.sendall(b'GET /index.ht')
+                    try:
+                        latencies, received, errors = run(port, path, headers, args.clients,
+                                                          args.seconds, args.timeout)
+                    finally:
+                        if stalled is not None:
+                            stalled.close()
+                    if latencies:
+                        p50 = latencies[len(latencies) // 2] * 1000
+                        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+                    else:
+                        p50 = p99 = float('nan')
+                    print(f"{kind:<9} {name:<28} {len(latencies) / args.seconds:>8.0f} {p50:>8.2f} "
+                          f"{p99:>8.2f} {received / args.seconds / 2**20:>8.1f} {errors:>7}")
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Cold start-up time of python -m pipeline and of each command's entry point.
+
+Each case runs in a fresh interpreter, --repeat times, and the median
+wall time is reported next to a bare ``python -c pass``. A command is
+timed by loading its script or module without calling main(), which is
+what every run pays before it does any work. The heavy imports each
+command ends up with are listed, so a stray top-level pandas or
+google.cloud import shows up at once.
+
+    python benchmarks/startup_bench.py --repeat 7
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from pipeline.cli import COMMANDS
+
+HEAVY = ['pandas', 'numpy', 'pyarrow', 'google.cloud.pubsub_v1', 'requests', 'psycopg2']
+
+LOAD = """
+import os, runpy, sys, importlib
+target = {target!r}
+if target.endswith('.py'):
+    runpy.run_path(os.path.join({root!r}, target), run_name='startup')
+else:
+    sys.path.insert(0, {root!r})
+    importlib.import_module(target)
+print(' '.join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+
+def run(args):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable] + args, cwd=ROOT, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"{args} failed: {result.stderr.strip().splitlines()[-1:]}")
+    return elapsed, result.stdout
+
+
+def median(args, repeat):
+    times, output = [], ''
+    for _ in range(repeat):
+        elapsed, output = run(args)
+        times.append(elapsed)
+    return statistics.median(times) * 1000, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    baseline, _ = median(['-c', 'pass'], args.repeat)
+    cases = [('python -c pass', baseline, '')]
+    cli, _ = median(['-m', 'pipeline', '--help'], args.repeat)
+    cases.append(('python -m pipeline --help', cli, ''))
+    for name, (target, _) in COMMANDS.items():
+        ms, output = median(['-c', LOAD.format(target=target, root=ROOT, heavy=HEAVY)], args.repeat)
+        cases.append((name, ms, output.strip().splitlines()[-1] if output.strip() else ''))
+
+    print(f"{'command':<26} {'ms':>8} {'over bare':>10}  heavy imports")
+    for name, ms, heavy in cases:
+        print(f"{name:<26} {ms:>8.1f} {ms - baseline:>10.1f}  {heavy}")
+
+
+if __name__ == "__main__":
+    main()
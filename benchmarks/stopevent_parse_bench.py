@@ -0,0 +1,98 @@
+"""Stop-event page parsing: original BeautifulSoup code vs the pluggable backends.
+
+Checks every backend returns exactly what the original code did, then
+times each one. Pages are the saved fixtures plus synthetic full-size pages;
+pass --pages to use pages saved from the real API instead.
+
+    python benchmarks/stopevent_parse_bench.py --vehicles 10
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pipeline.stopevents import BACKENDS, parse_stop_events, to_records
+from pipeline.stub import stop_events_page
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'getStopEvents_*.html')
+DATE = '2022-12-08'
+
+
+def original_parse(html):
+    """The per-row parsing loop from stopevent publisher.py before the parser module."""
+    soup = BeautifulSoup(html, 'html.parser')
+    tables = soup.find_all('table')
+    messages = []
+    for table in tables:
+        pdx_trip = table.find_previous_sibling('h2').text.split()[-1]
+        for row in table.find_all('tr')[1:]:
+            cells = row.find_all('td')
+            messages.append({
+                'pdx_trip': pdx_trip,
+                'date': DATE,
+                'vehicle_num': cells[0].text,
+                'leave_time': cells[1].text,
+                'train': cells[2].text,
+                'route_number': cells[3].text,
+                'direction': cells[4].text,
+                'service_key': cells[5].text,
+                'trip_number': cells[6].text,
+                'stop_time': cells[7].text,
+                'arrive_time': cells[8].text,
+                'dwell': cells[9].text,
+                'location_id': cells[10].text,
+                'door': cells[11].text,
+                'lift': cells[12].text,
+                'ons': cells[13].text,
+                'offs': cells[14].text,
+                'estimated_load': cells[15].text,
+                'maximum_speed': cells[16].text,
+                'train_mileage': cells[17].text,
+                'pattern_distance': cells[18].text,
+                'location_distance': cells[19].text,
+                'x_coordinate': cells[20].text,
+                'y_coordinate': cells[21].text,
+                'data_source': cells[22].text,
+                'schedule_status': cells[23].text,
+            })
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', nargs='*', help="saved getStopEvents pages")
+    parser.add_argument('--vehicles', type=int, default=3,
+                        help="synthetic full-size pages to add")
+    args = parser.parse_args()
+
+    pages = [open(path).read() for path in (args.pages or glob.glob(FIXTURES))]
+    pages += [stop_events_page(3000 + v, trips=25, stops=80) for v in range(args.vehicles)]
+
+    for page in pages:
+        expected = original_parse(page)
+        for backend in BACKENDS:
+            got = to_records(parse_stop_events(page, date=DATE, backend=backend))
+            assert got == expected, f"{backend} output differs from the original parser"
+    rows = sum(len(original_parse(page)) for page in pages)
+    size = sum(len(page) for page in pages)
+    print(f"{len(pages)} pages, {rows} rows, {size / 1e6:.1f} MB; all backends match the original")
+
+    start = time.perf_counter()
+    for page in pages:
+        original_parse(page)
+    baseline = time.perf_counter() - start
+    print(f"{'original':<9} {baseline:>7.3f}s {rows / baseline:>10.0f} rows/s")
+    for backend in BACKENDS:
+        start = time.perf_counter()
+        for page in pages:
+            parse_stop_events(page, date=DATE, backend=backend)
+        elapsed = time.perf_counter() - start
+        print(f"{backend:<9} {elapsed:>7.3f}s {rows / elapsed:>10.0f} rows/s {baseline / elapsed:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
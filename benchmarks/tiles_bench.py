@@ -0,0 +1,78 @@
+"""Speed-grid tile pyramid: generation time and payload per zoom vs one GeoJSON file.
+
+Bins a synthetic day of breadcrumbs into pipeline.tiles' grid and
+reports, per zoom, how many tiles and cells there are, how long the zoom
+took to encode and store, and the total, mean and largest gzipped
+tile. For comparison it also prints the size of the same rows as the
+single GeoJSON file index.html used to load, plain and gzipped.
+
+    python benchmarks/tiles_bench.py --rows 1000000 --max-zoom 16
+"""
+import argparse
+import gzip
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.schema_bench import synthetic_day
+from pipeline.export import export
+from pipeline.tiles import TileStore, build
+
+
+def chunked(df, rows):
+    for offset in range(0, len(df), rows):
+        yield df.iloc[offset:offset + rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--min-zoom', type=int, default=8)
+    parser.add_argument('--max-zoom', type=int, default=16)
+    parser.add_argument('--chunk-rows', type=int, default=100_000)
+    args = parser.parse_args()
+
+    df = synthetic_day(pd.Timestamp('2022-12-08').date(), args.rows)[['longitude', 'latitude', 'speed']]
+    geojson = io.StringIO()
+    export(chunked(df, args.chunk_rows), geojson, precision=6)
+    raw = geojson.getvalue().encode()
+    print(f"single GeoJSON: {len(df)} features, {len(raw) / 2**20:.1f} MB, "
+          f"{len(gzip.compress(raw, 6)) / 2**20:.1f} MB gzipped")
+    del geojson, raw
+
+    root = tempfile.mkdtemp(prefix='tiles_bench_')
+    try:
+        path = os.path.join(root, 'speed.mbtiles')
+        store = TileStore(path)
+        start = time.perf_counter()
+        stats = build(chunked(df, args.chunk_rows), store, args.min_zoom, args.max_zoom)
+        elapsed = time.perf_counter() - start
+        store.close()
+        binning = elapsed - sum(s['seconds'] for s in stats)
+        print(f"binned {len(df)} rows in {binning:.2f}s ({len(df) / binning:.0f} rows/s), "
+              f"pyramid in {elapsed:.2f}s total")
+
+        db = sqlite3.connect(path)
+        sizes = {z: (mean, largest) for z, mean, largest in db.execute(
+            "SELECT zoom_level, avg(length(tile_data)), max(length(tile_data)) "
+            "FROM tiles GROUP BY zoom_level")}
+        db.close()
+        print(f"{'zoom':>4} {'tiles':>7} {'cells':>9} {'seconds':>8} {'total kB':>10} "
+              f"{'mean kB':>8} {'max kB':>8}")
+        for s in sorted(stats, key=lambda s: s['zoom']):
+            mean, largest = sizes.get(s['zoom'], (0, 0))
+            print(f"{s['zoom']:>4} {s['tiles']:>7} {s['cells']:>9} {s['seconds']:>8.2f} "
+                  f"{s['bytes'] / 1024:>10.1f} {mean / 1024:>8.1f} {largest / 1024:>8.1f}")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Dashboard query latency on the trip/stop join as history grows: plain view vs trip_stop.
+
+Builds trip and stopevent tables in a scratch schema, adds one synthetic
+service day at a time, refreshes trip_stop for just that day, and times
+the same queries against the on-the-fly join and the maintained table.
+The scratch schema is dropped at the end.
+
+    python benchmarks/trip_stop_bench.py --dsn "host=localhost dbname=postgres user=postgres" --days 30
+"""
+import argparse
+import datetime
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pipeline.views import ensure_trip_stop, refresh_trip_stop
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SCHEMA = 'trip_stop_bench'
+
+# The original view, with the join key fixed so that it returns rows at all
+PLAIN_JOIN = """
+    SELECT DISTINCT t.trip_id, t.vehicle_id, s.route_number, s.service_key, s.direction
+    FROM trip t JOIN stopevent s ON s.pdx_trip = t.trip_id
+"""
+
+QUERIES = {
+    'trips on one route, one day': (
+        f"SELECT * FROM ({PLAIN_JOIN} AND s.date = %(day)s) j WHERE route_number = %(route)s",
+        "SELECT * FROM trip_stop WHERE service_date = %(day)s AND route_number = %(route)s"),
+    'trips per route, one day': (
+        f"SELECT route_number, count(*) FROM ({PLAIN_JOIN} AND s.date = %(day)s) j GROUP BY 1",
+        "SELECT route_number, count(*) FROM trip_stop WHERE service_date = %(day)s GROUP BY 1"),
+    'one trip, all history': (
+        f"SELECT * FROM ({PLAIN_JOIN}) j WHERE trip_id = %(trip)s",
+        "SELECT * FROM trip_stop_view WHERE trip_id = %(trip)s"),
+}
+
+
+def read_sql(*path):
+    with open(os.path.join(ROOT, *path)) as f:
+        return f.read()
+
+
+def add_day(cursor, day, service_date, trips, stops):
+    """Insert one service day of trips and stop events, generated server-side."""
+    cursor.execute("""
+        INSERT INTO trip (trip_id, route_id, vehicle_id, service_key, direction)
+        SELECT %(day)s * 100000 + g, 0, 3000 + g %% 400, 'W', g %% 2
+        FROM generate_series(1, %(trips)s) g
+    """, {'day': day, 'trips': trips})
+    cursor.execute("""
+        INSERT INTO stopevent (pdx_trip, date, vehicle_number, route_number, direction,
+                               service_key, trip_number, stop_time, location_id)
+        SELECT %(day)s * 100000 + g, %(date)s, 3000 + g %% 400, g %% 90,
+               g %% 2, 'W', %(day)s * 100000 + g, s * 60, 1000 + s
+        FROM generate_series(1, %(trips)s) g, generate_series(1, %(stops)s) s
+    """, {'day': day, 'date': service_date, 'trips': trips, 'stops': stops})
+
+
+def latency(cursor, sql, params, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dsn', required=True)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--trips', type=int, default=2000, help="trips per service day")
+    parser.add_argument('--stops', type=int, default=40, help="stop events per trip")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; "
+                           f"SET search_path TO {SCHEMA}")
+            cursor.execute(read_sql('Project-2 Assignment', 'trip breadcrumb table.sql'))
+            cursor.execute(read_sql('Project Assignment-3', 'stopevent table.sql'))
+        conn.commit()
+        ensure_trip_stop(conn)
+
+        checkpoints = sorted({1, 7, args.days} | set(range(0, args.days + 1, 30)) - {0})
+        print(f"{'days':>5} {'refresh ms':>10}  " + "  ".join(f"{n:>32}" for n in QUERIES))
+        for day in range(1, args.days + 1):
+            service_date = datetime.date(2022, 1, 1) + datetime.timedelta(days=day)
+            with conn.cursor() as cursor:
+                add_day(cursor, day, service_date, args.trips, args.stops)
+                cursor.execute("ANALYZE trip; ANALYZE stopevent")
+            conn.commit()
+            start = time.perf_counter()
+            refresh_trip_stop(conn, [service_date])
+            refresh_ms = (time.perf_counter() - start) * 1000
+            if day not in checkpoints:
+                continue
+            params = {'day': service_date, 'route': 42, 'trip': day * 100000 + 7}
+            cells = []
+            with conn.cursor() as cursor:
+                cursor.execute("ANALYZE trip_stop")
+                for plain, maintained in QUERIES.values():
+                    cells.append(f"{latency(cursor, plain, params, args.repeat):9.2f} -> "
+                                 f"{latency(cursor, maintained, params, args.repeat):7.2f} ms")
+            print(f"{day:>5} {refresh_ms:>10.1f}  " + "  ".join(f"{c:>32}" for c in cells))
+    finally:
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""Check that validating breadcrumbs scales linearly with the number of rows.
+
+    python benchmarks/validation_bench.py --rows 250000 500000 1000000 2000000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.transform_bench import synthetic_day
+from pipeline.breadcrumbs import BREADCRUMB_RULES
+from pipeline.validation import gate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[250_000, 500_000, 1_000_000])
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        df = synthetic_day(rows)
+        # Sprinkle in some bad rows so the quarantine path is exercised
+        df.loc[df.index[::1000], 'GPS_LATITUDE'] = 123.0
+        start = time.perf_counter()
+        good, rejected, report = gate(df, BREADCRUMB_RULES)
+        elapsed = time.perf_counter() - start
+        print(f"{rows:>9} rows {elapsed:>7.3f}s {rows / elapsed:>11.0f} rows/s "
+              f"{len(rejected):>6} quarantined")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+"""Shared building blocks for the TriMet breadcrumb and stop-event pipeline.
+
+The assignment scripts import from here so that fetching, publishing and
+loading behave the same way no matter which publisher or subscriber runs.
+"""
@@ -0,0 +1,321 @@
+"""Vectorized transforms and validation rules for breadcrumb DataFrames."""
+import atexit
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+
+from pipeline import metrics
+from pipeline.config import OPD_DATE_FORMAT
+from pipeline.validation import Consistent, InRange, Integer, NotNull, PresentPerGroup, Summary, Unique
+
+logger = logging.getLogger(__name__)
+
+# Natural keys that make reloading a batch idempotent
+TRIP_KEY = ('trip_id',)
+BREADCRUMB_KEY = ('trip_id', 'tstamp')
+
+# Postgres column types, for binary COPY
+TRIP_TYPES = {'trip_id': 'integer', 'vehicle_id': 'integer'}
+BREADCRUMB_TYPES = {
+    'tstamp': 'timestamp',
+    'latitude': 'double precision',
+    'longitude': 'double precision',
+    'speed': 'double precision',
+    'trip_id': 'integer',
+}
+
+DAY_TYPES = {0: 'Weekday', 1: 'Weekday', 2: 'Weekday', 3: 'Weekday',
+             4: 'Weekday', 5: 'Weekend', 6: 'Weekend'}
+
+# Service key stored on each trip
+DAY_NAMES = {0: 'Weekday', 1: 'Weekday', 2: 'Weekday', 3: 'Weekday',
+             4: 'Weekday', 5: 'Saturday', 6: 'Sunday'}
+
+
+def parse_opd_date(opd_date):
+    """Parse an OPD_DATE column, running strptime once per distinct value.
+
+    A day of breadcrumbs has millions of rows but only a handful of service
+    dates, so the column is factorized and only the uniques are parsed.
+    A missing OPD_DATE parses to NaT.
+    """
+    codes, uniques = pd.factorize(opd_date)
+    parsed = pd.to_datetime(pd.Series(uniques), format=OPD_DATE_FORMAT).to_numpy()
+    # factorize codes a missing value as -1, so a trailing NaT is what -1 picks
+    parsed = np.append(parsed, np.datetime64('NaT', 'ns'))
+    return pd.Series(parsed[codes], index=opd_date.index)
+
+
+def add_timestamp(df):
+    """Add TIMESTAMP = OPD_DATE + ACT_TIME seconds, and return the parsed OPD_DATE."""
+    opd_date = parse_opd_date(df['OPD_DATE'])
+    df['TIMESTAMP'] = opd_date + pd.to_timedelta(df['ACT_TIME'], unit='s')
+    return opd_date
+
+
+def add_speed(df):
+    """Add SPEED = meters / seconds since the previous breadcrumb of the same trip.
+
+    df must already be sorted by trip and time. The first breadcrumb of each
+    trip takes the speed of the next one; backfilling stays inside the trip,
+    and a trip with a single breadcrumb gets 0.
+    """
+    trip = df['EVENT_NO_TRIP']
+    grouped = df.groupby(trip, sort=False)
+    speed = grouped['METERS'].diff() / grouped['ACT_TIME'].diff()
+    df['SPEED'] = speed.groupby(trip, sort=False).bfill().fillna(0.0).clip(lower=0)
+
+
+# Raw columns transform() reads
+TRANSFORM_COLUMNS = ['EVENT_NO_TRIP', 'VEHICLE_ID', 'OPD_DATE', 'ACT_TIME',
+                     'METERS', 'GPS_LATITUDE', 'GPS_LONGITUDE']
+
+
+def transform(df):
+    """Derive TIMESTAMP, SPEED and the service day, and split df into trip and breadcrumb rows.
+
+    Returns (trips, breadcrumbs) with the trip and breadcrumb table column
+    names, trips sorted by trip_id and breadcrumbs by trip_id and tstamp.
+    """
+    df = df.copy()
+    opd_date = add_timestamp(df)
+    df['DAY_NAME'] = opd_date.dt.dayofweek.map(DAY_NAMES)
+
+    # Trip attributes come from each trip's first record as received
+    trips = df.drop_duplicates(subset=['EVENT_NO_TRIP'], keep='first')
+    trips = pd.DataFrame({
+        'trip_id': trips['EVENT_NO_TRIP'],
+        'route_id': 0,
+        'vehicle_id': trips['VEHICLE_ID'],
+        'service_key': trips['DAY_NAME'],
+    }).sort_values('trip_id', kind='stable')
+
+    df = df.sort_values(['EVENT_NO_TRIP', 'TIMESTAMP'], kind='stable')
+    add_speed(df)
+    breadcrumbs = pd.DataFrame({
+        'tstamp': df['TIMESTAMP'],
+        'latitude': df['GPS_LATITUDE'].fillna(0.0),
+        'longitude': df['GPS_LONGITUDE'].fillna(0.0),
+        'speed': df['SPEED'],
+        'trip_id': df['EVENT_NO_TRIP'],
+    })
+    return trips, breadcrumbs
+
+
+def parallel_transform(df, executor=None, workers=1, min_rows=100_000):
+    """transform() with df split by trip into workers shards across a process pool.
+
+    Each shard is a contiguous range of trip ids holding about the same
+    number of rows. Every trip lands whole in one shard, so per-trip speeds
+    are unaffected and the merged result equals transform(df) exactly.
+    Frames smaller than min_rows, single-worker runs and frames whose
+    columns cannot go in shared memory are transformed in-process. Pass a
+    long-lived pool from transform_pool(workers) as executor to avoid
+    starting one per call.
+    """
+    with metrics.timer('transform'):
+        trips, breadcrumbs = _parallel_transform(df, executor, workers, min_rows)
+    metrics.count('transform', rows=len(df))
+    return trips, breadcrumbs
+
+
+def transform_pool(workers):
+    """A ProcessPoolExecutor for parallel_transform.
+
+    The workers must share the parent's multiprocessing resource tracker.
+    A worker forked before it started would run a tracker of its own,
+    which unlinks the shared blocks when that worker exits.
+    """
+    resource_tracker.ensure_running()
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+# Numeric columns the workers read from shared memory; OPD_DATE goes as factorized codes
+SHARED_COLUMNS = [c for c in TRANSFORM_COLUMNS if c != 'OPD_DATE']
+OUTPUT_COLUMNS = ['tstamp', 'latitude', 'longitude', 'speed', 'trip_id']
+
+
+class _SharedBlocks:
+    """Shared memory blocks kept from one call to the next.
+
+    Touching a fresh block's pages costs more than copying the data into
+    them, so the blocks are reused and grown only when a batch outgrows
+    them. They are unlinked at exit.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.blocks = {}
+        atexit.register(self.close)
+
+    def get(self, key, size):
+        block = self.blocks.get(key)
+        if block is None or block.size < size:
+            if block is not None:
+                block.close()
+                block.unlink()
+            # Headroom so that slightly larger batches do not reallocate
+            block = self.blocks[key] = shared_memory.SharedMemory(create=True, size=max(size * 5 // 4, 1))
+        return block
+
+    def close(self):
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks.clear()
+
+
+_blocks = _SharedBlocks()
+
+# Blocks a worker process has attached, by name
+_attached = {}
+
+
+def _layout(dtypes, n):
+    """(name, dtype, offset) of n rows of each column in one block, and the block size."""
+    layout, offset = [], 0
+    for name, dtype in dtypes.items():
+        dtype = np.dtype(dtype)
+        layout.append((name, dtype.str, offset))
+        # Keep every column 8-byte aligned
+        offset += -(-dtype.itemsize * n // 8) * 8
+    return layout, offset
+
+
+def _views(block, layout, n):
+    return {name: np.ndarray(n, np.dtype(dtype), block.buf, offset) for name, dtype, offset in layout}
+
+
+def _shm_free():
+    try:
+        stat = os.statvfs('/dev/shm')
+    except OSError:
+        return None
+    return stat.f_bavail * stat.f_frsize
+
+
+def _attach(names):
+    for name in set(_attached) - set(names):
+        # The parent has replaced this block with a larger one
+        _attached.pop(name).close()
+    for name in names:
+        if name not in _attached:
+            _attached[name] = shared_memory.SharedMemory(name=name)
+    return [_attached[name] for name in names]
+
+
+def _transform_shard(task):
+    """Transform one trip range of the shared input into its place in the shared output; returns trips."""
+    (source, inputs), (target, outputs), n, low, high, start, uniques = task
+    source, target = _attach([source, target])
+    columns = _views(source, inputs, n)
+    trip = columns['EVENT_NO_TRIP']
+    selected = np.ones(n, dtype=bool) if low is None else trip >= low
+    if high is not None:
+        selected &= trip < high
+    # Positions in df, in the order received, so transform() sees the rows as it would in-process
+    rows = np.flatnonzero(selected)
+    shard = pd.DataFrame({c: columns[c][rows] for c in SHARED_COLUMNS}, index=rows)
+    shard['OPD_DATE'] = pd.Categorical.from_codes(columns['OPD_DATE'][rows], uniques)
+    trips, breadcrumbs = transform(shard)
+
+    out = _views(target, outputs, n)
+    stop = start + len(breadcrumbs)
+    for column in OUTPUT_COLUMNS:
+        out[column][start:stop] = breadcrumbs[column].to_numpy()
+    out['position'][start:stop] = breadcrumbs.index.to_numpy()
+    return trips
+
+
+def _parallel_transform(df, executor, workers, min_rows):
+    if workers <= 1 or len(df) < min_rows:
+        return transform(df)
+    # Trip ranges need integer trip ids, and strings or objects cannot go in shared memory
+    if df['EVENT_NO_TRIP'].dtype.kind not in 'iu' or any(df[c].dtype.kind not in 'iufb'
+                                                         for c in SHARED_COLUMNS):
+        return transform(df)
+    n = len(df)
+    codes, uniques = pd.factorize(df['OPD_DATE'])
+    trip = df['EVENT_NO_TRIP'].to_numpy()
+    inputs, input_size = _layout(dict({c: df[c].dtype for c in SHARED_COLUMNS}, OPD_DATE=codes.dtype), n)
+    outputs, output_size = _layout({'tstamp': 'datetime64[ns]', 'latitude': 'float64',
+                                    'longitude': 'float64', 'speed': 'float64',
+                                    'trip_id': trip.dtype, 'position': 'int64'}, n)
+    free = _shm_free()
+    if free is not None and free < 2 * (input_size + output_size):
+        # Writing past a full /dev/shm kills the process with SIGBUS rather than raising
+        logger.warning(f"Transforming in-process: {free} bytes free in /dev/shm")
+        return transform(df)
+
+    # Trip id bounds splitting the rows about evenly; shard k holds bounds[k-1] <= trip < bounds[k]
+    bounds = np.unique(np.quantile(trip, np.linspace(0, 1, workers + 1)[1:-1], method='lower'))
+    counts = np.bincount(np.searchsorted(bounds, trip, side='right'), minlength=len(bounds) + 1)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    edges = [None] + bounds.tolist() + [None]
+
+    # Workers read the columns from, and write their rows to, shared memory,
+    # so no DataFrame is pickled to or from them: only the small trips frames
+    with _blocks.lock:
+        source, target = _blocks.get('input', input_size), _blocks.get('output', output_size)
+        _fill(source, inputs, n, df, codes)
+        tasks = [((source.name, inputs), (target.name, outputs), n, edges[k], edges[k + 1],
+                  int(starts[k]), uniques) for k in range(len(counts)) if counts[k]]
+        if executor is None:
+            with transform_pool(workers) as pool:
+                results = list(pool.map(_transform_shard, tasks))
+        else:
+            results = list(executor.map(_transform_shard, tasks))
+        breadcrumbs = _collect(target, outputs, n, df.index)
+    # Shards cover ascending trip ranges, so their sorted outputs already follow one another
+    trips = pd.concat(results)
+    trips.index = df.index.take(trips.index)
+    return trips, breadcrumbs
+
+
+def _fill(source, inputs, n, df, codes):
+    columns = _views(source, inputs, n)
+    for c in SHARED_COLUMNS:
+        columns[c][:] = df[c].to_numpy()
+    columns['OPD_DATE'][:] = codes
+
+
+def _collect(target, outputs, n, index):
+    out = _views(target, outputs, n)
+    return pd.DataFrame({column: out[column].copy() for column in OUTPUT_COLUMNS},
+                        index=index.take(out['position']))
+
+
+def average_speed_by_day(df):
+    """Summary assertion #10: mean SPEED per day of the week."""
+    day_of_week = df['TIMESTAMP'].dt.dayofweek.rename('DAY_OF_WEEK')
+    day_type = day_of_week.map(DAY_TYPES).rename('DAY_TYPE')
+    return df.groupby([day_type, day_of_week])['SPEED'].mean().reset_index()
+
+
+# Assertions #1-#9, checked on the raw records before transformation
+BREADCRUMB_RULES = [
+    Integer('METERS', quarantine=False),
+    InRange('METERS', low=0),
+    NotNull(name="no missing values", quarantine=False),
+    InRange('GPS_LONGITUDE', -180, 180),
+    InRange('GPS_LATITUDE', -90, 90),
+    Unique(),
+    NotNull(['GPS_LONGITUDE', 'GPS_LATITUDE'], name="GPS position present"),
+    # Assertion #7 asks it of each vehicle; rows missing either key cannot be loaded, so are quarantined
+    PresentPerGroup('VEHICLE_ID', ['EVENT_NO_TRIP', 'EVENT_NO_STOP'], quarantine=False),
+    NotNull(['EVENT_NO_TRIP', 'EVENT_NO_STOP'], name="trip and stop numbers present"),
+    # Without a service date a row has no TIMESTAMP, partition or day type
+    NotNull(['OPD_DATE'], name="service date present"),
+    Consistent('EVENT_NO_TRIP', 'OPD_DATE', quarantine=False),
+    InRange('GPS_HDOP', high=10, quarantine=False),
+]
+
+# Assertion #10, reported after TIMESTAMP and SPEED are derived
+BREADCRUMB_SUMMARY = [
+    Summary('average speed by day', average_speed_by_day, columns=('TIMESTAMP', 'SPEED')),
+]
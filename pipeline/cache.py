@@ -0,0 +1,165 @@
+"""On-disk, compressed, content-addressed cache of raw busdata API responses.
+
+Response bodies are stored gzip-compressed under ``objects/`` named by the
+SHA-256 of their content, so identical responses are stored once. A small
+SQLite index maps (endpoint, vehicle, service date) to a body and keeps
+the ETag/Last-Modified validators for conditional refetches. When the
+cache grows past max_bytes, the least recently used entries are evicted.
+
+Publishers pick the cache up from the environment:
+
+    BUSDATA_CACHE=~/.cache/busdata      where to keep responses
+    BUSDATA_CACHE_MAX_MB=2048           size limit before eviction
+    BUSDATA_REPLAY=1                    serve only from the cache, no network
+    BUSDATA_SERVICE_DATE=2024-05-01     service date to store under or replay
+"""
+import datetime
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    endpoint TEXT NOT NULL,
+    vehicle TEXT NOT NULL,
+    service_date TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    stored_at REAL NOT NULL,
+    used_at REAL NOT NULL,
+    PRIMARY KEY (endpoint, vehicle, service_date)
+)
+"""
+
+
+def today():
+    return datetime.date.today().isoformat()
+
+
+class ResponseCache:
+    """Raw API responses keyed by endpoint, vehicle and service date."""
+
+    def __init__(self, path, max_bytes=2 * 1024 ** 3):
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(self.path, 'objects'), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.path, 'index.sqlite'),
+                                   check_same_thread=False, isolation_level=None)
+        self._db.execute(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _object_path(self, digest):
+        return os.path.join(self.path, 'objects', digest[:2], digest + '.gz')
+
+    def lookup(self, endpoint, vehicle, service_date):
+        """Return the index row for a response, or None if it is not cached."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT digest, etag, last_modified FROM entries "
+                "WHERE endpoint = ? AND vehicle = ? AND service_date = ?",
+                (endpoint, str(vehicle), service_date)).fetchone()
+
+    def read(self, endpoint, vehicle, service_date):
+        """Return the cached body, or None if it is not cached."""
+        entry = self.lookup(endpoint, vehicle, service_date)
+        if entry is None:
+            return None
+        try:
+            with gzip.open(self._object_path(entry[0]), 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._db.execute(
+                "UPDATE entries SET used_at = ? WHERE endpoint = ? AND vehicle = ? AND service_date = ?",
+                (time.time(), endpoint, str(vehicle), service_date))
+        return content
+
+    def validators(self, endpoint, vehicle, service_date):
+        """Conditional request headers for a cached response."""
+        entry = self.lookup(endpoint, vehicle, service_date)
+        headers = {}
+        if entry is not None:
+            if entry[1]:
+                headers['If-None-Match'] = entry[1]
+            if entry[2]:
+                headers['If-Modified-Since'] = entry[2]
+        return headers
+
+    def put(self, endpoint, vehicle, service_date, content, etag=None, last_modified=None):
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp, 'wb', compresslevel=6) as f:
+                f.write(content)
+            os.replace(tmp, path)
+        size = os.path.getsize(path)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (endpoint, str(vehicle), service_date, digest, size, etag, last_modified, now, now))
+        self.evict()
+
+    def vehicles(self, endpoint, service_date):
+        """Vehicles with a cached response for endpoint on service_date."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT vehicle FROM entries WHERE endpoint = ? AND service_date = ? ORDER BY vehicle",
+                (endpoint, service_date)).fetchall()
+        return [int(v) if v.isdigit() else v for v, in rows]
+
+    def total_bytes(self):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM entries)").fetchone()
+        return row[0]
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        if self.total_bytes() <= self.max_bytes:
+            return
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT endpoint, vehicle, service_date, digest, size FROM entries "
+                "ORDER BY used_at").fetchall()
+            sizes = {}
+            for *_, digest, size in rows:
+                sizes[digest] = size
+            total = sum(sizes.values())
+            for endpoint, vehicle, service_date, digest, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._db.execute(
+                    "DELETE FROM entries WHERE endpoint = ? AND vehicle = ? AND service_date = ?",
+                    (endpoint, vehicle, service_date))
+                still_used = self._db.execute(
+                    "SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone()
+                if not still_used:
+                    try:
+                        os.remove(self._object_path(digest))
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+
+    def close(self):
+        self._db.close()
+
+
+def from_env():
+    """(cache, replay, service_date) configured from the BUSDATA_* variables."""
+    path = os.environ.get('BUSDATA_CACHE')
+    replay = os.environ.get('BUSDATA_REPLAY', '') not in ('', '0')
+    service_date = os.environ.get('BUSDATA_SERVICE_DATE') or today()
+    if replay and not path:
+        raise SystemExit("BUSDATA_REPLAY needs BUSDATA_CACHE")
+    max_bytes = int(float(os.environ.get('BUSDATA_CACHE_MAX_MB', 2048)) * 1024 ** 2)
+    cache = ResponseCache(path, max_bytes=max_bytes) if path else None
+    return cache, replay, service_date
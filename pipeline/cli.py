@@ -0,0 +1,70 @@
+"""One entry point for the pipeline's publishers, subscribers and tools.
+
+    python -m pipeline [--config FILE] COMMAND [ARGS...]
+    python -m pipeline publish-breadcrumbs --workers 16
+    python -m pipeline subscribe-stopevents --help
+
+Each command runs an assignment script, or a pipeline module's main(),
+with the arguments that follow it. Nothing is imported until a command
+is chosen, and then only what that command imports. So listing commands,
+or a cron job that publishes a handful of vehicles, does not pay for
+pandas or google.cloud up front. --config points the commands at an INI
+settings file (see pipeline.config).
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# name -> (script path under the repository root, or pipeline module with main(argv), help)
+COMMANDS = {
+    'publish-raw': ('Project Assignment-1/Publisher.py',
+                    "publish each vehicle's raw breadcrumb response"),
+    'archive-raw': ('Project Assignment-1/Subscriber.py',
+                    "append raw breadcrumbs to the compressed NDJSON archive"),
+    'publish-breadcrumbs': ('Project-2 Assignment/project_publisher.py',
+                            "fetch and publish the fleet's breadcrumbs"),
+    'subscribe-breadcrumbs': ('Project-2 Assignment/ProjectSubscriber.py',
+                              "validate, transform and load breadcrumbs into Postgres"),
+    'publish-stopevents': ('Project Assignment-3/stopevent publisher.py',
+                           "fetch, parse and publish the fleet's stop events"),
+    'subscribe-stopevents': ('Project Assignment-3/stopeventsubscriber.py',
+                             "validate and load stop events into Postgres"),
+    'serve': ('pipeline.server', "serve the visualization"),
+    'export': ('pipeline.export', "stream a query or TSV out as GeoJSON"),
+    'tiles': ('pipeline.tiles', "build the speed-grid vector tiles"),
+    'quarantine': ('pipeline.quarantine', "list quarantined rows"),
+}
+
+
+def run(command, argv):
+    """Run command with argv as its arguments; returns what its main() returns."""
+    target, _ = COMMANDS[command]
+    # The scripts parse sys.argv themselves
+    sys.argv = [target] + argv
+    if target.endswith('.py'):
+        import runpy
+        runpy.run_path(os.path.normpath(os.path.join(ROOT, target)), run_name='__main__')
+        return None
+    import importlib
+    return importlib.import_module(target).main(argv)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pipeline', description="Run a TriMet pipeline command.",
+        epilog="commands:\n" + "\n".join(f"  {name:<22} {text}" for name, (_, text) in COMMANDS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default=os.environ.get('BUSDATA_CONFIG'),
+                        help="INI settings file (default $BUSDATA_CONFIG)")
+    parser.add_argument('command', choices=COMMANDS, metavar='COMMAND')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help="arguments for the command")
+    args = parser.parse_args(argv)
+    if args.config:
+        os.environ['BUSDATA_CONFIG'] = args.config
+    return run(args.command, args.args)
+
+
+if __name__ == "__main__":
+    main()
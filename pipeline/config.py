@@ -0,0 +1,83 @@
+"""Settings shared by the pipeline commands: script defaults, then a config file, then the environment.
+
+The config file is INI, found at $BUSDATA_CONFIG (``python -m pipeline
+--config FILE`` sets it). Each script asks for the sections it needs and
+passes its own defaults, so a script run without any configuration
+behaves as it always has::
+
+    [breadcrumbs]
+    project_id = scientific-pad-420219
+    topic_id = project_topic
+    subscription_id = project_topic-sub
+
+    [database]
+    host = localhost
+    password = ...
+
+    [vehicles]
+    file = vehicle_ids.csv
+    column = Quest
+
+Any value can be overridden from the environment as
+BUSDATA_<SECTION>_<KEY>, e.g. BUSDATA_DATABASE_PASSWORD. This module
+only uses the standard library, so reading settings adds nothing to a
+command's start-up time.
+"""
+import configparser
+import csv
+import functools
+import os
+
+# Breadcrumbs' OPD_DATE, e.g. 08DEC2022:00:00:00
+OPD_DATE_FORMAT = '%d%b%Y:%H:%M:%S'
+
+# The vehicles both publishers fetch when no vehicle file is configured
+FLEET = (
+    3951, 3235, 3010, 3042, 2919, 4048, 3548, 3750, 3056, 4062,
+    3228, 3320, 4017, 4020, 3023, 3722, 3012, 4041, 3577, 3252,
+    3608, 3241, 3954, 4068, 3749, 3904, 4014, 3950, 4061, 3617,
+    3632, 4203, 3963, 3735, 3229, 4228, 3953, 3316, 3623, 3301,
+    3234, 3007, 3207, 3403, 3538, 4221, 3014, 3232, 3029, 3933,
+    3113, 4050, 3751, 3918, 4021, 3219, 3128, 3732, 3707, 3004,
+    4519, 3558, 3047, 2908, 3609, 3201, 3929, 4508, 3906, 3650,
+    3570, 3118, 4001, 3145, 3258, 3624, 3621, 3054, 3634, 4045,
+    3519, 3757, 3716, 3641, 3739, 3556, 3602, 2904, 3545, 3614,
+    3931, 4037, 3329, 3405, 3744, 3955, 4018, 3743, 3223, 3034,
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _read(path):
+    parser = configparser.ConfigParser(interpolation=None)
+    if path:
+        with open(path) as f:
+            parser.read_file(f)
+    return parser
+
+
+def section(name, /, **defaults):
+    """Settings for section name as a dict: defaults, overridden by the config file, then the environment."""
+    values = dict(defaults)
+    parser = _read(os.environ.get('BUSDATA_CONFIG') or None)
+    if parser.has_section(name):
+        values.update(parser.items(name))
+    prefix = f"BUSDATA_{name.upper()}_"
+    for key, value in os.environ.items():
+        if key.startswith(prefix):
+            values[key[len(prefix):].lower()] = value
+    return values
+
+
+def vehicle_ids(path=None, column='Quest', default=FLEET):
+    """Vehicle ids from column of a CSV file, or default when path is empty.
+
+    Blank cells are skipped and repeated ids are kept once, in file order.
+    """
+    if not path:
+        return list(default)
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        if column not in (reader.fieldnames or ()):
+            raise ValueError(f"{path} has no column {column!r}")
+        ids = (row[column].strip() for row in reader)
+        return list(dict.fromkeys(int(float(v)) for v in ids if v))
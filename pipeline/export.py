@@ -0,0 +1,226 @@
+"""Stream query results or TSV rows into GeoJSON or newline-delimited GeoJSON.
+
+Rows are read in chunks, from a Postgres server-side cursor or a TSV file,
+and each chunk is formatted into Point features with vectorized pandas
+string operations and written out before the next one is read, so memory
+stays constant however many rows are exported.
+
+    python -m pipeline.export --dsn "dbname=postgres user=postgres" \\
+        --query "SELECT longitude, latitude, speed FROM breadcrumb WHERE tstamp::date = %(day)s" \\
+        --param day=2022-12-08 --precision 5 --out vis_day.geojson
+
+    python -m pipeline.export --tsv top3.tsv --lon x --lat y --required speed --out vis_5c.geojson
+"""
+import argparse
+import csv
+import decimal
+import io
+import json
+import sys
+import time
+
+# numpy and pandas are imported in the functions that use them, so that
+# loading this module (e.g. for --help from the CLI) stays fast
+
+
+def query_chunks(conn, query, params=None, chunk_rows=10_000):
+    """Yield DataFrames of chunk_rows rows from a named (server-side) cursor."""
+    import pandas as pd
+
+    with conn.cursor(name='geojson_export') as cursor:
+        cursor.itersize = chunk_rows
+        cursor.execute(query, params)
+        columns = None
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if columns is None:
+                columns = [c.name for c in cursor.description]
+            if not rows:
+                break
+            yield pd.DataFrame.from_records(rows, columns=columns)
+
+
+def tsv_chunks(path, chunk_rows=10_000):
+    """Yield DataFrames from a TSV file with a header row.
+
+    Files whose separator is a literal backslash-t, as psql output piped
+    through some shells produces, are read too. Cells are numbers where the
+    whole column parses as numbers in the chunk, text otherwise.
+    """
+    import pandas as pd
+
+    with open(path, newline='') as f:
+        header = f.readline().rstrip('\r\n')
+        literal = '\t' not in header and '\\t' in header
+        columns = header.split('\\t' if literal else '\t')
+        while True:
+            lines = [line for _, line in zip(range(chunk_rows), f)]
+            if not lines:
+                break
+            if literal:
+                lines = [line.replace('\\t', '\t') for line in lines]
+            chunk = pd.read_csv(io.StringIO(''.join(lines)), sep='\t', names=columns,
+                                dtype=str, keep_default_na=False, quoting=csv.QUOTE_NONE)
+            for column in chunk.columns:
+                cells = chunk[column].where(chunk[column] != '')
+                numbers = pd.to_numeric(cells, errors='coerce')
+                if numbers.notna().sum() == cells.notna().sum():
+                    chunk[column] = numbers
+            yield chunk
+
+
+def _json_values(series):
+    """JSON fragments for one property column, formatted a column at a time."""
+    import numpy as np
+    import pandas as pd
+
+    if pd.api.types.is_bool_dtype(series):
+        return series.map({True: 'true', False: 'false'}).astype(object)
+    if pd.api.types.is_integer_dtype(series):
+        return series.astype(str)
+    if pd.api.types.is_float_dtype(series):
+        # Whole numbers print without the ".0", as the old export's int(speed) did
+        values = series.to_numpy(dtype=float)
+        finite = np.isfinite(values)
+        integral = finite & (values == np.round(values))
+        text = np.where(integral, np.where(integral, values, 0).astype('int64').astype(str),
+                        values.astype(str))
+        return pd.Series(np.where(finite, text, 'null'), index=series.index)
+    return series.map(_json_value)
+
+
+def _json_value(v):
+    import pandas as pd
+
+    if v is None or v is pd.NA or v != v:
+        return 'null'
+    if isinstance(v, decimal.Decimal):
+        return str(v)
+    if not isinstance(v, (str, int, float, bool)):
+        v = str(v)
+    return json.dumps(v)
+
+
+def _coordinates(values, precision):
+    import numpy as np
+    import pandas as pd
+
+    if precision is not None:
+        values = np.round(values, precision)
+    return pd.Series(values.astype(str))
+
+
+def features(chunk, lon='longitude', lat='latitude', properties=None, precision=None, required=()):
+    """Format one chunk as a Series of GeoJSON Feature strings.
+
+    Rows without coordinates, or with a null in any required column, are
+    dropped. properties defaults to every column except the coordinates.
+    """
+    import numpy as np
+    import pandas as pd
+
+    x = pd.to_numeric(chunk[lon], errors='coerce').to_numpy(dtype=float)
+    y = pd.to_numeric(chunk[lat], errors='coerce').to_numpy(dtype=float)
+    keep = np.isfinite(x) & np.isfinite(y)
+    for column in required:
+        keep &= chunk[column].notna().to_numpy()
+    chunk = chunk[keep].reset_index(drop=True)
+    if properties is None:
+        properties = [c for c in chunk.columns if c not in (lon, lat)]
+    text = ('{"type":"Feature","geometry":{"type":"Point","coordinates":['
+            + _coordinates(x[keep], precision) + ',' + _coordinates(y[keep], precision)
+            + ']},"properties":{')
+    for i, name in enumerate(properties):
+        text = text + (',' if i else '') + json.dumps(name) + ':' + _json_values(chunk[name])
+    return text + '}}'
+
+
+class GeoJSONWriter:
+    """Write features to a file as one FeatureCollection, or one Feature per line."""
+
+    def __init__(self, out, ndjson=False):
+        self.out = out
+        self.ndjson = ndjson
+        self.count = 0
+        if not ndjson:
+            out.write('{"type":"FeatureCollection","features":[\n')
+
+    def write(self, texts):
+        if len(texts) == 0:
+            return
+        separator = '\n' if self.ndjson else ',\n'
+        if self.count and not self.ndjson:
+            self.out.write(separator)
+        self.out.write(separator.join(texts))
+        if self.ndjson:
+            self.out.write('\n')
+        self.count += len(texts)
+
+    def close(self):
+        if not self.ndjson:
+            self.out.write('\n]}\n')
+
+
+def export(chunks, out, ndjson=False, **feature_options):
+    """Write every chunk's features to out; returns the number of features written."""
+    writer = GeoJSONWriter(out, ndjson)
+    for chunk in chunks:
+        writer.write(features(chunk, **feature_options).tolist())
+    writer.close()
+    return writer.count
+
+
+def query_param(text):
+    name, _, value = text.partition('=')
+    if not value and '=' not in text:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {text!r}")
+    return name, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--query', help="SQL with %%(name)s placeholders for --param")
+    source.add_argument('--tsv', help="TSV file with a header row")
+    parser.add_argument('--dsn', default='', help="libpq connection string for --query")
+    parser.add_argument('--param', type=query_param, action='append', default=[],
+                        metavar='NAME=VALUE', help="query parameter, repeatable")
+    parser.add_argument('--out', required=True, help="output path, or - for stdout")
+    parser.add_argument('--ndjson', action='store_true',
+                        help="one Feature per line instead of a FeatureCollection")
+    parser.add_argument('--lon', default='longitude', help="longitude column")
+    parser.add_argument('--lat', default='latitude', help="latitude column")
+    parser.add_argument('--properties', nargs='*',
+                        help="property columns (default: all but the coordinates)")
+    parser.add_argument('--required', nargs='*', default=[],
+                        help="skip rows where any of these columns is null")
+    parser.add_argument('--precision', type=int, default=None,
+                        help="round coordinates to this many decimals (5 is about 1 m)")
+    parser.add_argument('--chunk-rows', type=int, default=10_000)
+    args = parser.parse_args(argv)
+
+    conn = None
+    if args.query:
+        import psycopg2
+        conn = psycopg2.connect(args.dsn)
+        chunks = query_chunks(conn, args.query, dict(args.param) or None, args.chunk_rows)
+    else:
+        chunks = tsv_chunks(args.tsv, args.chunk_rows)
+
+    start = time.perf_counter()
+    out = sys.stdout if args.out == '-' else open(args.out, 'w', encoding='utf-8')
+    try:
+        count = export(chunks, out, ndjson=args.ndjson, lon=args.lon, lat=args.lat,
+                       properties=args.properties, precision=args.precision,
+                       required=args.required)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if conn is not None:
+            conn.close()
+    print(f"Wrote {count} features to {args.out} in {time.perf_counter() - start:.2f}s",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
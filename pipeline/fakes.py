@@ -0,0 +1,95 @@
+"""In-process stand-ins for Pub/Sub clients, for benchmarks and offline runs."""
+import threading
+import time
+from concurrent.futures import Future
+
+
+class FakePublisherClient:
+    """Mimic PublisherClient.publish: batch messages and resolve futures off-thread.
+
+    message_limit emulates blocking publisher flow control; latency is the
+    simulated round trip per batch. Published messages are kept in
+    ``messages`` only when keep is true.
+    """
+
+    def __init__(self, max_messages=500, max_latency=0.05, latency=0.0,
+                 message_limit=1000, fail_every=0, keep=False):
+        self.max_messages = max_messages
+        self.max_latency = max_latency
+        self.latency = latency
+        self.fail_every = fail_every
+        self.keep = keep
+        self.messages = []
+        self.received = 0
+        self.batches = 0
+        self._slots = threading.BoundedSemaphore(message_limit)
+        self._batch = []
+        self._lock = threading.Lock()
+        self._count = 0
+        self._timer = None
+
+    def topic_path(self, project_id, topic_id):
+        return f"projects/{project_id}/topics/{topic_id}"
+
+    def publish(self, topic, data, **attributes):
+        if not isinstance(data, bytes):
+            raise TypeError("data must be bytes")
+        self._slots.acquire()
+        future = Future()
+        with self._lock:
+            self._count += 1
+            self._batch.append((future, data, attributes, self._count))
+            if len(self._batch) >= self.max_messages:
+                self._commit_locked()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.max_latency, self._commit)
+                self._timer.daemon = True
+                self._timer.start()
+        return future
+
+    def _commit(self):
+        with self._lock:
+            self._commit_locked()
+
+    def _commit_locked(self):
+        batch, self._batch = self._batch, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if batch:
+            self.batches += 1
+            threading.Thread(target=self._send, args=(batch,), daemon=True).start()
+
+    def _send(self, batch):
+        if self.latency:
+            time.sleep(self.latency)
+        for future, data, attributes, n in batch:
+            self._slots.release()
+            if self.fail_every and n % self.fail_every == 0:
+                future.set_exception(RuntimeError("fake publish failure"))
+            else:
+                self.received += 1
+                if self.keep:
+                    self.messages.append((data, attributes))
+                future.set_result(str(n))
+
+
+class FakeMessage:
+    """Enough of pubsub_v1.subscriber.message.Message for subscriber callbacks."""
+
+    def __init__(self, data, attributes=None, message_id=None):
+        self.data = data
+        self.attributes = attributes or {}
+        self.message_id = message_id
+        self.acked = False
+        self.nacked = False
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def ack(self):
+        self.acked = True
+
+    def nack(self):
+        self.nacked = True
@@ -0,0 +1,194 @@
+"""Concurrent fetching of busdata API pages over a pooled keep-alive session."""
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pipeline import metrics
+from pipeline.cache import today
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = "https://busdata.cs.pdx.edu/api"
+
+# Status codes worth retrying; anything else in the 4xx range is final.
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Token bucket limiting requests per second, one bucket per host."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate or 1))
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host):
+        """Block until a request to host is allowed."""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens, last = self._buckets.get(host, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                if tokens >= 1:
+                    self._buckets[host] = (tokens - 1, now)
+                    return
+                self._buckets[host] = (tokens, now)
+                delay = (1 - tokens) / self.rate
+            time.sleep(delay)
+
+
+def make_session(pool_size=10):
+    """Build a requests session whose connection pool fits pool_size workers."""
+    session = requests.Session()
+    # Retries are handled in Fetcher so that each attempt passes the rate limiter.
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class Fetcher:
+    """Fetch busdata API pages with bounded concurrency, rate limiting and retry.
+
+    With a ResponseCache, raw responses are stored per (endpoint, vehicle,
+    service_date). Responses for past service dates never change and are
+    served from the cache only; one that was never cached raises
+    LookupError, as the live API has only today's. Today's are refetched
+    conditionally. offline=True serves only from the cache and never
+    touches the network.
+    """
+
+    def __init__(self, base_url=BASE_URL, workers=8, rate=None, retries=3,
+                 backoff=0.5, timeout=30, session=None, cache=None, offline=False,
+                 service_date=None):
+        if offline and cache is None:
+            raise ValueError("offline replay needs a cache")
+        self.base_url = base_url.rstrip("/")
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate)
+        self.session = session or make_session(pool_size=workers)
+        self.cache = cache
+        self.offline = offline
+        self.service_date = service_date or today()
+
+    def url(self, endpoint):
+        return f"{self.base_url}/{endpoint}"
+
+    def request(self, endpoint, params, headers=None):
+        """GET one page, retrying connection errors and 429/5xx with backoff."""
+        url = self.url(endpoint)
+        host = urlsplit(url).netloc
+        attempt = 0
+        while True:
+            self.limiter.acquire(host)
+            try:
+                response = self.session.get(url, params=params, headers=headers,
+                                            timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError(f"{response.status_code} for {response.url}")
+                retry_after = response.headers.get("Retry-After")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error, retry_after = e, None
+            if attempt >= self.retries:
+                raise error
+            if retry_after and retry_after.isdigit():
+                delay = float(retry_after)
+            else:
+                delay = self.backoff * (2 ** attempt) * (1 + random.random())
+            logger.warning(f"Retrying {url} {params} in {delay:.2f}s: {error}")
+            metrics.inc('busdata_retries_total', stage='fetch')
+            time.sleep(delay)
+            attempt += 1
+
+    def get_bytes(self, endpoint, params):
+        """Raw response body, through the cache when there is one."""
+        with metrics.timer('fetch'):
+            content = self._get_bytes(endpoint, params)
+        metrics.count('fetch', messages=1, nbytes=len(content))
+        return content
+
+    def _get_bytes(self, endpoint, params):
+        if self.cache is None:
+            return self.request(endpoint, params).content
+        vehicle = next(iter(params.values()))
+        key = (endpoint, vehicle, self.service_date)
+        if self.offline or self.service_date < today():
+            content = self.cache.read(*key)
+            if content is not None:
+                return content
+            # The live API only serves today, so its answer must not be stored under a past date
+            raise LookupError(f"{endpoint} for vehicle {vehicle} on {self.service_date} is not cached")
+        response = self.request(endpoint, params, headers=self.cache.validators(*key))
+        if response.status_code == 304:
+            content = self.cache.read(*key)
+            if content is not None:
+                return content
+            response = self.request(endpoint, params)
+        self.cache.put(*key, response.content, etag=response.headers.get("ETag"),
+                       last_modified=response.headers.get("Last-Modified"))
+        return response.content
+
+    def get(self, endpoint, params, as_json=True):
+        """GET one page and decode it as JSON, or as text when as_json is false."""
+        content = self.get_bytes(endpoint, params)
+        if not as_json:
+            return content.decode("utf-8", errors="replace")
+        with metrics.timer('parse'):
+            records = json.loads(content)
+        metrics.count('parse', rows=len(records) if isinstance(records, list) else 1)
+        return records
+
+    def fetch_many(self, endpoint, vehicle_ids, param="vehicle_id", as_json=True):
+        """Yield (vehicle_id, payload) as each fetch completes.
+
+        At most 2 * workers requests are in flight, so payloads are handed to
+        the caller as they arrive instead of being collected for the whole
+        fleet. A failed fetch yields a payload of None.
+        """
+        pending = iter(vehicle_ids)
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            def submit(count):
+                for vehicle_id in pending:
+                    future = executor.submit(self.get, endpoint, {param: vehicle_id}, as_json)
+                    in_flight[future] = vehicle_id
+                    count -= 1
+                    if count == 0:
+                        break
+
+            submit(2 * self.workers)
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    vehicle_id = in_flight.pop(future)
+                    try:
+                        payload = future.result()
+                    except Exception as e:
+                        logger.error(f"Error fetching {endpoint} for vehicle {vehicle_id}: {e}")
+                        payload = None
+                    yield vehicle_id, payload
+                submit(len(done))
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
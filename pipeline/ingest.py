@@ -0,0 +1,212 @@
+"""Fleet ingest as asyncio stages, so fetching, parsing, encoding and publishing overlap.
+
+The publishers used to take one vehicle through every step before the
+next one got anywhere. While a page was being parsed no request was in
+flight, and while pages downloaded the CPU sat idle. Here each step is a
+stage with its own workers and a bounded queue in front of it::
+
+    vehicles -> fetch -> [queue] -> parse -> [queue] -> encode -> [queue] -> publish
+
+Fleet time then tends to that of the slowest stage rather than the sum
+of all of them.
+
+Backpressure comes from the bounded queues. A worker takes its next
+item only once it has handed the last one on. When Pub/Sub slows down,
+the client's flow control blocks publish and the publish queue fills.
+Encode and parse then stall on their full queues, and the fetchers stop
+asking for pages. At most the sum of the queue sizes and workers
+vehicles are held at once, however large the fleet.
+
+Stage work is blocking code, so each stage runs it in an executor:
+- requests has no asyncio API, and Fetcher's cache, rate limiter and
+  retries are reused as they are.
+- BatchPublisher.publish blocks under flow control.
+- Parsing is CPU-bound.
+
+Each stage gets a thread pool sized to its workers. Parse can be given a
+process pool instead, for parsers that hold the GIL. Stage functions take
+(key, payload), and for a process pool they must be picklable: module-level
+functions, or partials of them.
+
+A failed call is counted in busdata_stage_errors_total by the runner, once,
+whether or not the stage function has a timer of its own. A worker
+process has its own copy of the metrics registry, so the metrics of a
+call made there are collected in the child and merged into the parent's.
+"""
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from pipeline import metrics
+
+logger = logging.getLogger(__name__)
+
+# Tells a stage's worker that nothing more is coming
+_DONE = object()
+
+
+class Stage:
+    """A named step applying func(key, payload) to every item, workers at a time.
+
+    queue_size bounds the items waiting for this stage (default twice its
+    workers). func runs on executor, or on a thread pool of workers
+    threads owned by the stage's run.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=None, executor=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue_size = queue_size or 2 * self.workers
+        self.executor = executor
+        self.done = 0
+        self.failed = 0
+        # Seconds spent in func, summed over workers
+        self.busy = 0.0
+
+    def __repr__(self):
+        return (f"Stage({self.name}: {self.done} done, {self.failed} failed, "
+                f"{self.workers} workers {self.busy:.2f}s busy)")
+
+
+def _call(func, key, payload, collect):
+    """Run one stage call on an executor; returns (ok, result or exception, metrics snapshot).
+
+    collect, for calls in a worker process, records the call's metrics in a
+    fresh registry and returns its snapshot for the parent to merge.
+    """
+    saved = metrics.registry
+    if collect:
+        metrics.registry = metrics.Registry()
+    try:
+        with metrics.errors_counted_by_caller():
+            try:
+                ok, result = True, func(key, payload)
+            except Exception as e:
+                ok, result = False, e
+        return ok, result, metrics.registry.snapshot() if collect else None
+    finally:
+        metrics.registry = saved
+
+
+async def run_stages(keys, stages, on_result=None):
+    """Take every key through stages in order; returns (stage, key, error) for each item that failed.
+
+    The first stage's payload is the key itself. An item whose func raises
+    is logged, counted and dropped. on_result(key, payload) gets the last
+    stage's output, on the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    queues = [asyncio.Queue(stage.queue_size) for stage in stages]
+    executors, owned, collect = [], [], []
+    for stage in stages:
+        executor = stage.executor
+        if executor is None:
+            executor = ThreadPoolExecutor(stage.workers, thread_name_prefix=f"ingest-{stage.name}")
+            owned.append(executor)
+        executors.append(executor)
+        collect.append(metrics.enabled() and isinstance(executor, ProcessPoolExecutor))
+    failures = []
+
+    async def feed():
+        for key in keys:
+            await queues[0].put((key, key))
+        for _ in range(stages[0].workers):
+            await queues[0].put(_DONE)
+
+    async def work(i):
+        stage, inbox = stages[i], queues[i]
+        outbox = queues[i + 1] if i + 1 < len(stages) else None
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                return
+            metrics.gauge('busdata_queue_depth', inbox.qsize(), queue=stage.name)
+            key, payload = item
+            start = time.perf_counter()
+            try:
+                ok, payload, snapshot = await loop.run_in_executor(
+                    executors[i], _call, stage.func, key, payload, collect[i])
+                if snapshot is not None:
+                    metrics.merge(snapshot)
+                if not ok:
+                    raise payload
+            except Exception as e:
+                logger.error(f"{stage.name} failed for {key}: {e}")
+                metrics.inc('busdata_stage_errors_total', stage=stage.name)
+                stage.failed += 1
+                failures.append((stage.name, key, e))
+                continue
+            finally:
+                stage.busy += time.perf_counter() - start
+            stage.done += 1
+            if outbox is not None:
+                # Waits while the next stage is behind; this is what holds the fetchers back
+                await outbox.put((key, payload))
+            elif on_result is not None:
+                on_result(key, payload)
+
+    async def run(i):
+        await asyncio.gather(*(work(i) for _ in range(stages[i].workers)))
+        if i + 1 < len(stages):
+            for _ in range(stages[i + 1].workers):
+                await queues[i + 1].put(_DONE)
+
+    try:
+        await asyncio.gather(feed(), *(run(i) for i in range(len(stages))))
+    finally:
+        for executor in owned:
+            executor.shutdown(wait=False, cancel_futures=True)
+    return failures
+
+
+def parse_json(key, content):
+    """Records of one JSON response body."""
+    with metrics.timer('parse'):
+        records = json.loads(content)
+    metrics.count('parse', rows=len(records) if isinstance(records, list) else 1)
+    return records
+
+
+def parse_stop_events_page(key, content, date=None, backend=None):
+    """Stop-event records of one getStopEvents page body."""
+    from pipeline.stopevents import parse_stop_events, to_records
+
+    html = content.decode('utf-8', errors='replace')
+    return to_records(parse_stop_events(html, date=date, backend=backend))
+
+
+def fleet_stages(fetcher, endpoint, parse, publisher, param='vehicle_id', parse_workers=2,
+                 encode_workers=1, publish_workers=1, queue_size=None, parse_executor=None):
+    """Fetch, parse, encode and publish stages for one endpoint.
+
+    Keys are vehicle ids, sent as the param query parameter and attribute.
+    Fetch runs fetcher.workers requests at a time.
+    """
+    def fetch(key, _):
+        return fetcher.get_bytes(endpoint, {param: key})
+
+    def encode(key, records):
+        return len(records), publisher.encode_records(records, **{param: key})
+
+    def publish(key, encoded):
+        rows, messages = encoded
+        publisher.publish_messages(messages, rows=rows)
+        return rows
+
+    return [
+        Stage('fetch', fetch, fetcher.workers, queue_size),
+        Stage('parse', parse, parse_workers, queue_size, parse_executor),
+        Stage('encode', encode, encode_workers, queue_size),
+        Stage('publish', publish, publish_workers, queue_size),
+    ]
+
+
+def ingest(keys, stages, on_result=None):
+    """Run stages over keys to completion; returns the failed items as run_stages does."""
+    failures = asyncio.run(run_stages(keys, stages, on_result))
+    for stage in stages:
+        logger.info(f"{stage!r}")
+    return failures
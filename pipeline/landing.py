@@ -0,0 +1,196 @@
+"""Parquet landing zone for raw breadcrumbs and stop events.
+
+Subscribers append every batch they receive, before validation, as
+dictionary-encoded, zstd-compressed Parquet partitioned hive-style by
+service date and vehicle::
+
+    <root>/breadcrumbs/service_date=2022-12-08/vehicle=3951/part-<id>-0.parquet
+    <root>/stopevents/service_date=2022-12-08/vehicle=3951/part-<id>-0.parquet
+
+Readers push date and vehicle filters down to partition pruning, and trip
+and bounding-box filters down to Parquet row-group statistics (rows are
+sorted by trip and time within each file), and read only the requested
+columns through memory-mapped files. Backfills and exports can then run
+from local files instead of replaying Pub/Sub.
+
+Needs pyarrow.
+"""
+import logging
+import os
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs
+
+from pipeline.breadcrumbs import parse_opd_date
+from pipeline.stopevents import STOPEVENT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+BREADCRUMB_SCHEMA = pa.schema([
+    ('EVENT_NO_TRIP', pa.int64()),
+    ('EVENT_NO_STOP', pa.int64()),
+    ('OPD_DATE', pa.string()),
+    ('VEHICLE_ID', pa.int64()),
+    ('METERS', pa.int64()),
+    ('ACT_TIME', pa.int64()),
+    ('GPS_LONGITUDE', pa.float64()),
+    ('GPS_LATITUDE', pa.float64()),
+    ('GPS_SATELLITES', pa.float64()),
+    ('GPS_HDOP', pa.float64()),
+])
+
+# Stop-event cells are landed as the text the parser produced
+STOPEVENT_SCHEMA = pa.schema([(name, pa.string()) for name in STOPEVENT_COLUMNS])
+
+PARTITIONING = ds.partitioning(
+    pa.schema([('service_date', pa.string()), ('vehicle', pa.int64())]), flavor='hive')
+
+# table -> (schema, vehicle column, trip column, sort order within a file)
+TABLES = {
+    'breadcrumbs': (BREADCRUMB_SCHEMA, 'VEHICLE_ID', 'EVENT_NO_TRIP', ['EVENT_NO_TRIP', 'ACT_TIME']),
+    'stopevents': (STOPEVENT_SCHEMA, 'vehicle_num', 'trip_number', ['trip_number', 'stop_time']),
+}
+
+
+def _to_arrow(df, schema):
+    """df as an Arrow table with exactly schema's columns; missing ones are null."""
+    columns = {}
+    for field in schema:
+        if field.name not in df:
+            columns[field.name] = pa.nulls(len(df), field.type)
+        elif pa.types.is_string(field.type):
+            values = df[field.name]
+            columns[field.name] = pa.array(values.where(values.isna(), values.astype(str)),
+                                           type=field.type, from_pandas=True)
+        else:
+            values = pd.to_numeric(df[field.name], errors='coerce')
+            columns[field.name] = pa.array(values, type=field.type, from_pandas=True, safe=False)
+    return pa.table(columns, schema=schema)
+
+
+def _value_filter(field, value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return field.isin(list(value))
+    return field == value
+
+
+class LandingZone:
+    """Partitioned Parquet datasets of raw records under one root directory."""
+
+    def __init__(self, root, compression='zstd'):
+        self.root = root
+        self.compression = compression
+        self._fs = pyarrow.fs.LocalFileSystem(use_mmap=True)
+        self._format = ds.ParquetFileFormat()
+
+    def path(self, table):
+        return os.path.join(self.root, table)
+
+    def _write(self, table, df, service_date):
+        schema, vehicle, _, order = TABLES[table]
+        data = _to_arrow(df, schema)
+        data = data.append_column('service_date', pa.array(service_date, pa.string(), from_pandas=True))
+        data = data.append_column('vehicle', data[vehicle])
+        data = data.sort_by([(c, 'ascending') for c in ['service_date', 'vehicle'] + order])
+        options = self._format.make_write_options(compression=self.compression, use_dictionary=True)
+        ds.write_dataset(data, self.path(table), format=self._format, partitioning=PARTITIONING,
+                         file_options=options, filesystem=self._fs,
+                         basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+                         existing_data_behavior='overwrite_or_ignore')
+        return len(df)
+
+    def write_breadcrumbs(self, df):
+        """Append raw breadcrumb records, partitioned by OPD_DATE and VEHICLE_ID."""
+        if len(df) == 0:
+            return 0
+        service_date = parse_opd_date(df['OPD_DATE']).dt.strftime('%Y-%m-%d')
+        return self._write('breadcrumbs', df, service_date.to_numpy(dtype=object))
+
+    def write_stop_events(self, df):
+        """Append parsed stop-event records, partitioned by date and vehicle_num."""
+        if len(df) == 0:
+            return 0
+        return self._write('stopevents', df, df['date'].astype(str).to_numpy(dtype=object))
+
+    def dataset(self, table):
+        return ds.dataset(self.path(table), format=self._format, partitioning=PARTITIONING,
+                          filesystem=self._fs)
+
+    def scan(self, table, columns=None, service_date=None, vehicle=None, trip=None, bbox=None):
+        """Read table as an Arrow table, keeping only matching rows and the given columns.
+
+        service_date is one ISO date, a list of dates, or a (first, last)
+        inclusive range given as a slice; vehicle and trip take one value or
+        a list. bbox is (min_lon, min_lat, max_lon, max_lat) and applies to
+        breadcrumbs only.
+        """
+        if not os.path.isdir(self.path(table)):
+            return _to_arrow(pd.DataFrame(), TABLES[table][0]).select(columns or TABLES[table][0].names)
+        _, _, trip_column, _ = TABLES[table]
+        conditions = []
+        if isinstance(service_date, slice):
+            if service_date.start:
+                conditions.append(ds.field('service_date') >= str(service_date.start))
+            if service_date.stop:
+                conditions.append(ds.field('service_date') <= str(service_date.stop))
+        elif service_date is not None:
+            dates = service_date if isinstance(service_date, (list, tuple, set)) else [service_date]
+            conditions.append(_value_filter(ds.field('service_date'), [str(d) for d in dates]))
+        if vehicle is not None:
+            conditions.append(_value_filter(ds.field('vehicle'), vehicle))
+        if trip is not None:
+            if table == 'stopevents':
+                trip = [str(t) for t in trip] if isinstance(trip, (list, tuple, set)) else str(trip)
+            conditions.append(_value_filter(ds.field(trip_column), trip))
+        if bbox is not None:
+            if table != 'breadcrumbs':
+                raise ValueError("bbox filters apply to breadcrumbs only")
+            min_lon, min_lat, max_lon, max_lat = bbox
+            conditions += [ds.field('GPS_LONGITUDE') >= min_lon, ds.field('GPS_LONGITUDE') <= max_lon,
+                           ds.field('GPS_LATITUDE') >= min_lat, ds.field('GPS_LATITUDE') <= max_lat]
+        condition = None
+        for c in conditions:
+            condition = c if condition is None else condition & c
+        return self.dataset(table).to_table(columns=columns, filter=condition)
+
+    def breadcrumbs(self, columns=None, **filters):
+        """Raw breadcrumbs as a DataFrame; see scan() for the filters."""
+        return self.scan('breadcrumbs', columns, **filters).to_pandas()
+
+    def stop_events(self, columns=None, **filters):
+        """Raw stop events as a DataFrame; see scan() for the filters."""
+        return self.scan('stopevents', columns, **filters).to_pandas()
+
+    def compact(self, table, service_date=None):
+        """Rewrite each partition of table (optionally one service date) as a single file.
+
+        Micro-batched subscribers leave many small files; compacting them
+        restores large row groups and tight statistics.
+        """
+        dataset = self.dataset(table)
+        if service_date is not None:
+            dataset = dataset.filter(ds.field('service_date') == str(service_date))
+        partitions = {}
+        for fragment in dataset.get_fragments():
+            partitions.setdefault(os.path.dirname(fragment.path), []).append(fragment.path)
+        _, _, _, order = TABLES[table]
+        options = self._format.make_write_options(compression=self.compression, use_dictionary=True)
+        compacted = 0
+        for directory, paths in partitions.items():
+            if len(paths) < 2:
+                continue
+            data = ds.dataset(paths, format=self._format, filesystem=self._fs).to_table()
+            data = data.sort_by([(c, 'ascending') for c in order])
+            target = os.path.join(directory, f"part-{uuid.uuid4().hex}-0.parquet")
+            ds.write_dataset(data, os.path.dirname(target), format=self._format,
+                             file_options=options, filesystem=self._fs,
+                             basename_template=os.path.basename(target).replace('-0.', '-{i}.'),
+                             existing_data_behavior='overwrite_or_ignore')
+            for path in paths:
+                os.remove(path)
+            compacted += 1
+        logger.info(f"Compacted {compacted} partitions of {table}")
+        return compacted
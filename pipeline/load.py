@@ -0,0 +1,336 @@
+"""Chunked, streaming COPY of DataFrames into Postgres.
+
+Rows are serialized a block at a time into a file-like object that
+psycopg2's ``copy_expert`` reads from, so the whole frame is never held
+as one CSV string. Each chunk is committed on its own: a bad row costs
+its chunk (and, after bisection, only itself), not the whole load.
+Errors no single row causes, such as a missing table or column or a
+permission error, are raised instead of bisected.
+Fixed-width numeric and timestamp columns can use the binary COPY format,
+which skips float formatting and parsing entirely. Loads can also merge
+through a staging table on a natural key, which makes replays idempotent.
+"""
+import io
+import json
+import logging
+import os
+import struct
+import time
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from pipeline import metrics
+
+logger = logging.getLogger(__name__)
+
+PG_EPOCH = np.datetime64('2000-01-01T00:00:00', 'us')
+BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+BINARY_TRAILER = struct.pack('>h', -1)
+
+# Postgres type -> (numpy big-endian dtype, byte width) for the binary format
+BINARY_TYPES = {
+    'smallint': ('>i2', 2),
+    'integer': ('>i4', 4),
+    'bigint': ('>i8', 8),
+    'real': ('>f4', 4),
+    'double precision': ('>f8', 8),
+    'timestamp': ('>i8', 8),
+    'date': ('>i4', 4),
+}
+
+
+class IteratorFile(io.RawIOBase):
+    """Read-only file over an iterator of byte strings."""
+
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self._pending = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            try:
+                self._pending = memoryview(next(self._blocks))
+            except StopIteration:
+                return 0
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+def _binary_values(series, pg_type):
+    if pg_type == 'timestamp':
+        return (series.to_numpy(dtype='datetime64[us]') - PG_EPOCH).astype('int64')
+    if pg_type == 'date':
+        days = series.to_numpy(dtype='datetime64[D]') - PG_EPOCH.astype('datetime64[D]')
+        return days.astype('int64')
+    return series.to_numpy()
+
+
+def binary_compatible(df, types):
+    """Whether df can be sent as binary: known fixed-width types, no nulls, no overflow."""
+    if types is None or any(types.get(c) not in BINARY_TYPES for c in df.columns):
+        return False
+    if df.isnull().to_numpy().any():
+        return False
+    for column in df.columns:
+        dtype = np.dtype(BINARY_TYPES[types[column]][0])
+        if dtype.kind == 'i' and types[column] not in ('timestamp', 'date') and len(df):
+            limits = np.iinfo(dtype)
+            if df[column].min() < limits.min or df[column].max() > limits.max:
+                return False
+    return True
+
+
+def binary_block(df, types):
+    """Encode df as binary COPY tuples in one vectorized numpy pass.
+
+    Every column must have a fixed-width type in BINARY_TYPES and no nulls.
+    """
+    fields = [('count', '>i2')]
+    for i, column in enumerate(df.columns):
+        dtype, width = BINARY_TYPES[types[column]]
+        fields += [(f'len{i}', '>i4'), (f'val{i}', dtype)]
+    rows = np.empty(len(df), dtype=fields)
+    rows['count'] = len(df.columns)
+    for i, column in enumerate(df.columns):
+        rows[f'len{i}'] = BINARY_TYPES[types[column]][1]
+        rows[f'val{i}'] = _binary_values(df[column], types[column])
+    return rows.tobytes()
+
+
+def csv_block(df):
+    return df.to_csv(index=False, header=False).encode('utf-8')
+
+
+def _blocks(df, block_rows, binary, types):
+    if binary:
+        yield BINARY_HEADER
+    for start in range(0, len(df), block_rows):
+        block = df.iloc[start:start + block_rows]
+        yield binary_block(block, types) if binary else csv_block(block)
+    if binary:
+        yield BINARY_TRAILER
+
+
+class Progress:
+    """Rows committed per load key, kept in a small JSON file so loads can resume."""
+
+    def __init__(self, path):
+        self.path = path
+        self._state = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self._state = json.load(f)
+
+    def get(self, key):
+        return self._state.get(key, 0)
+
+    def set(self, key, rows):
+        self._state[key] = rows
+        self._save()
+
+    def clear(self, key):
+        if self._state.pop(key, None) is not None:
+            self._save()
+
+    def _save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._state, f)
+        os.replace(tmp, self.path)
+
+
+class LoadResult:
+    def __init__(self, table):
+        self.table = table
+        self.rows = 0
+        self.inserted = 0
+        self.chunks = 0
+        self.skipped = 0
+        self.seconds = 0.0
+        self.failed = []
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def failed_rows(self):
+        """Rejected rows as one DataFrame with a ``reason`` column."""
+        if not self.failed:
+            return pd.DataFrame(columns=['reason'])
+        return pd.concat([rows.assign(reason=reason) for rows, reason in self.failed])
+
+    def __str__(self):
+        failed = sum(len(rows) for rows, _ in self.failed)
+        existing = f" ({self.rows - self.inserted} duplicates skipped)" if self.inserted != self.rows else ""
+        return (f"{self.table}: {self.rows} rows{existing} in {self.chunks} chunks, "
+                f"{self.seconds:.2f}s ({self.rows_per_second:.0f} rows/s), {failed} rows failed")
+
+
+def _copy_sql(table, columns, binary):
+    options = "FORMAT binary" if binary else "FORMAT csv"
+    return f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH ({options})"
+
+
+def copy_chunk(conn, table, df, binary=False, types=None, block_rows=10_000):
+    """COPY one chunk in its own transaction; returns the rows written."""
+    with conn.cursor() as cursor:
+        cursor.copy_expert(_copy_sql(table, df.columns, binary),
+                           IteratorFile(_blocks(df, block_rows, binary, types)))
+    conn.commit()
+    return len(df)
+
+
+def merge_chunk(conn, table, df, key, update=(), binary=False, types=None, block_rows=10_000):
+    """COPY one chunk into a staging table and merge it into table on key.
+
+    The staging table is a session-private temporary table (temporary tables
+    are never WAL-logged) emptied at every commit. Rows whose key already
+    exists are skipped, or have the update columns overwritten. Returns the
+    number of rows inserted or updated.
+    """
+    stage = f"{table}_stage"
+    columns = ', '.join(df.columns)
+    keys = ', '.join(key)
+    if update:
+        action = "DO UPDATE SET " + ', '.join(f"{c} = EXCLUDED.{c}" for c in update)
+    else:
+        action = "DO NOTHING"
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} "
+                       f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+        cursor.copy_expert(_copy_sql(stage, df.columns, binary),
+                           IteratorFile(_blocks(df, block_rows, binary, types)))
+        # DISTINCT ON keeps one row per key, as ON CONFLICT cannot touch a row twice
+        cursor.execute(f"INSERT INTO {table} ({columns}) "
+                       f"SELECT DISTINCT ON ({keys}) {columns} FROM {stage} ORDER BY {keys} "
+                       f"ON CONFLICT ({keys}) {action}")
+        merged = cursor.rowcount
+    conn.commit()
+    return merged
+
+
+def ensure_unique_key(conn, table, key):
+    """Create a unique index on key unless table already has one on exactly those columns.
+
+    ON CONFLICT needs it. Fails if the table already holds duplicate keys
+    from earlier append-only loads; those have to be removed once by hand.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indrelid
+            WHERE c.relname = %s AND i.indisunique
+              AND (SELECT array_agg(a.attname::text ORDER BY a.attname)
+                   FROM pg_attribute a
+                   WHERE a.attrelid = c.oid AND a.attnum = ANY(i.indkey)) = %s
+        """, (table, sorted(key)))
+        if cursor.fetchone() is None:
+            cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_{'_'.join(key)}_key "
+                           f"ON {table} ({', '.join(key)})")
+    conn.commit()
+
+
+# Errors one bad row can cause. Any other error (a missing table or column,
+# a permission error) fails every row alike, so is raised rather than bisected.
+ROW_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError)
+
+
+def _reason(error):
+    return str(error).strip().splitlines()[0]
+
+
+def _try_load(conn, load, df, result):
+    """Load df; returns the row error that rolled it back, or None once it is committed."""
+    try:
+        result.inserted += load(df)
+    except ROW_ERRORS as error:
+        conn.rollback()
+        return error
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        raise
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    result.rows += len(df)
+    return None
+
+
+def _load_or_bisect(conn, load, df, result):
+    error = _try_load(conn, load, df, result)
+    if error is not None:
+        _bisect(conn, load, df, error, result)
+
+
+def _bisect(conn, load, df, error, result):
+    """Commit what loads of df, which failed with error, and record the rows that do not."""
+    if len(df) == 1:
+        result.failed.append((df, _reason(error)))
+        return
+    middle = len(df) // 2
+    halves = [df.iloc[:middle], df.iloc[middle:]]
+    errors = [_try_load(conn, load, half, result) for half in halves]
+    if errors[0] is not None and type(errors[0]) is type(errors[1]):
+        # Both halves fail alike, as when no partition takes the chunk's date:
+        # record the rows with that error instead of a round trip per row
+        result.failed.append((df, _reason(errors[0])))
+        return
+    for half, half_error in zip(halves, errors):
+        if half_error is not None:
+            _bisect(conn, load, half, half_error, result)
+
+
+def copy_dataframe(conn, table, df, chunk_rows=50_000, binary=False, types=None,
+                   block_rows=10_000, progress=None, key=None, merge_key=None, update=()):
+    """COPY df into table chunk by chunk and return a LoadResult.
+
+    df's column names must match the table's. binary=True needs types, a
+    mapping of column to Postgres type for every column; frames that cannot
+    be sent as binary (nulls, out-of-range integers) fall back to CSV so the
+    server can reject the bad rows. With a Progress and key, chunks already
+    committed by an earlier run of the same key are skipped. A chunk that
+    fails with a data or integrity error is bisected until the offending
+    rows are found. They are returned in result.failed and the rest are
+    committed. If both halves of a chunk fail with the same kind of error,
+    bisection stops and the whole chunk is recorded with it. Any other
+    error, including a lost connection, propagates to the caller.
+
+    With merge_key, chunks are staged and merged with INSERT ... ON CONFLICT
+    on those columns (see merge_chunk), so reloading the same rows is a no-op.
+    """
+    if binary and not binary_compatible(df, types):
+        binary = False
+    if merge_key:
+        merge_key = tuple(merge_key)
+
+        def load(chunk):
+            return merge_chunk(conn, table, chunk, merge_key, update, binary, types, block_rows)
+    else:
+        def load(chunk):
+            return copy_chunk(conn, table, chunk, binary, types, block_rows)
+
+    result = LoadResult(table)
+    start_row = progress.get(key) if progress is not None else 0
+    result.skipped = start_row
+    start = time.perf_counter()
+    for offset in range(start_row, len(df), chunk_rows):
+        chunk = df.iloc[offset:offset + chunk_rows]
+        with metrics.timer('load'):
+            _load_or_bisect(conn, load, chunk, result)
+        result.chunks += 1
+        if progress is not None:
+            progress.set(key, offset + len(chunk))
+    result.seconds = time.perf_counter() - start
+    if progress is not None:
+        progress.clear(key)
+    metrics.count('load', rows=result.rows)
+    if result.failed:
+        metrics.inc('busdata_rejected_rows_total', sum(len(rows) for rows, _ in result.failed),
+                    stage='load')
+    logger.info(str(result))
+    return result
@@ -0,0 +1,358 @@
+"""Per-stage timers, counters and gauges for the pipeline scripts, off unless configured.
+
+The library modules report what they do through the functions here:
+``timer(stage)`` around a unit of work (fetch, parse, publish, ack,
+validate, transform, load), ``inc`` for rows, messages, bytes and errors,
+and ``gauge`` for queue depths. Until ``configure`` enables a registry
+each of them returns immediately, so instrumented code costs one global
+lookup and a function call when metrics are off.
+
+``configure`` reads BUSDATA_METRICS:
+
+* ``:9108`` or ``9108`` serves the Prometheus text format at
+  ``http://<host>:9108/metrics`` from a background thread.
+* Anything else is a file path that gets a JSON snapshot, including per
+  second rates since the previous snapshot, every BUSDATA_METRICS_INTERVAL
+  seconds (default 15) and once more at exit.
+
+BUSDATA_TRACE=1 also logs every timed span at DEBUG, which is useful for
+following one batch through the stages but too chatty to leave on.
+
+Metrics:
+
+    busdata_stage_seconds{stage}        histogram of time spent per call
+    busdata_stage_errors_total{stage}   calls that raised
+    busdata_rows_total{stage}           records handled
+    busdata_messages_total{stage}       API responses or Pub/Sub messages
+    busdata_bytes_total{stage}          payload bytes
+    busdata_rejected_rows_total{stage}  rows quarantined or refused by the database
+    busdata_retries_total{stage}        requests retried after an error
+    busdata_queue_depth{queue}          items waiting in a queue
+"""
+import atexit
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+HELP = {
+    'busdata_stage_seconds': ('histogram', "Seconds spent in one call of a pipeline stage"),
+    'busdata_stage_errors_total': ('counter', "Stage calls that raised an exception"),
+    'busdata_rows_total': ('counter', "Records handled by a stage"),
+    'busdata_messages_total': ('counter', "API responses or Pub/Sub messages handled by a stage"),
+    'busdata_bytes_total': ('counter', "Payload bytes handled by a stage"),
+    'busdata_rejected_rows_total': ('counter', "Rows quarantined by validation or refused by the database"),
+    'busdata_retries_total': ('counter', "Requests retried after an error"),
+    'busdata_queue_depth': ('gauge', "Items waiting in a queue"),
+}
+
+# The enabled Registry, or None while metrics are off
+registry = None
+
+# Per-thread flag set by errors_counted_by_caller()
+_local = threading.local()
+trace = False
+
+
+class Registry:
+    """Counters, gauges and histograms keyed by name and sorted label pairs."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.started = time.time()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, labels=()):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, value, labels=()):
+        with self._lock:
+            self._gauges[(name, labels)] = value
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Per-bucket counts, then sum and count
+                histogram = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def merge(self, snapshot):
+        """Add a snapshot() taken elsewhere, e.g. in a worker process, to this registry."""
+        counters, gauges, histograms = snapshot
+        with self._lock:
+            for key, value in counters.items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            self._gauges.update(gauges)
+            for key, value in histograms.items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    self._histograms[key] = list(value)
+                else:
+                    self._histograms[key] = [a + b for a, b in zip(histogram, value)]
+
+    def snapshot(self):
+        """Plain dicts of every metric, safe to read while the pipeline keeps running."""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+        return counters, gauges, histograms
+
+    def prometheus(self):
+        """The registry in the Prometheus text exposition format (0.0.4)."""
+        counters, gauges, histograms = self.snapshot()
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described:
+                described.add(name)
+                kind, text = HELP.get(name, ('untyped', name))
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for metrics in (counters, gauges):
+            for (name, labels), value in sorted(metrics.items()):
+                describe(name)
+                lines.append(f"{name}{_labels(labels)} {value!r}")
+        for (name, labels), histogram in sorted(histograms.items()):
+            describe(name)
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram[-1]}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram[-2]:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def as_dict(self, previous=None, elapsed=None):
+        """A JSON-ready snapshot; with the previous one and the seconds since, counter rates too."""
+        counters, gauges, histograms = self.snapshot()
+        doc = {'time': time.time(), 'uptime': time.time() - self.started,
+               'counters': [], 'gauges': [], 'stages': []}
+        before = {}
+        if previous:
+            before = {(c['name'], tuple(sorted(c['labels'].items()))): c['value']
+                      for c in previous['counters']}
+        for (name, labels), value in sorted(counters.items()):
+            entry = {'name': name, 'labels': dict(labels), 'value': value}
+            if elapsed:
+                entry['per_second'] = (value - before.get((name, labels), 0)) / elapsed
+            doc['counters'].append(entry)
+        for (name, labels), value in sorted(gauges.items()):
+            doc['gauges'].append({'name': name, 'labels': dict(labels), 'value': value})
+        for (name, labels), histogram in sorted(histograms.items()):
+            total, count = histogram[-2], histogram[-1]
+            doc['stages'].append({'name': name, 'labels': dict(labels), 'count': count,
+                                  'seconds': total, 'mean': total / count if count else 0.0})
+        return doc
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class _Timer:
+    """Context manager recording one call of a stage in busdata_stage_seconds."""
+
+    __slots__ = ('registry', 'labels', 'start')
+
+    def __init__(self, registry, labels):
+        self.registry = registry
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.registry.observe('busdata_stage_seconds', elapsed, self.labels)
+        if exc_type is not None and not getattr(_local, 'caller_counts_errors', False):
+            self.registry.inc('busdata_stage_errors_total', 1, self.labels)
+        if trace:
+            outcome = f" failed: {exc_type.__name__}" if exc_type is not None else ""
+            logger.debug(f"{_labels(self.labels)} {elapsed * 1000:.1f}ms{outcome}")
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(stage, **labels):
+    """Time a block as one call of stage; exceptions are counted and re-raised."""
+    if registry is None:
+        return _NULL_TIMER
+    return _Timer(registry, (('stage', stage),) + tuple(sorted(labels.items())))
+
+
+def inc(name, value=1, **labels):
+    """Add value to the counter name with labels."""
+    if registry is None:
+        return
+    registry.inc(name, value, tuple(sorted(labels.items())))
+
+
+def gauge(name, value, **labels):
+    """Set the gauge name with labels to value."""
+    if registry is None:
+        return
+    registry.gauge(name, value, tuple(sorted(labels.items())))
+
+
+def count(stage, rows=0, messages=0, nbytes=0):
+    """Add to a stage's row, message and byte counters in one call."""
+    if registry is None:
+        return
+    labels = (('stage', stage),)
+    if rows:
+        registry.inc('busdata_rows_total', rows, labels)
+    if messages:
+        registry.inc('busdata_messages_total', messages, labels)
+    if nbytes:
+        registry.inc('busdata_bytes_total', nbytes, labels)
+
+
+def merge(snapshot):
+    """Add a Registry.snapshot() from another process to the enabled registry."""
+    if registry is None:
+        return
+    registry.merge(snapshot)
+
+
+@contextlib.contextmanager
+def errors_counted_by_caller():
+    """Within the block, timers on this thread leave busdata_stage_errors_total to the caller.
+
+    For runners that count a failed call themselves, so it is counted once
+    whether or not the work inside has a timer of its own.
+    """
+    previous = getattr(_local, 'caller_counts_errors', False)
+    _local.caller_counts_errors = True
+    try:
+        yield
+    finally:
+        _local.caller_counts_errors = previous
+
+
+def enabled():
+    return registry is not None
+
+
+def serve(port, bind=''):
+    """Serve /metrics on port from a daemon thread; returns the server."""
+    # Imported here: http.server costs more start-up time than the rest of this module
+    import http.server
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = registry.prometheus().encode() if registry is not None else b""
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((bind, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f"Serving metrics at port {server.server_address[1]}/metrics")
+    return server
+
+
+class JSONDumper:
+    """Write the registry to path every interval seconds, and once more on close."""
+
+    def __init__(self, registry, path, interval=15.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._previous = None
+        self._last = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-dump', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        now = time.monotonic()
+        doc = self.registry.as_dict(self._previous, now - self._last)
+        self._previous, self._last = doc, now
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(doc, f, indent=1)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.error(f"Could not write metrics to {self.path}: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.dump()
+
+
+def configure(spec=None, interval=None):
+    """Turn metrics on as spec (default $BUSDATA_METRICS) says; returns the registry or None.
+
+    Calling it again once metrics are on returns the same registry.
+    """
+    global registry, trace
+    trace = os.environ.get('BUSDATA_TRACE', '') not in ('', '0')
+    if registry is not None:
+        return registry
+    spec = spec if spec is not None else os.environ.get('BUSDATA_METRICS', '')
+    if not spec:
+        return None
+    registry = Registry()
+    port = spec[1:] if spec.startswith(':') else spec
+    if port.isdigit():
+        serve(int(port))
+    else:
+        interval = interval or float(os.environ.get('BUSDATA_METRICS_INTERVAL') or 15)
+        atexit.register(JSONDumper(registry, spec, interval).close)
+    return registry
@@ -0,0 +1,127 @@
+"""Micro-batching of Pub/Sub messages with ack-after-commit semantics."""
+import logging
+import threading
+import time
+
+from pipeline import metrics
+from pipeline.publish import unpack_records
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Buffer subscriber messages and hand them to handler in bounded batches.
+
+    A batch is flushed when it holds max_rows records or its oldest message
+    is max_age seconds old. Messages are acked only after handler returns;
+    if it raises, the whole batch is nacked so Pub/Sub redelivers it. Use
+    ``add`` as the streaming-pull callback.
+
+    With dead_letter, a batch that fails is passed to dead_letter(records,
+    reason) instead and acked once that returns, so one poison batch is not
+    redelivered forever. Exceptions listed in transient (a lost database
+    connection, say) are still nacked and retried. A message that does
+    not decode is nacked on arrival, never acked.
+    """
+
+    def __init__(self, handler, max_rows=5000, max_age=5.0, dead_letter=None, transient=()):
+        self.handler = handler
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.dead_letter = dead_letter
+        self.transient = tuple(transient)
+        self.flushed_rows = 0
+        self.flushed_batches = 0
+        self.failed_batches = 0
+        self.dead_lettered_batches = 0
+        self._records = []
+        self._messages = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._ticker = threading.Thread(target=self._tick, daemon=True)
+        self._ticker.start()
+
+    def add(self, message):
+        try:
+            with metrics.timer('parse'):
+                records = unpack_records(message.data, message.attributes)
+        except ValueError as e:
+            # Never acked, so nothing is lost: the subscription's retry and dead-letter
+            # policy decide where it goes after repeated deliveries
+            logger.error(f"Nacking undecodable message {message.message_id}: {e}")
+            message.nack()
+            return
+        metrics.count('parse', rows=len(records), messages=1, nbytes=len(message.data))
+        with self._lock:
+            self._records.extend(records)
+            self._messages.append(message)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            buffered = len(self._records)
+            full = buffered >= self.max_rows
+        metrics.gauge('busdata_queue_depth', buffered, queue='microbatch')
+        if full:
+            self.flush()
+
+    def _tick(self):
+        interval = min(1.0, self.max_age / 4)
+        while not self._stop.wait(interval):
+            oldest = self._oldest
+            if oldest is not None and time.monotonic() - oldest >= self.max_age:
+                self.flush()
+
+    def flush(self):
+        """Process everything buffered so far; returns the number of rows handled."""
+        with self._flush_lock:
+            with self._lock:
+                records, messages = self._records, self._messages
+                self._records, self._messages, self._oldest = [], [], None
+            metrics.gauge('busdata_queue_depth', 0, queue='microbatch')
+            if not messages:
+                return 0
+            start = time.monotonic()
+            try:
+                self.handler(records)
+            except Exception as e:
+                self.failed_batches += 1
+                metrics.inc('busdata_stage_errors_total', stage='ack')
+                if self._dead_letter(records, e):
+                    self._ack(records, messages)
+                    return 0
+                logger.error(f"Batch of {len(records)} rows failed, nacking {len(messages)} messages: {e}")
+                for message in messages:
+                    message.nack()
+                return 0
+            self._ack(records, messages)
+            self.flushed_rows += len(records)
+            self.flushed_batches += 1
+            logger.info(f"Flushed {len(records)} rows from {len(messages)} messages "
+                        f"in {time.monotonic() - start:.2f}s")
+            return len(records)
+
+    def _dead_letter(self, records, error):
+        """Hand a failed batch to dead_letter; whether it took it."""
+        if self.dead_letter is None or isinstance(error, self.transient):
+            return False
+        try:
+            self.dead_letter(records, f"{type(error).__name__}: {error}")
+        except Exception as e:
+            logger.error(f"Could not dead-letter a batch of {len(records)} rows: {e}")
+            return False
+        self.dead_lettered_batches += 1
+        logger.error(f"Batch of {len(records)} rows failed and was dead-lettered: {error}")
+        return True
+
+    def _ack(self, records, messages):
+        with metrics.timer('ack'):
+            for message in messages:
+                message.ack()
+        metrics.count('ack', rows=len(records), messages=len(messages))
+
+    def close(self):
+        """Stop the age timer and flush whatever is left."""
+        self._stop.set()
+        self._ticker.join()
+        self.flush()
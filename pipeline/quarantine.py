@@ -0,0 +1,268 @@
+"""Quarantine for rejected rows and failed batches, kept until they are replayed.
+
+Subscribers put here what they cannot load:
+- rows that fail validation (stage ``validate``)
+- rows the database refuses (``load_<table>``)
+- whole batches whose processing raised (``batch``)
+
+Each put is one entry that records the dataset, the stage, a reason per
+row and the rows themselves. A subscriber's replay mode hands the
+pending entries to ``replay``, which runs each through validation and
+load again and marks it replayed once it is handled. Rows that still
+fail, and entries whose replay raises, are quarantined again as new
+entries, so nothing is lost and a replay never loops over its own output.
+
+Two stores share the interface:
+
+* QuarantineDir keeps one gzip NDJSON file per entry:
+  ``<root>/<dataset>/<stage>/<time>-<pid>-<n>.ndjson.gz``. Replayed
+  entries are moved into a ``replayed`` directory beside them.
+* QuarantineTable keeps rows in a Postgres ``quarantine`` table, one
+  JSONB record per row. Replayed entries get a replayed_at timestamp.
+
+    python -m pipeline.quarantine --dir quarantine      # pending rows by dataset, stage and reason
+"""
+import argparse
+import collections
+import glob
+import gzip
+import io
+import itertools
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+QUARANTINE_DDL = """
+CREATE TABLE IF NOT EXISTS quarantine (
+    id BIGSERIAL PRIMARY KEY,
+    entry BIGINT NOT NULL,
+    dataset VARCHAR NOT NULL,
+    stage VARCHAR NOT NULL,
+    reason TEXT,
+    record JSONB NOT NULL,
+    quarantined_at TIMESTAMP NOT NULL DEFAULT now(),
+    replayed_at TIMESTAMP
+);
+CREATE SEQUENCE IF NOT EXISTS quarantine_entry_seq;
+CREATE INDEX IF NOT EXISTS quarantine_pending_idx ON quarantine (dataset, entry) WHERE replayed_at IS NULL;
+"""
+
+
+class Entry:
+    """One quarantined batch: where it came from, and its rows with a ``reason`` column."""
+
+    def __init__(self, key, dataset, stage, rows):
+        self.key = key
+        self.dataset = dataset
+        self.stage = stage
+        self.rows = rows
+
+    @property
+    def records(self):
+        """The rows without their reason, as handed to put."""
+        return self.rows.drop(columns=['reason'], errors='ignore')
+
+    def __repr__(self):
+        return f"Entry({self.dataset}/{self.stage}, {len(self.rows)} rows)"
+
+
+def _with_reason(rows, reason):
+    # Imported here so that loading this module (e.g. for --help from the CLI) stays fast
+    import pandas as pd
+
+    if not isinstance(rows, pd.DataFrame):
+        rows = pd.DataFrame(rows)
+    if reason is not None or 'reason' not in rows.columns:
+        rows = rows.assign(reason=reason)
+    return rows
+
+
+def _to_ndjson(rows):
+    # 15 digits, the most to_json writes, so replayed coordinates match the originals
+    return rows.to_json(orient='records', lines=True, date_format='iso', date_unit='us',
+                        double_precision=15, default_handler=str)
+
+
+def _from_ndjson(text):
+    import pandas as pd
+
+    if not text.strip():
+        return pd.DataFrame(columns=['reason'])
+    # Values come back as JSON gave them; loaders convert the columns they type
+    return pd.read_json(io.StringIO(text), lines=True, dtype=False, convert_dates=False,
+                        precise_float=True)
+
+
+class QuarantineDir:
+    """Quarantine entries as gzip NDJSON files under root."""
+
+    def __init__(self, root):
+        self.root = root
+        self._counter = itertools.count()
+
+    def put(self, dataset, stage, rows, reason=None):
+        """Quarantine rows (a DataFrame or list of records); reason overrides a ``reason`` column."""
+        rows = _with_reason(rows, reason)
+        if len(rows) == 0:
+            return None
+        directory = os.path.join(self.root, dataset, stage)
+        os.makedirs(directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(self._counter):05d}.ndjson.gz"
+        path = os.path.join(directory, name)
+        tmp = path + '.tmp'
+        with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+            f.write(_to_ndjson(rows))
+        os.replace(tmp, path)
+        logger.warning(f"Quarantined {len(rows)} {dataset} rows at {stage} in {path}")
+        return path
+
+    def _paths(self, dataset, stages=None):
+        paths = glob.glob(os.path.join(self.root, dataset, '*', '*.ndjson.gz'))
+        paths = [p for p in paths if stages is None or os.path.basename(os.path.dirname(p)) in stages]
+        # Names start with the time they were written
+        return sorted(paths, key=os.path.basename)
+
+    def pending(self, dataset, stages=None):
+        """Yield the entries of dataset not yet replayed, oldest first, as listed when called."""
+        for path in self._paths(dataset, stages):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                rows = _from_ndjson(f.read())
+            yield Entry(path, dataset, os.path.basename(os.path.dirname(path)), rows)
+
+    def done(self, entry):
+        """Mark an entry replayed."""
+        replayed = os.path.join(os.path.dirname(entry.key), 'replayed')
+        os.makedirs(replayed, exist_ok=True)
+        os.replace(entry.key, os.path.join(replayed, os.path.basename(entry.key)))
+
+    def summary(self):
+        """Pending row counts by (dataset, stage, reason)."""
+        counts = collections.Counter()
+        for dataset in sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []:
+            for entry in self.pending(dataset):
+                for reason, n in entry.rows['reason'].fillna('').value_counts().items():
+                    counts[(dataset, entry.stage, reason)] += int(n)
+        return counts
+
+
+class QuarantineTable:
+    """Quarantine entries as rows of a Postgres table, on the loader's own connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        with conn.cursor() as cursor:
+            cursor.execute(QUARANTINE_DDL)
+        conn.commit()
+
+    def put(self, dataset, stage, rows, reason=None):
+        """Quarantine rows (a DataFrame or list of records); reason overrides a ``reason`` column."""
+        rows = _with_reason(rows, reason)
+        if len(rows) == 0:
+            return None
+        import pandas as pd
+
+        reasons = rows['reason'].astype(object).where(rows['reason'].notna(), None).tolist()
+        records = _to_ndjson(rows.drop(columns=['reason'])).splitlines()
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT nextval('quarantine_entry_seq')")
+            entry = cursor.fetchone()[0]
+            buffer = io.StringIO()
+            pd.DataFrame({'entry': entry, 'dataset': dataset, 'stage': stage,
+                          'reason': reasons, 'record': records}).to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            cursor.copy_expert("COPY quarantine (entry, dataset, stage, reason, record) "
+                               "FROM STDIN WITH (FORMAT csv)", buffer)
+        self.conn.commit()
+        logger.warning(f"Quarantined {len(rows)} {dataset} rows at {stage} as entry {entry}")
+        return entry
+
+    def pending(self, dataset, stages=None):
+        """Yield the entries of dataset not yet replayed, oldest first, as listed when called."""
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT DISTINCT entry, stage FROM quarantine "
+                           "WHERE dataset = %s AND replayed_at IS NULL ORDER BY entry", (dataset,))
+            entries = [(e, s) for e, s in cursor.fetchall() if stages is None or s in stages]
+        for entry, stage in entries:
+            with self.conn.cursor() as cursor:
+                cursor.execute("SELECT record::text, reason FROM quarantine "
+                               "WHERE entry = %s ORDER BY id", (entry,))
+                fetched = cursor.fetchall()
+            self.conn.commit()
+            rows = _from_ndjson("\n".join(record for record, _ in fetched))
+            rows['reason'] = [reason for _, reason in fetched]
+            yield Entry(entry, dataset, stage, rows)
+
+    def done(self, entry):
+        """Mark an entry replayed."""
+        with self.conn.cursor() as cursor:
+            cursor.execute("UPDATE quarantine SET replayed_at = now() WHERE entry = %s", (entry.key,))
+        self.conn.commit()
+
+    def summary(self):
+        """Pending row counts by (dataset, stage, reason)."""
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT dataset, stage, coalesce(reason, ''), count(*) FROM quarantine "
+                           "WHERE replayed_at IS NULL GROUP BY 1, 2, 3 ORDER BY 1, 2, 3")
+            counts = collections.Counter({tuple(row[:3]): row[3] for row in cursor.fetchall()})
+        self.conn.commit()
+        return counts
+
+
+def replay(store, dataset, handle, transient=()):
+    """Hand each pending entry of dataset to handle(entry, records); returns (rows replayed, entries failed).
+
+    records are the entry's rows without the old ``reason`` column, as they
+    were before validation or load refused them. An entry whose handle
+    raises is quarantined again under its stage with the error as reason,
+    and the replay moves on to the next. Either way the old entry is marked
+    replayed. Exceptions in transient, such as a lost connection, end the
+    replay and leave the entry pending.
+    """
+    replayed = failed = 0
+    for entry in store.pending(dataset):
+        records = entry.records
+        try:
+            handle(entry, records)
+        except transient:
+            raise
+        except Exception as error:
+            logger.error(f"Replay of {entry!r} failed: {error}")
+            store.put(dataset, entry.stage, records, reason=f"{type(error).__name__}: {error}")
+            failed += 1
+        else:
+            replayed += len(records)
+        store.done(entry)
+    return replayed, failed
+
+
+def open_quarantine(spec, connect=None):
+    """QuarantineTable on connect() when spec is 'postgres', otherwise QuarantineDir(spec); None when spec is empty."""
+    if not spec:
+        return None
+    if spec == 'postgres':
+        return QuarantineTable(connect())
+    return QuarantineDir(spec)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show the rows waiting in a quarantine.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--dir', help="quarantine directory")
+    source.add_argument('--dsn', help="Postgres database holding the quarantine table")
+    args = parser.parse_args(argv)
+
+    if args.dir:
+        store = QuarantineDir(args.dir)
+    else:
+        import psycopg2
+        store = QuarantineTable(psycopg2.connect(args.dsn))
+    counts = store.summary()
+    for (dataset, stage, reason), n in sorted(counts.items()):
+        print(f"{dataset:<12} {stage:<16} {n:>9}  {reason}")
+    print(f"{sum(counts.values())} rows pending")
+
+
+if __name__ == "__main__":
+    main()
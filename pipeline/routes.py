@@ -0,0 +1,150 @@
+"""Route, direction and service key on trip rows, taken from stop events.
+
+Breadcrumbs carry no route, so trip.route_id and trip.direction used to
+be filled only at query time, by joining stopevent through trip_stop.
+Here each stop-event batch is reduced to one row per trip (the stop
+events' pdx_trip is the breadcrumbs' EVENT_NO_TRIP) and merged into
+``trip_route``. Then the trips it names are updated in one UPDATE ...
+FROM statement.
+
+The two subscribers meet in the database, so neither stream has to
+arrive first:
+
+* The stop-event side writes trip_route, then updates the trips already
+  loaded (apply).
+* The breadcrumb side updates the trips it has just loaded from
+  whatever trip_route already holds (enrich_trips).
+
+Each side commits before it reads the other's table, so whichever
+commits last fills the trip. Both updates touch only the batch's trip
+ids, through the primary keys.
+
+TripRouteIndex remembers what it has already written, so the many stop
+events of one trip, or a replayed batch, do not cause repeated writes.
+"""
+import logging
+
+import pandas as pd
+
+from pipeline.load import copy_dataframe
+
+logger = logging.getLogger(__name__)
+
+TRIP_ROUTE_DDL = """
+CREATE TABLE IF NOT EXISTS trip_route (
+    trip_id INT PRIMARY KEY,
+    route_id INT,
+    direction INT,
+    service_key VARCHAR
+);
+CREATE INDEX IF NOT EXISTS trip_route_id_idx ON trip (route_id);
+"""
+
+ROUTE_COLUMNS = ['route_id', 'direction', 'service_key']
+TRIP_ROUTE_KEY = ('trip_id',)
+
+UPDATE_SQL = """
+UPDATE trip t
+SET route_id = r.route_id, direction = r.direction, service_key = r.service_key
+FROM trip_route r
+WHERE r.trip_id = t.trip_id AND t.trip_id = ANY(%s)
+  AND (t.route_id, t.direction, t.service_key)
+      IS DISTINCT FROM (r.route_id, r.direction, r.service_key)
+"""
+
+
+def trip_routes(stop_events):
+    """One (trip_id, route_id, direction, service_key) row per trip in a frame of stop-event records."""
+    service_key = stop_events['service_key']
+    routes = pd.DataFrame({
+        'trip_id': pd.to_numeric(stop_events['pdx_trip'], errors='coerce'),
+        'route_id': pd.to_numeric(stop_events['route_number'], errors='coerce'),
+        'direction': pd.to_numeric(stop_events['direction'], errors='coerce'),
+        # A missing key stays null rather than becoming the string 'nan'
+        'service_key': service_key.astype(str).where(service_key.notna()),
+    }).dropna(subset=['trip_id'])
+    routes = routes.drop_duplicates(subset=['trip_id'], keep='first')
+    return routes.astype({'trip_id': 'int64', 'route_id': 'Int64', 'direction': 'Int64'})
+
+
+def enrich_trips(conn, trip_ids):
+    """Copy trip_route onto the given trips where it differs; returns the trips updated. Commits."""
+    ids = sorted({int(t) for t in trip_ids})
+    if not ids:
+        return 0
+    with conn.cursor() as cursor:
+        cursor.execute(UPDATE_SQL, (ids,))
+        updated = cursor.rowcount
+    conn.commit()
+    return updated
+
+
+class TripRouteIndex:
+    """In-memory trip_id -> route, direction and service key, written through to trip_route and trip.
+
+    Only trips that are new to the index, or whose attributes changed, are
+    written. Once the index holds max_trips trips it is cleared, which
+    keeps memory flat on a long run at the cost of rewriting a few trips.
+    """
+
+    def __init__(self, max_trips=500_000):
+        self.max_trips = max_trips
+        self.routes = pd.DataFrame(columns=ROUTE_COLUMNS, index=pd.Index([], name='trip_id', dtype='int64'))
+
+    def __len__(self):
+        return len(self.routes)
+
+    def changed(self, routes):
+        """The rows of routes that are new to the index or differ from it."""
+        routes = routes.set_index('trip_id')[ROUTE_COLUMNS]
+        known = self.routes.reindex(routes.index)
+        same = pd.Series(True, index=routes.index)
+        for column in ROUTE_COLUMNS:
+            old, new = known[column], routes[column]
+            same &= (old == new).fillna(False).astype(bool) | (old.isna() & new.isna())
+        return routes.loc[~same].reset_index()
+
+    def remember(self, routes):
+        """Add or replace the rows of routes in the index."""
+        routes = routes.set_index('trip_id')[ROUTE_COLUMNS]
+        if len(self.routes) + len(routes) > self.max_trips:
+            self.routes = self.routes.iloc[:0]
+        kept = self.routes.drop(routes.index, errors='ignore')
+        self.routes = pd.concat([kept, routes]) if len(kept) else routes
+
+    def apply(self, conn, stop_events, quarantine=None):
+        """Record the trips of a stop-event batch and fill them in on trip; returns the trips updated.
+
+        Trips whose trip_route row is refused are logged, left out of the
+        index so a later batch writes them again, and, with a quarantine,
+        their stop events are quarantined at load_trip_route for replay.
+        """
+        fresh = self.changed(trip_routes(stop_events))
+        if len(fresh) == 0:
+            return 0
+        result = copy_dataframe(conn, 'trip_route', fresh[['trip_id'] + ROUTE_COLUMNS],
+                                merge_key=TRIP_ROUTE_KEY, update=ROUTE_COLUMNS)
+        if result.failed:
+            refused = result.failed_rows()
+            logger.warning(f"trip_route refused {len(refused)} trips: "
+                           f"{'; '.join(refused['reason'].astype(str).unique())}")
+            if quarantine is not None:
+                reasons = refused.set_index('trip_id')['reason']
+                trip_ids = pd.to_numeric(stop_events['pdx_trip'], errors='coerce')
+                refused_events = trip_ids.isin(reasons.index)
+                events = stop_events.loc[refused_events].assign(
+                    reason=trip_ids.loc[refused_events].map(reasons).to_numpy())
+                quarantine.put('stopevent', 'load_trip_route', events)
+            fresh = fresh.loc[~fresh['trip_id'].isin(refused['trip_id'])]
+        updated = enrich_trips(conn, fresh['trip_id'])
+        # Only once both writes have committed, so a failed batch is written again on redelivery
+        self.remember(fresh)
+        logger.info(f"Routes for {len(fresh)} trips recorded, {updated} trips updated")
+        return updated
+
+
+def ensure_trip_route(conn):
+    """Create trip_route, and the index on trip.route_id for route-level queries, if missing."""
+    with conn.cursor() as cursor:
+        cursor.execute(TRIP_ROUTE_DDL)
+    conn.commit()
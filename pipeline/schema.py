@@ -0,0 +1,195 @@
+"""Postgres schema for trip, breadcrumb and stopevent, with breadcrumb partitioned by day.
+
+breadcrumb is range-partitioned on tstamp, one partition per service day,
+named ``breadcrumb_pYYYYMMDD``. These indexes are declared on the parent
+and so exist on every partition:
+
+    breadcrumb_trip_id_tstamp_key  unique btree (trip_id, tstamp): trip
+                                   lookups and the merge key for reloads
+    breadcrumb_tstamp_brin         BRIN on tstamp: time windows inside a day
+
+Bounding-box queries (``point(longitude, latitude) <@ box(...)``) use a
+GiST index that only closed days get. Maintaining GiST row by row made
+loads about three times slower, while building it once over a finished
+day's partition takes seconds, so ensure_partitions indexes the days
+behind the current batch whenever it opens a new one.
+
+Time-window queries are pruned to the partitions they touch, and loads only
+ever write to the current day's partition, so neither slows down as
+history grows. Old days can be detached or dropped as whole partitions.
+Partitions are not created ahead of time: loaders call ensure_partitions
+with the days present in each batch.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+TRIP_DDL = """
+CREATE TABLE IF NOT EXISTS trip (
+    trip_id INT PRIMARY KEY,
+    route_id INT,
+    vehicle_id INT,
+    service_key VARCHAR,
+    direction INT
+)
+"""
+
+BREADCRUMB_DDL = """
+CREATE TABLE IF NOT EXISTS breadcrumb (
+    tstamp TIMESTAMP NOT NULL,
+    latitude FLOAT,
+    longitude FLOAT,
+    speed FLOAT,
+    trip_id INT NOT NULL,
+    CONSTRAINT breadcrumb_trip_id_tstamp_key UNIQUE (trip_id, tstamp)
+) PARTITION BY RANGE (tstamp);
+CREATE INDEX IF NOT EXISTS breadcrumb_tstamp_brin ON breadcrumb USING brin (tstamp);
+"""
+
+SPATIAL_INDEX = "CREATE INDEX IF NOT EXISTS {name}_position_gist ON {name} USING gist (point(longitude, latitude))"
+
+STOPEVENT_DDL = """
+CREATE TABLE IF NOT EXISTS stopevent (
+    pdx_trip INT,
+    date DATE,
+    vehicle_number INT,
+    leave_time INT,
+    train INT,
+    route_number INT,
+    direction INT,
+    service_key VARCHAR,
+    trip_number INT,
+    stop_time INT,
+    arrive_time INT,
+    dwell INT,
+    location_id INT,
+    door INT,
+    lift INT,
+    ons INT,
+    offs INT,
+    estimated_load INT,
+    maximum_speed INT,
+    train_mileage FLOAT,
+    pattern_distance INT,
+    location_distance INT,
+    x_coordinate FLOAT,
+    y_coordinate FLOAT,
+    data_source INT,
+    schedule_status INT,
+    PRIMARY KEY (trip_number, stop_time, location_id)
+);
+CREATE INDEX IF NOT EXISTS stopevent_date_idx ON stopevent (date);
+CREATE INDEX IF NOT EXISTS stopevent_pdx_trip_idx ON stopevent (pdx_trip);
+"""
+
+
+def partition_name(day):
+    return f"breadcrumb_p{day.strftime('%Y%m%d')}"
+
+
+def is_partitioned(conn, table='breadcrumb'):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def ensure_schema(conn):
+    """Create any missing table and index. Existing tables are left as they are.
+
+    A breadcrumb table from before partitioning is reported, not converted;
+    see partition_breadcrumbs.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(TRIP_DDL)
+        cursor.execute("SELECT to_regclass('breadcrumb')")
+        if cursor.fetchone()[0] is None:
+            cursor.execute(BREADCRUMB_DDL)
+        elif not is_partitioned(conn):
+            logger.warning("breadcrumb is not partitioned; run partition_breadcrumbs() to convert it")
+        cursor.execute(STOPEVENT_DDL)
+    conn.commit()
+
+
+def ensure_partitions(conn, days):
+    """Create the daily breadcrumb partitions for days (dates or timestamps) that are missing.
+
+    Opening a new day also builds the spatial index on every day before the
+    earliest one in days, which this batch no longer writes to.
+    A no-op when breadcrumb is not partitioned. Commits.
+    """
+    if not is_partitioned(conn):
+        return []
+    days = sorted({d.date() if hasattr(d, 'date') else d for d in days})
+    created = []
+    with conn.cursor() as cursor:
+        for day in days:
+            name = partition_name(day)
+            cursor.execute("SELECT to_regclass(%s)", (name,))
+            if cursor.fetchone()[0] is not None:
+                continue
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF breadcrumb "
+                           f"FOR VALUES FROM (%s) TO (%s::date + 1)", (day, day))
+            created.append(name)
+    conn.commit()
+    if created:
+        logger.info(f"Created breadcrumb partitions {', '.join(created)}")
+        index_closed_partitions(conn, days[0])
+    return created
+
+
+def index_closed_partitions(conn, before):
+    """Build the spatial index on every breadcrumb partition for days before the given day."""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'breadcrumb'::regclass AND c.relname < %s
+              AND to_regclass(c.relname || '_position_gist') IS NULL
+            ORDER BY c.relname
+        """, (partition_name(before),))
+        names = [name for name, in cursor.fetchall()]
+        for name in names:
+            cursor.execute(SPATIAL_INDEX.format(name=name))
+            conn.commit()
+            logger.info(f"Built spatial index on {name}")
+    return names
+
+
+def breadcrumb_days(df, column='tstamp'):
+    """Distinct service days in a breadcrumb frame, for ensure_partitions."""
+    return df[column].dt.normalize().unique().tolist()
+
+
+def partition_breadcrumbs(conn):
+    """Convert an unpartitioned breadcrumb table in place, in one transaction.
+
+    The old table is renamed to breadcrumb_unpartitioned and its rows are
+    copied into the new partitions; drop it once the copy is checked.
+    """
+    if is_partitioned(conn):
+        return 0
+    with conn.cursor() as cursor:
+        cursor.execute("ALTER TABLE breadcrumb RENAME TO breadcrumb_unpartitioned")
+        # Free the index names (including the unique key's) for the new table
+        cursor.execute("SELECT indexrelid::regclass::text FROM pg_index "
+                       "WHERE indrelid = 'breadcrumb_unpartitioned'::regclass")
+        for (name,) in cursor.fetchall():
+            cursor.execute(f"ALTER INDEX {name} RENAME TO {name}_old")
+        cursor.execute(BREADCRUMB_DDL)
+        cursor.execute("SELECT DISTINCT tstamp::date FROM breadcrumb_unpartitioned WHERE tstamp IS NOT NULL")
+        days = [day for day, in cursor.fetchall()]
+        for day in days:
+            cursor.execute(f"CREATE TABLE {partition_name(day)} PARTITION OF breadcrumb "
+                           f"FOR VALUES FROM (%s) TO (%s::date + 1)", (day, day))
+        cursor.execute("""
+            INSERT INTO breadcrumb (tstamp, latitude, longitude, speed, trip_id)
+            SELECT DISTINCT ON (trip_id, tstamp) tstamp, latitude, longitude, speed, trip_id
+            FROM breadcrumb_unpartitioned
+            WHERE tstamp IS NOT NULL AND trip_id IS NOT NULL
+        """)
+        rows = cursor.rowcount
+        for day in days:
+            cursor.execute(SPATIAL_INDEX.format(name=partition_name(day)))
+    conn.commit()
+    logger.info(f"Moved {rows} breadcrumbs into daily partitions")
+    return rows
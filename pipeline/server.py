@@ -0,0 +1,345 @@
+"""Threaded static file server with an in-memory, precompressed file cache.
+
+Each request runs on its own thread, so a slow client no longer holds up
+everyone else, and connections are kept alive (HTTP/1.1). Files up to
+max_file_bytes are read once and kept in memory, with gzip and, when the
+brotli package is installed, brotli copies made at load time for text
+types such as GeoJSON. An entry is reloaded when the file's mtime or size
+changes, and the least recently used entries are dropped once the cache
+passes max_bytes. Bigger files are streamed from disk uncompressed.
+
+Responses carry an ETag per encoding, Last-Modified and Cache-Control:
+no-cache, so browsers revalidate with If-None-Match and get a 304 when
+nothing changed. Single byte ranges (Range, If-Range) are served from
+the uncompressed body.
+
+    python -m pipeline.server --directory "Project Assignment-3/Visualization" --port 8000
+"""
+import argparse
+import collections
+import email.utils
+import functools
+import gzip
+import hashlib
+import http.server
+import mimetypes
+import os
+import re
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+mimetypes.add_type('application/geo+json', '.geojson')
+mimetypes.add_type('application/x-protobuf', '.pbf')
+
+COMPRESSIBLE = {'application/geo+json', 'application/json', 'application/javascript',
+                'application/xml', 'image/svg+xml'}
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class CachedFile:
+    """One file's validators and, when cached, its body under each content coding."""
+
+    def __init__(self, path, stat, content_type, body=None):
+        self.path = path
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.content_type = content_type
+        self.last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        self.bodies = {}
+        if body is None:
+            self.etag = f'"{self.size:x}-{self.mtime_ns:x}"'
+        else:
+            self.etag = f'"{hashlib.sha256(body).hexdigest()[:20]}"'
+            self.bodies['identity'] = body
+
+    @property
+    def nbytes(self):
+        return sum(len(body) for body in self.bodies.values())
+
+    def etag_for(self, encoding):
+        return self.etag if encoding == 'identity' else f'{self.etag[:-1]}-{encoding}"'
+
+    def matches(self, stat):
+        return stat.st_mtime_ns == self.mtime_ns and stat.st_size == self.size
+
+
+class FileCache:
+    """Files by path, kept compressed and uncompressed, evicted least recently used first."""
+
+    def __init__(self, max_bytes=256 * 1024 ** 2, max_file_bytes=64 * 1024 ** 2,
+                 gzip_level=6, brotli_quality=5):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.hits = 0
+        self.loads = 0
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, stat):
+        """The entry for path as of stat, loading (and compressing) it when stale."""
+        entry = self._current(path, stat)
+        if entry is not None:
+            return entry
+        if stat.st_size > self.max_file_bytes:
+            return CachedFile(path, stat, self.content_type(path))
+        # One thread loads a given file; the others wait for it rather than repeat the work
+        with self._lock:
+            loading = self._loading.setdefault(path, threading.Lock())
+        with loading:
+            entry = self._current(path, stat)
+            if entry is None:
+                entry = self._load(path, stat)
+                self._store(path, entry)
+        with self._lock:
+            self._loading.pop(path, None)
+        return entry
+
+    def _current(self, path, stat):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or not entry.matches(stat):
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry
+
+    def _load(self, path, stat):
+        with open(path, 'rb') as f:
+            body = f.read()
+        entry = CachedFile(path, os.stat(path) if len(body) != stat.st_size else stat,
+                           self.content_type(path), body)
+        if self.compressible(entry.content_type) and len(body) > 1024:
+            variants = {'gzip': gzip.compress(body, self.gzip_level, mtime=0)}
+            if brotli is not None:
+                variants['br'] = brotli.compress(body, quality=self.brotli_quality)
+            for encoding, data in variants.items():
+                # Not worth a second copy unless it saves a tenth
+                if len(data) < len(body) * 0.9:
+                    entry.bodies[encoding] = data
+        self.loads += 1
+        return entry
+
+    def _store(self, path, entry):
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[path] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    @staticmethod
+    def content_type(path):
+        content_type, _ = mimetypes.guess_type(path)
+        return content_type or 'application/octet-stream'
+
+    @staticmethod
+    def compressible(content_type):
+        return content_type.startswith('text/') or content_type in COMPRESSIBLE
+
+
+def accepted_encodings(header):
+    """Content codings from an Accept-Encoding header, mapped to their q values."""
+    codings = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if not coding:
+            continue
+        q = 1.0
+        match = re.search(r'q\s*=\s*([0-9.]+)', params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        codings[coding.strip().lower()] = q
+    return codings
+
+
+class StaticHandler(http.server.SimpleHTTPRequestHandler):
+    """SimpleHTTPRequestHandler with cached, compressed, conditional and ranged file responses.
+
+    Directory listings and redirects still come from the base class.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; with keep-alive, Nagle
+    # would hold the body back until the client's delayed ACK
+    disable_nagle_algorithm = True
+    cache = FileCache()
+    quiet = False
+
+    def do_GET(self):
+        self.send_static(head=False)
+
+    def do_HEAD(self):
+        self.send_static(head=True)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def file_path(self):
+        """The file a request maps to, or None to let the base class handle it."""
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            if not self.path.split('?', 1)[0].split('#', 1)[0].endswith('/'):
+                return None
+            path = os.path.join(path, 'index.html')
+        return path if os.path.isfile(path) else None
+
+    def send_static(self, head):
+        path = self.file_path()
+        try:
+            stat = os.stat(path) if path else None
+            entry = self.cache.get(path, stat) if stat else None
+        except OSError:
+            entry = None
+        if entry is None:
+            return super().do_HEAD() if head else super().do_GET()
+
+        encoding = self.choose_encoding(entry)
+        etag = entry.etag_for(encoding)
+        if self.not_modified(entry, etag):
+            self.send_response(304)
+            self.send_validators(entry, etag)
+            self.end_headers()
+            return
+
+        size = len(entry.bodies[encoding]) if entry.bodies else entry.size
+        start, stop = 0, size
+        byte_range = self.requested_range(entry, size) if encoding == 'identity' else None
+        if byte_range == 'unsatisfiable':
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if byte_range:
+            start, stop = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{stop - 1}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', entry.content_type)
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(stop - start))
+        self.send_validators(entry, etag)
+        self.end_headers()
+        if head:
+            return
+        if entry.bodies:
+            self.wfile.write(memoryview(entry.bodies[encoding])[start:stop])
+        else:
+            self.copy_range(entry.path, start, stop)
+
+    def choose_encoding(self, entry):
+        # Ranges address the uncompressed bytes
+        if len(entry.bodies) < 2 or 'Range' in self.headers:
+            return 'identity'
+        codings = accepted_encodings(self.headers.get('Accept-Encoding'))
+        for encoding in ('br', 'gzip'):
+            if encoding in entry.bodies and codings.get(encoding, codings.get('*', 0)) > 0:
+                return encoding
+        return 'identity'
+
+    def not_modified(self, entry, etag):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+            return '*' in tags or etag in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            return entry.mtime_ns // 1_000_000_000 <= since
+        return False
+
+    def requested_range(self, entry, size):
+        """(start, stop) of a single satisfiable byte range, 'unsatisfiable', or None for the whole body."""
+        header = self.headers.get('Range')
+        if not header:
+            return None
+        if_range = self.headers.get('If-Range')
+        if if_range is not None and if_range.strip() != entry.etag:
+            return None
+        match = RANGE.match(header.strip())
+        if not match or match.groups() == ('', ''):
+            # Multiple or malformed ranges: the whole body is an allowed answer
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            stop = min(int(last) + 1, size) if last else size
+            if last and int(last) < start:
+                return None
+        else:
+            start, stop = max(size - int(last), 0), size
+        if start >= size or start >= stop:
+            return 'unsatisfiable'
+        return start, stop
+
+    def send_validators(self, entry, etag):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', entry.last_modified)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Accept-Ranges', 'bytes')
+        if len(entry.bodies) > 1:
+            self.send_header('Vary', 'Accept-Encoding')
+
+    def copy_range(self, path, start, stop, chunk=256 * 1024):
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                data = f.read(min(chunk, remaining))
+                if not data:
+                    break
+                self.wfile.write(data)
+                remaining -= len(data)
+
+
+def serve(directory='.', port=8000, handler=StaticHandler, cache=None, quiet=False, bind=''):
+    """Serve directory until interrupted, one thread per connection."""
+    attributes = {'quiet': quiet}
+    if cache is not None:
+        attributes['cache'] = cache
+    handler = functools.partial(type(handler.__name__, (handler,), attributes), directory=directory)
+    with http.server.ThreadingHTTPServer((bind, port), handler) as httpd:
+        print(f"serving {directory} at port {httpd.server_address[1]}", flush=True)
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--directory', default='.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--bind', default='')
+    parser.add_argument('--cache-mb', type=int, default=256, help="in-memory cache size")
+    parser.add_argument('--max-file-mb', type=int, default=64,
+                        help="larger files are streamed from disk, uncompressed")
+    parser.add_argument('--quiet', action='store_true', help="don't log each request")
+    args = parser.parse_args(argv)
+    cache = FileCache(args.cache_mb * 1024 ** 2, args.max_file_mb * 1024 ** 2)
+    serve(args.directory, args.port, cache=cache, quiet=args.quiet, bind=args.bind)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Stop-event columns, validation rules and getStopEvents page parsing."""
+from datetime import datetime
+from html.parser import HTMLParser
+
+from pipeline import metrics
+from pipeline.validation import Columns, Consistent, InRange, NotNull, Unique
+
+# Record keys in stopevent table column order
+STOPEVENT_COLUMNS = [
+    'pdx_trip', 'date', 'vehicle_num', 'leave_time', 'train', 'route_number',
+    'direction', 'service_key', 'trip_number', 'stop_time', 'arrive_time',
+    'dwell', 'location_id', 'door', 'lift', 'ons', 'offs', 'estimated_load',
+    'maximum_speed', 'train_mileage', 'pattern_distance', 'location_distance',
+    'x_coordinate', 'y_coordinate', 'data_source', 'schedule_status',
+]
+
+# Record keys whose stopevent table column has a different name
+TABLE_COLUMNS = {'vehicle_num': 'vehicle_number'}
+
+# Natural key of a stop event, used to merge replays idempotently
+STOPEVENT_KEY = ('trip_number', 'stop_time', 'location_id')
+
+STOPEVENT_RULES = [
+    Columns(STOPEVENT_COLUMNS),
+    NotNull(name="no missing values"),
+    Unique(quarantine=False),
+    Consistent('trip_number', 'route_number', quarantine=False),
+    # A TriMet bus should not exceed 100 miles per hour
+    InRange('maximum_speed', high=100, quarantine=False),
+]
+
+# Table cells in page order; each row also gets pdx_trip and date
+CELL_COLUMNS = STOPEVENT_COLUMNS[2:]
+
+# Elements without an end tag, which do not open a nesting level
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+                 'link', 'meta', 'source', 'track', 'wbr'}
+
+
+class StopEventTableParser(HTMLParser):
+    """Streaming extractor for getStopEvents pages built on html.parser.
+
+    Collects td text straight into per-column lists. The first row of every
+    table is its header and is skipped, and each table takes its PDX_TRIP
+    from the last word of the nearest h2 before it at the same nesting
+    level, like find_previous_sibling('h2') in the original parser.
+    """
+
+    def __init__(self, columns):
+        super().__init__(convert_charrefs=True)
+        self.columns = columns
+        # Open elements, and the PDX_TRIP of the last h2 closed at each level
+        self._depth = 0
+        self._pdx_trips = {}
+        self._pdx_trip = ''
+        self._h2 = None
+        self._rows_in_table = 0
+        self._cells = None
+        self._text = None
+
+    def handle_starttag(self, tag, attrs):
+        level = self._depth
+        if tag not in VOID_ELEMENTS:
+            self._depth += 1
+        if tag == 'h2':
+            self._h2 = []
+        elif tag == 'table':
+            self._pdx_trip = self._pdx_trips.get(level, '')
+            self._rows_in_table = 0
+        elif tag == 'tr':
+            self._rows_in_table += 1
+            self._cells = []
+        elif tag == 'td' and self._cells is not None:
+            self._text = []
+
+    def handle_endtag(self, tag):
+        if tag not in VOID_ELEMENTS:
+            self._depth = max(self._depth - 1, 0)
+            # Headings inside the closed element are not siblings of anything after it
+            for level in [level for level in self._pdx_trips if level > self._depth]:
+                del self._pdx_trips[level]
+        if tag == 'h2' and self._h2 is not None:
+            words = ''.join(self._h2).split()
+            self._pdx_trips[self._depth] = words[-1] if words else ''
+            self._h2 = None
+        elif tag == 'td' and self._text is not None:
+            self._cells.append(''.join(self._text))
+            self._text = None
+        elif tag == 'tr' and self._cells is not None:
+            if self._rows_in_table > 1 and len(self._cells) >= len(CELL_COLUMNS):
+                self.columns['pdx_trip'].append(self._pdx_trip)
+                for name, value in zip(CELL_COLUMNS, self._cells):
+                    self.columns[name].append(value)
+            self._cells = None
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+        elif self._h2 is not None:
+            self._h2.append(data)
+
+
+def _parse_stream(html, columns):
+    parser = StopEventTableParser(columns)
+    parser.feed(html)
+    parser.close()
+
+
+def _parse_lxml(html, columns):
+    import lxml.html
+
+    document = lxml.html.fromstring(html)
+    for table in document.iter('table'):
+        h2 = next(table.itersiblings('h2', preceding=True), None)
+        pdx_trip = h2.text_content().split()[-1] if h2 is not None else ''
+        rows = table.iter('tr')
+        next(rows, None)  # Skip the header row
+        for row in rows:
+            cells = row.findall('.//td')
+            if len(cells) < len(CELL_COLUMNS):
+                continue
+            columns['pdx_trip'].append(pdx_trip)
+            for name, cell in zip(CELL_COLUMNS, cells):
+                # Plain cells have no children, so .text avoids walking the subtree
+                columns[name].append(''.join(cell.itertext()) if len(cell) else cell.text or '')
+
+
+def _parse_bs4(html, columns):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    for table in soup.find_all('table'):
+        pdx_trip = table.find_previous_sibling('h2').text.split()[-1]
+        for row in table.find_all('tr')[1:]:
+            cells = row.find_all('td')
+            if len(cells) < len(CELL_COLUMNS):
+                continue
+            columns['pdx_trip'].append(pdx_trip)
+            for name, cell in zip(CELL_COLUMNS, cells):
+                columns[name].append(cell.text)
+
+
+BACKENDS = {'lxml': _parse_lxml, 'stream': _parse_stream, 'bs4': _parse_bs4}
+
+
+def default_backend():
+    try:
+        import lxml.html  # noqa: F401
+        return 'lxml'
+    except ImportError:
+        return 'stream'
+
+
+def parse_stop_events(html, date=None, backend=None):
+    """Parse a getStopEvents page into a dict of column name -> list of values.
+
+    Values are the cell text exactly as the original BeautifulSoup parser
+    produced it. date defaults to today, as before.
+    """
+    columns = {name: [] for name in STOPEVENT_COLUMNS}
+    with metrics.timer('parse'):
+        BACKENDS[backend or default_backend()](html, columns)
+    metrics.count('parse', rows=len(columns['pdx_trip']))
+    columns['date'] = [date or datetime.now().strftime("%Y-%m-%d")] * len(columns['pdx_trip'])
+    return columns
+
+
+def to_records(columns):
+    """Turn column lists into the per-row dicts the publisher sends."""
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
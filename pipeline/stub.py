@@ -0,0 +1,156 @@
+"""Local stand-in for the busdata API, for exercising the publishers offline.
+
+Run ``python -m pipeline.stub --port 8080`` and point a publisher at
+``http://localhost:8080/api`` with ``--base-url``.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+def breadcrumbs(vehicle_id, count=500, opd_date="08DEC2022:00:00:00"):
+    """Generate count breadcrumb records shaped like getBreadCrumbs output."""
+    rng = random.Random(int(vehicle_id))
+    records = []
+    trip = 200000000 + int(vehicle_id) * 100
+    meters, act_time = 0, 16000
+    lat, lon = 45.5 + rng.random() / 10, -122.7 + rng.random() / 10
+    for i in range(count):
+        if i and i % 100 == 0:
+            trip, meters = trip + 1, 0
+        meters += rng.randint(0, 120)
+        act_time += 5
+        lat += rng.uniform(-1e-4, 1e-4)
+        lon += rng.uniform(-1e-4, 1e-4)
+        records.append({
+            "EVENT_NO_TRIP": trip,
+            "EVENT_NO_STOP": trip + i,
+            "OPD_DATE": opd_date,
+            "VEHICLE_ID": int(vehicle_id),
+            "METERS": meters,
+            "ACT_TIME": act_time,
+            "GPS_LONGITUDE": round(lon, 6),
+            "GPS_LATITUDE": round(lat, 6),
+            "GPS_SATELLITES": 12.0,
+            "GPS_HDOP": round(rng.uniform(0.5, 3.0), 1),
+        })
+    return records
+
+
+STOP_EVENT_HEADER = [
+    'vehicle_number', 'leave_time', 'train', 'route_number', 'direction',
+    'service_key', 'trip_number', 'stop_time', 'arrive_time', 'dwell',
+    'location_id', 'door', 'lift', 'ons', 'offs', 'estimated_load',
+    'maximum_speed', 'train_mileage', 'pattern_distance', 'location_distance',
+    'x_coordinate', 'y_coordinate', 'data_source', 'schedule_status',
+]
+
+
+def stop_events_page(vehicle_num, trips=20, stops=60, service_date='2022-12-08'):
+    """Render a getStopEvents HTML page: one h2 and table per PDX_TRIP."""
+    rng = random.Random(int(vehicle_num))
+    parts = [f"<html><head><title>TriMet stop events</title></head><body>\n"
+             f"<h1>Trimet CAD/AVL stop data for {service_date}</h1>\n"]
+    route = rng.randint(1, 99)
+    for t in range(trips):
+        pdx_trip = 230000000 + int(vehicle_num) * 100 + t
+        trip_number = 1000000 + int(vehicle_num) * 100 + t
+        direction = t % 2
+        parts.append(f"<h2>Stop events for PDX_TRIP {pdx_trip}</h2>\n<table border=\"1\">\n<tr>")
+        parts.append("".join(f"<th>{name}</th>" for name in STOP_EVENT_HEADER))
+        parts.append("</tr>\n")
+        leave = 20000 + t * 3600
+        mileage = rng.uniform(1000, 90000)
+        for s in range(stops):
+            leave += rng.randint(30, 120)
+            ons, offs = rng.randint(0, 8), rng.randint(0, 8)
+            cells = [vehicle_num, leave, vehicle_num, route, direction, 'W',
+                     trip_number, leave - rng.randint(0, 20), leave - rng.randint(0, 40),
+                     rng.randint(0, 30), 1000 + rng.randint(0, 12000), rng.randint(0, 2),
+                     0, ons, offs, rng.randint(0, 40), rng.randint(10, 45),
+                     round(mileage + s * 0.3, 1), s * 1500, rng.randint(0, 200),
+                     round(7640000 + rng.uniform(0, 30000), 1),
+                     round(680000 + rng.uniform(0, 30000), 1), 0, rng.randint(0, 6)]
+            parts.append("<tr>" + "".join(f"<td>{c}</td>" for c in cells) + "</tr>\n")
+        parts.append("</table>\n")
+    parts.append("</body></html>\n")
+    return "".join(parts)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serve /api/getBreadCrumbs and /api/getStopEvents with synthetic data and optional faults."""
+
+    records_per_vehicle = 500
+    latency = 0.0
+    fail_every = 0
+    # Status of the failed requests, e.g. 429 to exercise rate-limit retries
+    fail_status = 503
+    # Extra seconds for some vehicles, {vehicle id: seconds}, so responses complete out of order
+    vehicle_latency = {}
+    _hits = 0
+    _lock = threading.Lock()
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        with self._lock:
+            StubHandler._hits += 1
+            hits = StubHandler._hits
+        vehicle = (query.get("vehicle_id") or query.get("vehicle_num") or [None])[0]
+        extra = {str(k): v for k, v in self.vehicle_latency.items()}
+        delay = self.latency + extra.get(vehicle, 0.0)
+        if delay:
+            time.sleep(delay)
+        if self.fail_every and hits % self.fail_every == 0:
+            self.send_error(self.fail_status)
+            return
+        if parts.path.endswith("/getBreadCrumbs") and "vehicle_id" in query:
+            body = json.dumps(breadcrumbs(query["vehicle_id"][0], self.records_per_vehicle))
+            content_type = "application/json"
+        elif parts.path.endswith("/getStopEvents") and "vehicle_num" in query:
+            body = stop_events_page(query["vehicle_num"][0], stops=max(1, self.records_per_vehicle // 20))
+            content_type = "text/html"
+        else:
+            self.send_error(404)
+            return
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=0, **options):
+    """Start the stub in a background thread and return the server."""
+    handler = type("Handler", (StubHandler,), options)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--records", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--fail-every", type=int, default=0)
+    args = parser.parse_args()
+    server = serve(args.port, records_per_vehicle=args.records,
+                   latency=args.latency, fail_every=args.fail_every)
+    print(f"Stub busdata API at http://127.0.0.1:{server.server_port}/api")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
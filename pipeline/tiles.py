@@ -0,0 +1,345 @@
+"""Pre-aggregated speed grid served as Mapbox vector tiles.
+
+Breadcrumbs are binned into a Web Mercator grid of CELLS x CELLS cells
+per tile at max_zoom, keeping count, sum, min and max speed per cell.
+Each coarser zoom merges 2 x 2 cells of the one below, so the whole
+pyramid comes from one pass over the rows, and every tile holds at most
+CELLS ** 2 points however many breadcrumbs fell in it. Tiles are encoded
+as Mapbox Vector Tile protobufs: one layer, ``speed``, with a point at
+each occupied cell's centre and properties
+
+    count       breadcrumbs in the cell
+    speed       mean speed
+    min_speed   slowest breadcrumb
+    max_speed   fastest breadcrumb
+
+They are stored gzip-compressed in an MBTiles file (SQLite, TMS rows),
+which Visualization/server.py serves at /tiles/{z}/{x}/{y}.pbf.
+
+    python -m pipeline.tiles --dsn "dbname=postgres user=postgres" --day 2022-12-08 --out speed.mbtiles
+    python -m pipeline.tiles --tsv top3.tsv --lon x --lat y --out speed.mbtiles
+"""
+import argparse
+import gzip
+import json
+import logging
+import math
+import sqlite3
+import struct
+import sys
+import threading
+import time
+
+# numpy and pandas are imported in the functions that use them, so that
+# loading this module (e.g. for --help from the CLI, or the tile server) stays fast
+
+logger = logging.getLogger(__name__)
+
+LAYER = 'speed'
+CELL_BITS = 6
+CELLS = 1 << CELL_BITS
+EXTENT = 4096
+MAX_LATITUDE = 85.0511287798
+
+DAY_QUERY = ("SELECT longitude, latitude, speed FROM breadcrumb "
+             "WHERE tstamp >= %(day)s::date AND tstamp < %(day)s::date + 1")
+
+MBTILES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tiles (
+    zoom_level INTEGER NOT NULL,
+    tile_column INTEGER NOT NULL,
+    tile_row INTEGER NOT NULL,
+    tile_data BLOB NOT NULL,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+);
+"""
+
+_AGGREGATES = {'count': 'sum', 'total': 'sum', 'low': 'min', 'high': 'max'}
+
+
+def cell_coordinates(lon, lat, zoom, cell_bits=CELL_BITS):
+    """Global grid cell (column, row) of each point at zoom, as int64 arrays."""
+    import numpy as np
+
+    size = float(1 << (zoom + cell_bits))
+    lat = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(lon, dtype=float) + 180.0) / 360.0 * size
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0 * size
+    last = size - 1
+    return np.clip(x, 0, last).astype(np.int64), np.clip(y, 0, last).astype(np.int64)
+
+
+class SpeedGrid:
+    """Per-cell speed aggregates at max_zoom, accumulated a chunk at a time.
+
+    Memory grows with the number of occupied cells, not with rows.
+    """
+
+    def __init__(self, max_zoom=16, cell_bits=CELL_BITS, merge_rows=1_000_000):
+        self.max_zoom = max_zoom
+        self.cell_bits = cell_bits
+        self.merge_rows = merge_rows
+        self.rows = 0
+        self._cells = None
+        self._pending = []
+        self._pending_rows = 0
+
+    def add(self, lon, lat, speed):
+        import numpy as np
+        import pandas as pd
+
+        lon, lat, speed = (np.asarray(a, dtype=float) for a in (lon, lat, speed))
+        keep = np.isfinite(lon) & np.isfinite(lat) & np.isfinite(speed)
+        if not keep.any():
+            return
+        cx, cy = cell_coordinates(lon[keep], lat[keep], self.max_zoom, self.cell_bits)
+        speed = speed[keep]
+        frame = pd.DataFrame({'key': (cx << 32) | cy, 'count': 1, 'total': speed,
+                              'low': speed, 'high': speed})
+        part = frame.groupby('key', sort=False).agg(_AGGREGATES)
+        self._pending.append(part)
+        self._pending_rows += len(part)
+        self.rows += int(keep.sum())
+        if self._pending_rows >= self.merge_rows:
+            self._merge()
+
+    def _merge(self):
+        import pandas as pd
+
+        parts = self._pending if self._cells is None else [self._cells] + self._pending
+        if parts:
+            self._cells = pd.concat(parts).groupby(level=0, sort=False).agg(_AGGREGATES)
+        self._pending, self._pending_rows = [], 0
+
+    def cells(self):
+        """The cells at max_zoom as a frame of cx, cy, count, total, low, high."""
+        import numpy as np
+        import pandas as pd
+
+        self._merge()
+        if self._cells is None:
+            return pd.DataFrame({c: np.array([], dtype=np.int64 if c in ('cx', 'cy', 'count') else float)
+                                 for c in ('cx', 'cy', 'count', 'total', 'low', 'high')})
+        keys = self._cells.index.to_numpy()
+        return pd.DataFrame({'cx': keys >> 32, 'cy': keys & 0xFFFFFFFF,
+                             **{c: self._cells[c].to_numpy() for c in _AGGREGATES}})
+
+
+def pyramid(cells, min_zoom, max_zoom):
+    """Yield (zoom, cells) from max_zoom down to min_zoom, merging 2 x 2 cells per step."""
+    for zoom in range(max_zoom, min_zoom - 1, -1):
+        yield zoom, cells
+        if zoom > min_zoom:
+            coarser = cells.assign(cx=cells['cx'] // 2, cy=cells['cy'] // 2)
+            cells = coarser.groupby(['cx', 'cy'], sort=False, as_index=False).agg(_AGGREGATES)
+
+
+def _varint(n):
+    out = bytearray()
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+# Covers every tag, value index and zigzagged coordinate in a tile of EXTENT
+_VARINTS = [_varint(n) for n in range(4 * EXTENT)]
+
+
+def _message(tag, payload):
+    return tag + _varint(len(payload)) + payload
+
+
+def encode_tile(px, py, count, speed, low, high, extent=EXTENT):
+    """Encode one tile's cell-centre points (tile pixel coordinates) as an MVT protobuf.
+
+    Counts and speeds go into the layer's value table once each, so cells
+    with the same rounded speed share an entry.
+    """
+    import numpy as np
+
+    counts, count_index = np.unique(count, return_inverse=True)
+    speeds, speed_index = np.unique(np.concatenate([speed, low, high]), return_inverse=True)
+    speed_index = speed_index.reshape(3, -1) + len(counts)
+    v = _VARINTS
+    features = []
+    for i, (x, y, c, s, lo, hi) in enumerate(zip((px << 1).tolist(), (py << 1).tolist(),
+                                                   count_index.tolist(), *speed_index.tolist())):
+        tags = b''.join((b'\x00', v[c], b'\x01', v[s], b'\x02', v[lo], b'\x03', v[hi]))
+        # MoveTo(1) with zigzag-encoded coordinates
+        geometry = b''.join((b'\x09', v[x], v[y]))
+        feature = b''.join((b'\x12', v[len(tags)], tags, b'\x18\x01\x22', v[len(geometry)], geometry))
+        features.append(b'\x12' + v[len(feature)] + feature)
+    layer = [b'\x78\x02', _message(b'\x0a', LAYER.encode())] + features
+    layer += [_message(b'\x1a', key.encode()) for key in ('count', 'speed', 'min_speed', 'max_speed')]
+    layer += [_message(b'\x22', b'\x28' + _varint(int(c))) for c in counts]
+    layer += [_message(b'\x22', b'\x19' + struct.pack('<d', s)) for s in speeds.tolist()]
+    layer.append(b'\x28' + _varint(extent))
+    return _message(b'\x1a', b''.join(layer))
+
+
+def zoom_tiles(cells, cell_bits=CELL_BITS, extent=EXTENT):
+    """Yield (x, y, pbf) for every occupied tile in one zoom level's cells."""
+    import numpy as np
+
+    cx, cy = cells['cx'].to_numpy(), cells['cy'].to_numpy()
+    tile = ((cx >> cell_bits) << 32) | (cy >> cell_bits)
+    order = np.argsort(tile, kind='stable')
+    tile, cx, cy = tile[order], cx[order], cy[order]
+    count = cells['count'].to_numpy()[order]
+    speed = np.round(cells['total'].to_numpy()[order] / count, 1)
+    low = np.round(cells['low'].to_numpy()[order], 1)
+    high = np.round(cells['high'].to_numpy()[order], 1)
+    step = extent >> cell_bits
+    px = (cx & ((1 << cell_bits) - 1)) * step + step // 2
+    py = (cy & ((1 << cell_bits) - 1)) * step + step // 2
+    bounds = np.flatnonzero(np.diff(tile)) + 1
+    for start, stop in zip(np.r_[0, bounds], np.r_[bounds, len(tile)]):
+        if start == stop:
+            continue
+        s = slice(start, stop)
+        yield (int(tile[start] >> 32), int(tile[start] & 0xFFFFFFFF),
+               encode_tile(px[s], py[s], count[s], speed[s], low[s], high[s], extent))
+
+
+class TileStore:
+    """Gzipped vector tiles in an MBTiles file, addressed by XYZ (slippy map) coordinates."""
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(MBTILES_SCHEMA)
+        self._lock = threading.Lock()
+
+    def put_many(self, zoom, tiles):
+        """Store (x, y, pbf) tiles for one zoom in a single transaction; returns gzipped bytes."""
+        flip = (1 << zoom) - 1
+        size = 0
+        with self._db:
+            for x, y, pbf in tiles:
+                data = gzip.compress(pbf, 6)
+                size += len(data)
+                self._db.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                                 (zoom, x, flip - y, data))
+        return size
+
+    def get(self, zoom, x, y):
+        """The gzipped tile, or None where no breadcrumbs fell."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (zoom, x, (1 << zoom) - 1 - y)).fetchone()
+        return row[0] if row else None
+
+    def set_metadata(self, **values):
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+                                 [(k, str(v)) for k, v in values.items()])
+
+    def metadata(self):
+        return dict(self._db.execute("SELECT name, value FROM metadata"))
+
+    def clear(self):
+        with self._db:
+            self._db.execute("DELETE FROM tiles")
+
+    def close(self):
+        self._db.close()
+
+
+def build(chunks, store, min_zoom=8, max_zoom=16, cell_bits=CELL_BITS,
+          lon='longitude', lat='latitude', speed='speed'):
+    """Aggregate breadcrumb chunks into store's pyramid, replacing its tiles.
+
+    Returns one dict per zoom with the tile count, cell count, gzipped bytes
+    and seconds spent building and storing it.
+    """
+    import pandas as pd
+
+    start = time.perf_counter()
+    grid = SpeedGrid(max_zoom, cell_bits)
+    for chunk in chunks:
+        grid.add(pd.to_numeric(chunk[lon], errors='coerce'), pd.to_numeric(chunk[lat], errors='coerce'),
+                 pd.to_numeric(chunk[speed], errors='coerce'))
+    cells = grid.cells()
+    logger.info(f"Binned {grid.rows} breadcrumbs into {len(cells)} cells "
+                f"in {time.perf_counter() - start:.2f}s")
+
+    store.clear()
+    stats = []
+    for zoom, zoom_cells in pyramid(cells, min_zoom, max_zoom):
+        zoom_start = time.perf_counter()
+        tiles = 0
+
+        def counted(tiles_iter):
+            nonlocal tiles
+            for tile in tiles_iter:
+                tiles += 1
+                yield tile
+
+        size = store.put_many(zoom, counted(zoom_tiles(zoom_cells, cell_bits)))
+        stats.append({'zoom': zoom, 'tiles': tiles, 'cells': len(zoom_cells), 'bytes': size,
+                      'seconds': time.perf_counter() - zoom_start})
+
+    if len(cells):
+        size = float(1 << (max_zoom + cell_bits))
+        west, east = cells['cx'].min() / size * 360 - 180, (cells['cx'].max() + 1) / size * 360 - 180
+        north, south = (math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / size))))
+                        for y in (cells['cy'].min(), cells['cy'].max() + 1))
+        store.set_metadata(bounds=f"{west:.6f},{south:.6f},{east:.6f},{north:.6f}")
+    store.set_metadata(
+        name=LAYER, format='pbf', type='overlay', minzoom=min_zoom, maxzoom=max_zoom,
+        json=json.dumps({'vector_layers': [{
+            'id': LAYER, 'minzoom': min_zoom, 'maxzoom': max_zoom,
+            'fields': {'count': 'Number', 'speed': 'Number',
+                       'min_speed': 'Number', 'max_speed': 'Number'}}]}))
+    return stats
+
+
+def main(argv=None):
+    from pipeline.export import query_param, query_chunks, tsv_chunks
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--day', help="service date of breadcrumbs to aggregate")
+    source.add_argument('--query', help="SQL with %%(name)s placeholders for --param")
+    source.add_argument('--tsv', help="TSV file with a header row")
+    parser.add_argument('--dsn', default='', help="libpq connection string for --day/--query")
+    parser.add_argument('--param', type=query_param, action='append', default=[],
+                        metavar='NAME=VALUE', help="query parameter, repeatable")
+    parser.add_argument('--out', required=True, help="MBTiles file to write")
+    parser.add_argument('--lon', default='longitude', help="longitude column")
+    parser.add_argument('--lat', default='latitude', help="latitude column")
+    parser.add_argument('--speed', default='speed', help="speed column")
+    parser.add_argument('--min-zoom', type=int, default=8)
+    parser.add_argument('--max-zoom', type=int, default=16)
+    parser.add_argument('--chunk-rows', type=int, default=100_000)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    conn = None
+    if args.tsv:
+        chunks = tsv_chunks(args.tsv, args.chunk_rows)
+    else:
+        import psycopg2
+        conn = psycopg2.connect(args.dsn)
+        query, params = (DAY_QUERY, {'day': args.day}) if args.day else (args.query, dict(args.param) or None)
+        chunks = query_chunks(conn, query, params, args.chunk_rows)
+
+    store = TileStore(args.out)
+    try:
+        stats = build(chunks, store, args.min_zoom, args.max_zoom,
+                      lon=args.lon, lat=args.lat, speed=args.speed)
+    finally:
+        store.close()
+        if conn is not None:
+            conn.close()
+    for s in stats:
+        print(f"z{s['zoom']:<3} {s['tiles']:>7} tiles {s['cells']:>9} cells "
+              f"{s['bytes'] / 1024:>10.1f} kB {s['seconds']:>7.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""Declarative, vectorized validation of pipeline DataFrames.
+
+Rules are declared once per dataset and evaluated together by
+:func:`validate` in a single pass over the frame. The pass computes each
+shared intermediate once, whichever rules ask for it: the null matrix,
+a column coerced to numbers, a grouping. Every rule then writes its
+violating rows into one column of a rows x rules boolean matrix, and the
+per-rule counts and the rows to quarantine come out of one reduction of
+that matrix. :func:`gate` uses the same rules to split a frame into rows
+to load and rows to quarantine.
+
+pandas is imported where rules are evaluated rather than at the top, so
+modules that only declare rules, such as pipeline.stopevents in the
+stop-event publisher, do not pay for it at start-up.
+"""
+from pipeline import metrics
+
+
+class Pass:
+    """One evaluation of a frame: intermediates shared by rules, each computed at most once."""
+
+    def __init__(self, df):
+        self.df = df
+        self._nulls = None
+        self._numeric = {}
+        self._groups = {}
+
+    def nulls(self, columns=()):
+        """Rows with a null in any of columns (in any column when none are given)."""
+        if self._nulls is None:
+            self._nulls = self.df.isnull()
+        frame = self._nulls[list(columns)] if columns else self._nulls
+        return frame.to_numpy().any(axis=1)
+
+    def numeric(self, column):
+        """column coerced to numbers, unparseable text as NaN."""
+        if column not in self._numeric:
+            import pandas as pd
+            self._numeric[column] = pd.to_numeric(self.df[column], errors='coerce')
+        return self._numeric[column]
+
+    def groups(self, by):
+        """The frame grouped by the columns in by."""
+        by = tuple(by)
+        if by not in self._groups:
+            self._groups[by] = self.df.groupby(list(by), sort=False)
+        return self._groups[by]
+
+
+class Rule:
+    """A check on some columns; subclasses return a boolean array of violating rows.
+
+    Rules with quarantine=False only report: their violations are counted but
+    the rows are still loaded.
+    """
+
+    columns = ()
+
+    def __init__(self, name, quarantine=True):
+        self.name = name
+        self.quarantine = quarantine
+
+    def check(self, p):
+        """Violating rows of p.df, as a numpy boolean array; p is the shared Pass."""
+        raise NotImplementedError
+
+    def violations(self, df):
+        """Violating rows of df as a boolean Series, evaluating this rule alone."""
+        import pandas as pd
+        return pd.Series(self.check(Pass(df)), index=df.index)
+
+
+class Columns(Rule):
+    """All of columns must be present; if any is missing every row fails."""
+
+    def __init__(self, columns, name="columns present", **kwargs):
+        super().__init__(name, **kwargs)
+        self.columns = tuple(columns)
+
+    def check(self, p):
+        import numpy as np
+        return np.zeros(len(p.df), dtype=bool)
+
+
+class NotNull(Rule):
+    """No nulls in columns (all columns when none are given)."""
+
+    def __init__(self, columns=None, name="not null", **kwargs):
+        super().__init__(name, **kwargs)
+        self.columns = tuple(columns or ())
+
+    def check(self, p):
+        return p.nulls(self.columns)
+
+
+class PresentPerGroup(Rule):
+    """Every group_by group has at least one non-null value in each of columns.
+
+    All rows of a group that lacks one fail, e.g. every breadcrumb of a
+    vehicle that reported no trip numbers at all.
+    """
+
+    def __init__(self, group_by, columns, name=None, **kwargs):
+        group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+        columns = [columns] if isinstance(columns, str) else list(columns)
+        super().__init__(name or f"{'/'.join(columns)} present per {'/'.join(group_by)}", **kwargs)
+        self.group_by = group_by
+        self.columns = tuple(group_by) + tuple(columns)
+        self.present = columns
+
+    def check(self, p):
+        counts = p.groups(self.group_by)[self.present].transform('count')
+        return (counts.to_numpy() == 0).any(axis=1)
+
+
+class InRange(Rule):
+    """Values of column lie in [low, high]; either bound may be None.
+
+    Values are coerced to numbers first, so text columns such as the scraped
+    stop events can be checked too. Nulls pass (NotNull covers them) but
+    non-numeric text fails.
+    """
+
+    def __init__(self, column, low=None, high=None, name=None, **kwargs):
+        if name is None:
+            if low is None:
+                name = f"{column} <= {high}"
+            elif high is None:
+                name = f"{column} >= {low}"
+            else:
+                name = f"{column} in [{low}, {high}]"
+        super().__init__(name, **kwargs)
+        self.columns = (column,)
+        self.low = low
+        self.high = high
+
+    def check(self, p):
+        column = self.columns[0]
+        values = p.numeric(column).to_numpy(dtype=float, na_value=float('nan'))
+        bad = ~p.nulls((column,)) & (values != values)
+        if self.low is not None:
+            bad |= values < self.low
+        if self.high is not None:
+            bad |= values > self.high
+        return bad
+
+
+class Integer(Rule):
+    """Values of column are whole numbers."""
+
+    def __init__(self, column, name=None, **kwargs):
+        super().__init__(name or f"{column} is integer", **kwargs)
+        self.columns = (column,)
+
+    def check(self, p):
+        import numpy as np
+        import pandas as pd
+        column = self.columns[0]
+        if pd.api.types.is_integer_dtype(p.df[column]):
+            return np.zeros(len(p.df), dtype=bool)
+        values = p.numeric(column).to_numpy(dtype=float, na_value=float('nan'))
+        return ~p.nulls((column,)) & ((values != values) | (values % 1 != 0))
+
+
+class Unique(Rule):
+    """No repeated rows over columns (whole rows when none are given).
+
+    The first occurrence passes and later copies fail, so gating keeps one.
+    """
+
+    def __init__(self, columns=None, name="unique rows", **kwargs):
+        super().__init__(name, **kwargs)
+        self.columns = tuple(columns or ())
+
+    def check(self, p):
+        return p.df.duplicated(subset=list(self.columns) or None, keep='first').to_numpy()
+
+
+class Consistent(Rule):
+    """Within each group_by group, column has a single distinct value."""
+
+    def __init__(self, group_by, column, name=None, **kwargs):
+        group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+        super().__init__(name or f"{column} consistent per {'/'.join(group_by)}", **kwargs)
+        self.group_by = group_by
+        self.columns = tuple(group_by) + (column,)
+        self.column = column
+
+    def check(self, p):
+        distinct = p.groups(self.group_by)[self.column].transform('nunique')
+        return distinct.to_numpy() > 1
+
+
+class Summary:
+    """A statistic reported alongside the rules; it never fails rows."""
+
+    def __init__(self, name, func, columns=()):
+        self.name = name
+        self.func = func
+        self.columns = tuple(columns)
+
+
+class RuleResult:
+    def __init__(self, name, violations, quarantine, sample):
+        self.name = name
+        self.violations = violations
+        self.quarantine = quarantine
+        self.sample = sample
+
+    def __repr__(self):
+        return f"RuleResult({self.name!r}, violations={self.violations})"
+
+
+class Report:
+    """Per-rule violation counts and sample rows for one validated frame."""
+
+    def __init__(self, rows, results, summaries, bad, masks):
+        self.rows = rows
+        self.results = results
+        self.summaries = summaries
+        self.bad = bad
+        self.masks = masks
+
+    @property
+    def ok(self):
+        return all(r.violations == 0 for r in self.results)
+
+    @property
+    def quarantined(self):
+        return int(self.bad.sum())
+
+    def counts(self):
+        return {r.name: r.violations for r in self.results}
+
+    def __str__(self):
+        lines = [f"Validated {self.rows} rows, {self.quarantined} quarantined"]
+        for r in self.results:
+            status = "ok" if r.violations == 0 else f"{r.violations} violations"
+            action = "" if r.quarantine or r.violations == 0 else " (reported only)"
+            lines.append(f"  {r.name}: {status}{action}")
+        for name, value in self.summaries.items():
+            lines.append(f"  {name}:\n{value}")
+        return "\n".join(lines)
+
+
+def validate(df, rules, sample=5):
+    """Evaluate rules over df in one pass and return a Report.
+
+    Report.bad marks the rows that fail any quarantining rule.
+    """
+    import numpy as np
+    import pandas as pd
+    p = Pass(df)
+    checks = [rule for rule in rules if not isinstance(rule, Summary)]
+    summaries = {rule.name: rule.func(df) for rule in rules
+                 if isinstance(rule, Summary) and all(c in df.columns for c in rule.columns)}
+    # One column of violating rows per rule; a rule whose columns are missing fails every row
+    matrix = np.ones((len(df), len(checks)), dtype=bool, order='F')
+    for j, rule in enumerate(checks):
+        if all(c in df.columns for c in rule.columns):
+            matrix[:, j] = rule.check(p)
+    counts = matrix.sum(axis=0)
+    quarantining = np.array([rule.quarantine for rule in checks], dtype=bool)
+    bad = matrix[:, quarantining].any(axis=1) if len(checks) else np.zeros(len(df), dtype=bool)
+
+    results = []
+    masks = {}
+    for j, rule in enumerate(checks):
+        count = int(counts[j])
+        results.append(RuleResult(rule.name, count, rule.quarantine,
+                                  df.loc[matrix[:, j]].head(sample) if count else df.iloc[:0]))
+        if rule.quarantine and count:
+            masks[rule.name] = pd.Series(matrix[:, j], index=df.index)
+    return Report(len(df), results, summaries, pd.Series(bad, index=df.index), masks)
+
+
+def gate(df, rules, sample=5):
+    """Split df into (good, rejected, report) using the quarantining rules.
+
+    rejected carries a ``reason`` column naming every rule the row failed.
+    """
+    with metrics.timer('validate'):
+        good, rejected, report = _split(df, rules, sample)
+    metrics.count('validate', rows=len(df))
+    if len(rejected):
+        metrics.inc('busdata_rejected_rows_total', len(rejected), stage='validate')
+    return good, rejected, report
+
+
+def _split(df, rules, sample):
+    import pandas as pd
+    report = validate(df, rules, sample=sample)
+    if not report.quarantined:
+        return df, df.iloc[:0].assign(reason=pd.Series(dtype=str)), report
+    rejected = df.loc[report.bad].copy()
+    reason = pd.Series("", index=rejected.index)
+    for name, mask in report.masks.items():
+        hit = mask.loc[rejected.index]
+        reason = reason.where(~hit, reason + name + "; ")
+    rejected['reason'] = reason.str.rstrip("; ")
+    return df.loc[~report.bad].copy(), rejected, report
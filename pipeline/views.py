@@ -0,0 +1,153 @@
+"""Incrementally maintained trip/stop-event join.
+
+``trip_stop`` holds the distinct (trip, vehicle, route, service key,
+direction) rows of the trip/stopevent join per service date, with indexes
+for the dashboard queries. ``trip_stop_view`` stays as a view over it so
+existing queries keep working. Instead of re-running the join over all
+history on every query, the subscribers refresh just the service dates
+they have loaded: one DELETE and one INSERT ... SELECT per refresh, in a
+single transaction, so a refresh is idempotent and readers never see a
+half-refreshed date.
+
+Either side of the join can arrive last, so both subscribers refresh:
+the stop-event side for the dates of the stop events it loads, the
+breadcrumb side for the service dates of the trips it loads. Refreshes
+take a transaction-level advisory lock, so the two never rebuild a date
+at the same time. TripStopRefresher collects the dates and refreshes
+them from a timer, so an idle subscriber still catches up.
+"""
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TRIP_STOP_DDL = """
+CREATE TABLE IF NOT EXISTS trip_stop (
+    service_date DATE NOT NULL,
+    trip_id INT NOT NULL,
+    vehicle_id INT,
+    route_number INT,
+    service_key VARCHAR,
+    direction INT
+);
+CREATE INDEX IF NOT EXISTS trip_stop_service_date_idx ON trip_stop (service_date);
+CREATE INDEX IF NOT EXISTS trip_stop_trip_id_idx ON trip_stop (trip_id);
+CREATE INDEX IF NOT EXISTS trip_stop_route_idx ON trip_stop (route_number, service_date);
+CREATE INDEX IF NOT EXISTS stopevent_date_idx ON stopevent (date);
+CREATE OR REPLACE VIEW trip_stop_view AS
+SELECT trip_id, vehicle_id, route_number, service_key, direction FROM trip_stop;
+"""
+
+# Stop events carry PDX_TRIP, the same trip number as the breadcrumbs' EVENT_NO_TRIP
+REFRESH_SQL = """
+SELECT pg_advisory_xact_lock(hashtext('trip_stop'));
+DELETE FROM trip_stop WHERE service_date = ANY(%(dates)s::date[]);
+INSERT INTO trip_stop (service_date, trip_id, vehicle_id, route_number, service_key, direction)
+SELECT DISTINCT s.date, t.trip_id, t.vehicle_id, s.route_number, s.service_key, s.direction
+FROM stopevent s JOIN trip t ON t.trip_id = s.pdx_trip
+WHERE s.date = ANY(%(dates)s::date[]);
+"""
+
+
+def ensure_trip_stop(conn):
+    """Create trip_stop and its indexes if missing, and point trip_stop_view at it.
+
+    The view keeps the columns of the original join view, so CREATE OR
+    REPLACE swaps it in place for anything already querying it.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(TRIP_STOP_DDL)
+    conn.commit()
+
+
+def refresh_trip_stop(conn, service_dates):
+    """Rebuild the trip_stop rows for service_dates; returns the rows now held for them."""
+    dates = sorted({str(d) for d in service_dates})
+    if not dates:
+        return 0
+    start = time.perf_counter()
+    with conn.cursor() as cursor:
+        cursor.execute(REFRESH_SQL, {'dates': dates})
+        rows = cursor.rowcount
+    conn.commit()
+    logger.info(f"Refreshed trip_stop for {', '.join(dates)}: {rows} rows "
+                f"in {time.perf_counter() - start:.2f}s")
+    return rows
+
+
+def stop_event_dates(conn, trip_ids):
+    """Service dates of the stop events loaded for trip_ids: the trip_stop dates that joining these trips changes."""
+    ids = sorted({int(t) for t in trip_ids})
+    if not ids:
+        return []
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT DISTINCT date FROM stopevent WHERE pdx_trip = ANY(%s)", (ids,))
+        dates = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    return dates
+
+
+class TripStopRefresher:
+    """Refresh trip_stop for the service dates loaded since the last refresh, every interval seconds.
+
+    Loaders add() the dates they load. A background thread refreshes them
+    on its own connection from connect(), whether or not more batches
+    arrive. Rebuilding a date costs the whole date, so dates are collected
+    rather than refreshed per batch. A failed refresh keeps its dates for
+    the next one. close() stops the timer and refreshes what is left. With
+    an infinite interval there is no timer and only close() refreshes.
+    """
+
+    def __init__(self, connect, interval=300.0):
+        self.connect = connect
+        self.interval = interval
+        self.conn = None
+        self._dates = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._timer = None
+        if math.isfinite(interval):
+            self._timer = threading.Thread(target=self._tick, daemon=True)
+            self._timer.start()
+
+    def add(self, service_dates):
+        """Mark service_dates for the next refresh."""
+        with self._lock:
+            self._dates.update(str(d) for d in service_dates)
+
+    def _tick(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"trip_stop refresh failed, retrying in {self.interval:g}s: {e}")
+
+    def refresh(self):
+        """Refresh the dates added since the last refresh now; returns the rows held for them."""
+        with self._lock:
+            dates, self._dates = self._dates, set()
+        if not dates:
+            return 0
+        try:
+            if self.conn is None or self.conn.closed:
+                self.conn = self.connect()
+                ensure_trip_stop(self.conn)
+            return refresh_trip_stop(self.conn, dates)
+        except Exception:
+            with self._lock:
+                self._dates |= dates
+            if self.conn is not None and not self.conn.closed:
+                self.conn.close()
+            raise
+
+    def close(self):
+        self._stop.set()
+        if self._timer is not None:
+            self._timer.join()
+        try:
+            self.refresh()
+        finally:
+            if self.conn is not None:
+                self.conn.close()
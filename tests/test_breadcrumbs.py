@@ -0,0 +1,75 @@
+"""Breadcrumb OPD_DATE parsing, and parallel_transform against the single-process transform."""
+import pandas as pd
+import pytest
+
+from pipeline.breadcrumbs import (BREADCRUMB_RULES, parallel_transform, parse_opd_date, transform,
+                                  transform_pool)
+from pipeline.stub import breadcrumbs
+from pipeline.validation import gate
+
+
+@pytest.fixture(scope='module')
+def day():
+    records = [r for vehicle in (3951, 4001, 3010) for r in breadcrumbs(vehicle, 250)]
+    # Trips with a single breadcrumb, one of them at the very end
+    records.append(dict(records[0], EVENT_NO_TRIP=111, EVENT_NO_STOP=1, METERS=5))
+    records.insert(100, dict(records[0], EVENT_NO_TRIP=112, EVENT_NO_STOP=2, METERS=7))
+    # Records of one trip arriving out of time order
+    records[10], records[20] = records[20], records[10]
+    return pd.DataFrame(records)
+
+
+def assert_same(result, expected):
+    pd.testing.assert_frame_equal(result[0], expected[0])
+    pd.testing.assert_frame_equal(result[1], expected[1])
+
+
+@pytest.mark.parametrize('workers', [2, 3, 4])
+def test_sharded_equals_single_process(day, workers):
+    expected = transform(day)
+    with transform_pool(workers) as executor:
+        assert_same(parallel_transform(day, executor=executor, workers=workers, min_rows=0), expected)
+
+
+def test_single_breadcrumb_trips(day):
+    with transform_pool(2) as executor:
+        trips, crumbs = parallel_transform(day, executor=executor, workers=2, min_rows=0)
+    single = crumbs[crumbs['trip_id'].isin([111, 112])]
+    assert len(single) == 2
+    # Nothing to take a speed from, so it is 0 rather than borrowed from another trip
+    assert single['speed'].tolist() == [0.0, 0.0]
+    assert {111, 112} <= set(trips['trip_id'])
+
+
+def test_shared_blocks_are_reused_and_grown(day):
+    larger = pd.concat([day, day.assign(EVENT_NO_TRIP=day['EVENT_NO_TRIP'] + 10**6)], ignore_index=True)
+    with transform_pool(2) as executor:
+        for df in (day, day.iloc[:300], larger, day):
+            assert_same(parallel_transform(df, executor=executor, workers=2, min_rows=0), transform(df))
+
+
+def test_unshareable_columns_transform_in_process(day):
+    # Object columns cannot go in shared memory
+    df = day.astype({'METERS': object})
+    assert_same(parallel_transform(df, workers=2, min_rows=0), transform(df))
+
+
+def test_in_process_by_default(day):
+    # No pool is needed, or started, for one worker or a small frame
+    assert_same(parallel_transform(day), transform(day))
+    assert_same(parallel_transform(day, workers=2), transform(day))
+
+
+def test_missing_opd_date_is_not_given_another_rows_date():
+    opd_date = pd.Series(['08DEC2022:00:00:00', None, '09DEC2022:00:00:00', None])
+    parsed = parse_opd_date(opd_date)
+    assert parsed.isna().tolist() == [False, True, False, True]
+    assert parsed[[0, 2]].tolist() == [pd.Timestamp('2022-12-08'), pd.Timestamp('2022-12-09')]
+
+
+def test_missing_opd_date_is_quarantined():
+    df = pd.DataFrame(breadcrumbs(3951, 5))
+    df.loc[2, 'OPD_DATE'] = None
+    loaded, rejected, report = gate(df, BREADCRUMB_RULES)
+    assert len(loaded) == 4 and loaded['OPD_DATE'].notna().all()
+    assert rejected['ACT_TIME'].tolist() == [df.loc[2, 'ACT_TIME']]
@@ -0,0 +1,108 @@
+"""Fetcher against the local stub API: retries, rate limiting and yield-as-completed."""
+import time
+
+import pytest
+
+from pipeline import stub
+from pipeline.cache import ResponseCache, today
+from pipeline.fetch import Fetcher, RateLimiter
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(**options):
+        server = stub.serve(0, records_per_vehicle=5, **options)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}/api"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize('status', [503, 429])
+def test_retries_failed_requests(serve, status):
+    base_url = serve(fail_every=2, fail_status=status)
+    with Fetcher(base_url=base_url, workers=1, backoff=0.01) as fetcher:
+        results = dict(fetcher.fetch_many('getBreadCrumbs', [1, 2, 3, 4]))
+    # Every second request fails once and succeeds on retry
+    assert sorted(results) == [1, 2, 3, 4]
+    assert all(len(records) == 5 for records in results.values())
+    assert results[3][0]['VEHICLE_ID'] == 3
+
+
+def test_gives_up_after_retries(serve):
+    base_url = serve(fail_every=1)
+    with Fetcher(base_url=base_url, workers=1, retries=2, backoff=0.01) as fetcher:
+        assert list(fetcher.fetch_many('getBreadCrumbs', [7])) == [(7, None)]
+
+
+def test_rate_limiter_spaces_requests():
+    limiter = RateLimiter(rate=20, burst=1)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.acquire('host')
+    # The first request goes at once, the next five wait 1/20s each
+    assert time.monotonic() - start >= 5 / 20 * 0.9
+
+
+def test_rate_limiter_buckets_per_host():
+    limiter = RateLimiter(rate=1, burst=1)
+    start = time.monotonic()
+    limiter.acquire('a')
+    limiter.acquire('b')
+    assert time.monotonic() - start < 0.5
+
+
+def test_fetcher_rate_limits_against_stub(serve):
+    base_url = serve()
+    with Fetcher(base_url=base_url, workers=4) as fetcher:
+        # No burst, so the spacing shows from the second request on
+        fetcher.limiter = RateLimiter(rate=20, burst=1)
+        start = time.monotonic()
+        results = list(fetcher.fetch_many('getBreadCrumbs', range(1, 7)))
+    assert len(results) == 6
+    assert time.monotonic() - start >= 5 / 20 * 0.9
+
+
+def test_yields_as_completed(serve):
+    base_url = serve(vehicle_latency={1: 0.5})
+    with Fetcher(base_url=base_url, workers=4) as fetcher:
+        order = [vehicle for vehicle, _ in fetcher.fetch_many('getBreadCrumbs', [1, 2, 3, 4])]
+    # The slow first vehicle arrives last instead of holding back the others
+    assert sorted(order) == [1, 2, 3, 4]
+    assert order[-1] == 1
+
+
+def test_stop_events_as_text(serve):
+    base_url = serve()
+    with Fetcher(base_url=base_url, workers=2) as fetcher:
+        (vehicle, html), = fetcher.fetch_many('getStopEvents', [3951], param='vehicle_num', as_json=False)
+    assert vehicle == 3951
+    assert 'PDX_TRIP' in html
+
+
+def test_past_date_is_never_fetched_live(serve, tmp_path):
+    base_url = serve()
+    cache = ResponseCache(str(tmp_path))
+    cache.put('getBreadCrumbs', 1, '2022-12-08', b'[]')
+    with Fetcher(base_url=base_url, workers=1, cache=cache, service_date='2022-12-08') as fetcher:
+        assert fetcher.get('getBreadCrumbs', {'vehicle_id': 1}) == []
+        with pytest.raises(LookupError):
+            fetcher.get('getBreadCrumbs', {'vehicle_id': 2})
+    # Today's live answer was not stored under the past date
+    assert cache.read('getBreadCrumbs', 2, '2022-12-08') is None
+    cache.close()
+
+
+def test_today_is_fetched_and_cached(serve, tmp_path):
+    base_url = serve()
+    cache = ResponseCache(str(tmp_path))
+    with Fetcher(base_url=base_url, workers=1, cache=cache) as fetcher:
+        records = fetcher.get('getBreadCrumbs', {'vehicle_id': 2})
+    assert len(records) == 5
+    assert cache.read('getBreadCrumbs', 2, today()) is not None
+    cache.close()
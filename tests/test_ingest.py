@@ -0,0 +1,56 @@
+"""Staged ingest: results, failures and the per-stage metrics."""
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from pipeline import metrics
+from pipeline.ingest import Stage, ingest, parse_json
+
+PAGES = {1: b'[{"a": 1}]', 2: b'not json', 3: b'[{"a": 3}, {"a": 4}]', 4: None}
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    return registry
+
+
+def fetch(key, _):
+    # No timer of its own, so only the runner can count its failures
+    if PAGES[key] is None:
+        raise OSError(f"vehicle {key} not found")
+    return PAGES[key]
+
+
+def errors(registry, stage):
+    counters, _, _ = registry.snapshot()
+    return counters.get(('busdata_stage_errors_total', (('stage', stage),)), 0)
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_failed_items_are_dropped_and_counted_once(registry, processes):
+    results = {}
+    executor = ProcessPoolExecutor(processes) if processes else None
+    stages = [Stage('fetch', fetch, workers=2), Stage('parse', parse_json, executor=executor)]
+    try:
+        failures = ingest(PAGES, stages, on_result=results.__setitem__)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    assert results == {1: [{'a': 1}], 3: [{'a': 3}, {'a': 4}]}
+    assert sorted((stage, key) for stage, key, _ in failures) == [('fetch', 4), ('parse', 2)]
+    assert isinstance(dict((key, e) for _, key, e in failures)[2], json.JSONDecodeError)
+    assert [(s.done, s.failed) for s in stages] == [(3, 1), (2, 1)]
+    assert (errors(registry, 'fetch'), errors(registry, 'parse')) == (1, 1)
+
+
+def test_metrics_from_worker_processes_reach_the_parent(registry):
+    with ProcessPoolExecutor(2) as executor:
+        ingest(PAGES, [Stage('fetch', fetch), Stage('parse', parse_json, executor=executor)])
+    counters, _, histograms = registry.snapshot()
+    assert counters[('busdata_rows_total', (('stage', 'parse'),))] == 3
+    # Every parse call was timed in a child, the failed one included
+    assert histograms[('busdata_stage_seconds', (('stage', 'parse'),))][-1] == 3
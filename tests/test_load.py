@@ -0,0 +1,79 @@
+"""copy_dataframe bisection against a fake connection that rejects rows as Postgres would."""
+import io
+
+import pandas as pd
+import psycopg2.errors
+import pytest
+
+from pipeline.load import copy_dataframe
+
+
+class FakeConnection:
+    """Takes CSV COPY data; reject(row) returns the error a row fails with, or None."""
+
+    def __init__(self, reject):
+        self.reject = reject
+        self.committed = []
+        self.copies = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def copy_expert(self, sql, file):
+        self.copies += 1
+        rows = pd.read_csv(io.BufferedReader(file), header=None, names=['trip_id', 'speed'])
+        for row in rows.itertuples(index=False):
+            error = self.reject(row)
+            if error is not None:
+                raise error
+        self.pending = rows['trip_id'].tolist()
+
+    def commit(self):
+        self.committed += self.pending
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def frame(rows):
+    return pd.DataFrame({'trip_id': range(rows), 'speed': 1.0})
+
+
+def test_bad_rows_are_bisected_out():
+    bad = {17, 700}
+
+    def reject(row):
+        if row.trip_id in bad:
+            return psycopg2.errors.NumericValueOutOfRange(f"speed out of range\nrow {row.trip_id}")
+
+    conn = FakeConnection(reject)
+    result = copy_dataframe(conn, 'breadcrumb', frame(1000), chunk_rows=500)
+    assert sorted(conn.committed) == [i for i in range(1000) if i not in bad]
+    assert sorted(result.failed_rows()['trip_id']) == sorted(bad)
+    assert set(result.failed_rows()['reason']) == {"speed out of range"}
+    assert result.rows == 998
+
+
+def test_chunk_wide_row_error_stops_bisecting():
+    # Every row fails alike when, say, no partition takes the chunk's date
+    conn = FakeConnection(lambda row: psycopg2.errors.CheckViolation(
+        'no partition of relation "breadcrumb" found for row'))
+    result = copy_dataframe(conn, 'breadcrumb', frame(1000), chunk_rows=500)
+    # The chunk, then its two halves; not one attempt per row
+    assert conn.copies == 2 * 3
+    assert len(result.failed_rows()) == 1000 and conn.committed == []
+    assert set(result.failed_rows()['reason']) == {'no partition of relation "breadcrumb" found for row'}
+
+
+def test_errors_no_row_causes_are_raised():
+    conn = FakeConnection(lambda row: psycopg2.errors.UndefinedTable('relation "breadcrumb" does not exist'))
+    with pytest.raises(psycopg2.errors.UndefinedTable):
+        copy_dataframe(conn, 'breadcrumb', frame(1000), chunk_rows=500)
+    assert conn.copies == 1 and conn.rollbacks == 1
@@ -0,0 +1,46 @@
+"""MicroBatcher decoding, acking and nacking, through to the raw archive."""
+import base64
+import glob
+import json
+
+from pipeline import wire
+from pipeline.archive import RawArchive, read_partition
+from pipeline.fakes import FakeMessage
+from pipeline.microbatch import MicroBatcher
+from pipeline.publish import unpack_records
+from pipeline.stub import breadcrumbs
+
+
+def test_unpack_old_base64_messages():
+    records = breadcrumbs(3951, 3)
+    data = base64.b64encode(json.dumps(records).encode())
+    assert unpack_records(data, {'vehicle_id': '3951'}) == records
+
+
+def test_unpack_current_encodings():
+    records = breadcrumbs(3951, 3)
+    assert unpack_records(json.dumps(records[0]).encode(), {}) == records[:1]
+    assert unpack_records(wire.encode_records(records), {'encoding': wire.ENCODING}) == records
+
+
+def test_base64_messages_reach_the_archive(tmp_path):
+    archive = RawArchive(str(tmp_path))
+    batcher = MicroBatcher(archive.write, max_rows=1000, max_age=60)
+    records = breadcrumbs(3951, 4)
+    message = FakeMessage(base64.b64encode(json.dumps(records).encode()), {'vehicle_id': '3951'}, '1')
+    batcher.add(message)
+    batcher.close()
+    archive.close()
+    assert message.acked
+    archived = [r for path in glob.glob(str(tmp_path / '*' / '*')) for r in read_partition(path)]
+    assert archived == records
+
+
+def test_undecodable_message_is_nacked_not_acked():
+    handled = []
+    batcher = MicroBatcher(handled.extend, max_rows=1000, max_age=60)
+    message = FakeMessage(b'\x00not a message', {}, '2')
+    batcher.add(message)
+    batcher.close()
+    assert message.nacked and not message.acked
+    assert handled == []
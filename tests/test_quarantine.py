@@ -0,0 +1,72 @@
+"""QuarantineDir entries, and replay handing them back without their old reasons."""
+import pandas as pd
+import psycopg2
+import pytest
+
+from pipeline.quarantine import QuarantineDir, replay
+from pipeline.stub import breadcrumbs
+
+
+@pytest.fixture
+def store(tmp_path):
+    return QuarantineDir(str(tmp_path))
+
+
+def test_put_pending_done(store):
+    rejected = pd.DataFrame(breadcrumbs(3951, 3)).assign(reason=['a', 'b', 'a'])
+    store.put('breadcrumb', 'validate', rejected)
+    store.put('breadcrumb', 'batch', breadcrumbs(4001, 2), reason="RuntimeError: boom")
+    assert store.put('breadcrumb', 'validate', []) is None
+
+    entries = list(store.pending('breadcrumb'))
+    assert [(e.stage, len(e.rows)) for e in entries] == [('validate', 3), ('batch', 2)]
+    assert entries[0].rows['reason'].tolist() == ['a', 'b', 'a']
+    assert entries[1].records.to_dict('records') == breadcrumbs(4001, 2)
+    assert [e.stage for e in store.pending('breadcrumb', stages={'batch'})] == ['batch']
+    assert store.summary() == {('breadcrumb', 'validate', 'a'): 2, ('breadcrumb', 'validate', 'b'): 1,
+                               ('breadcrumb', 'batch', 'RuntimeError: boom'): 2}
+
+    store.done(entries[0])
+    assert [e.stage for e in store.pending('breadcrumb')] == ['batch']
+    assert list(store.pending('stopevent')) == []
+
+
+def test_replay_hands_over_records_without_reason(store):
+    store.put('breadcrumb', 'validate', pd.DataFrame(breadcrumbs(3951, 3)), reason="GPS position present")
+    handled = []
+    replayed, failed = replay(store, 'breadcrumb', lambda entry, rows: handled.append(rows))
+    assert (replayed, failed) == (3, 0)
+    assert 'reason' not in handled[0].columns
+    assert handled[0].to_dict('records') == breadcrumbs(3951, 3)
+    assert list(store.pending('breadcrumb')) == []
+
+
+def test_failed_entry_is_quarantined_anew_and_replay_goes_on(store):
+    store.put('breadcrumb', 'batch', breadcrumbs(3951, 2), reason="old")
+    store.put('breadcrumb', 'load_trip', breadcrumbs(4001, 3), reason="old")
+    handled = []
+
+    def handle(entry, rows):
+        if entry.stage == 'batch':
+            raise RuntimeError("breadcrumb load failed")
+        handled.append(entry.stage)
+
+    assert replay(store, 'breadcrumb', handle) == (3, 1)
+    assert handled == ['load_trip']
+    # Replayed once, not again from its own output
+    [entry] = store.pending('breadcrumb')
+    assert entry.stage == 'batch'
+    assert entry.rows['reason'].unique().tolist() == ["RuntimeError: breadcrumb load failed"]
+    assert entry.records.to_dict('records') == breadcrumbs(3951, 2)
+
+
+def test_transient_error_leaves_the_entry_pending(store):
+    store.put('breadcrumb', 'batch', breadcrumbs(3951, 2), reason="old")
+
+    def handle(entry, rows):
+        raise psycopg2.OperationalError("server closed the connection")
+
+    with pytest.raises(psycopg2.OperationalError):
+        replay(store, 'breadcrumb', handle, transient=(psycopg2.OperationalError,))
+    [entry] = store.pending('breadcrumb')
+    assert entry.rows['reason'].unique().tolist() == ["old"]
@@ -0,0 +1,80 @@
+"""trip_route rows from stop events, and TripRouteIndex writing only what changed."""
+import pandas as pd
+import pytest
+
+from pipeline import routes
+from pipeline.load import LoadResult
+from pipeline.quarantine import QuarantineDir
+from pipeline.routes import TripRouteIndex, trip_routes
+
+
+def stop_events(*rows):
+    return pd.DataFrame(rows, columns=['pdx_trip', 'route_number', 'direction', 'service_key'])
+
+
+def test_one_row_per_trip():
+    df = stop_events(('101', '20', '0', 'W'), ('101', '20', '0', 'W'),
+                     ('102', '44', '1', 'S'), ('bad', '9', '0', 'W'))
+    got = trip_routes(df)
+    assert got['trip_id'].tolist() == [101, 102]
+    assert got['route_id'].tolist() == [20, 44]
+    assert got['direction'].tolist() == [0, 1]
+    assert got['service_key'].tolist() == ['W', 'S']
+
+
+def test_missing_values_stay_null():
+    got = trip_routes(stop_events(('101', None, '0', None), ('102', '44', '', 'W')))
+    assert got['route_id'].isna().tolist() == [True, False]
+    assert got['direction'].isna().tolist() == [False, True]
+    assert got['service_key'].isna().tolist() == [True, False]
+    assert 'nan' not in got['service_key'].tolist()
+
+
+def test_changed_returns_new_and_different_trips():
+    index = TripRouteIndex()
+    first = trip_routes(stop_events(('101', '20', '0', 'W'), ('102', '44', '1', None)))
+    assert index.changed(first)['trip_id'].tolist() == [101, 102]
+    index.remember(first)
+    assert len(index) == 2
+
+    # The same trips again, nulls included, are unchanged
+    assert len(index.changed(first)) == 0
+    later = trip_routes(stop_events(('101', '20', '1', 'W'), ('102', '44', '1', None),
+                                    ('103', '8', '0', 'S')))
+    assert index.changed(later)['trip_id'].tolist() == [101, 103]
+
+
+def test_index_is_cleared_when_full():
+    index = TripRouteIndex(max_trips=2)
+    index.remember(trip_routes(stop_events(('101', '20', '0', 'W'), ('102', '44', '1', 'W'))))
+    index.remember(trip_routes(stop_events(('103', '8', '0', 'S'))))
+    assert len(index) == 1
+
+
+@pytest.fixture
+def refuse_trip(monkeypatch):
+    """copy_dataframe refuses the trip_route row of trip 102; enrich_trips updates every trip."""
+    def copy_dataframe(conn, table, df, **options):
+        result = LoadResult(table)
+        result.rows = len(df)
+        refused = df['trip_id'] == 102
+        if refused.any():
+            result.failed.append((df.loc[refused], "route_id out of range"))
+        return result
+
+    monkeypatch.setattr(routes, 'copy_dataframe', copy_dataframe)
+    monkeypatch.setattr(routes, 'enrich_trips', lambda conn, trip_ids: len(trip_ids))
+
+
+def test_refused_trips_are_quarantined_and_not_remembered(refuse_trip, tmp_path):
+    store = QuarantineDir(str(tmp_path))
+    index = TripRouteIndex()
+    df = stop_events(('101', '20', '0', 'W'), ('102', '44', '1', 'W'), ('102', '44', '1', 'W'))
+    assert index.apply(None, df, store) == 1
+
+    entries = list(store.pending('stopevent'))
+    assert [(e.stage, len(e.rows)) for e in entries] == [('load_trip_route', 2)]
+    assert entries[0].rows['pdx_trip'].tolist() == ['102', '102']
+    assert set(entries[0].rows['reason']) == {"route_id out of range"}
+    # The refused trip is written again with the next batch
+    assert index.changed(trip_routes(df))['trip_id'].tolist() == [102]
@@ -0,0 +1,30 @@
+"""Commands that do not need numpy or pandas to start must not import them."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+@pytest.mark.parametrize('module', ['pipeline.cli', 'pipeline.publish', 'pipeline.quarantine',
+                                    'pipeline.export', 'pipeline.tiles'])
+def test_module_loads_without_numpy_or_pandas(module):
+    code = (f"import sys, {module}; "
+            f"print(' '.join(m for m in ('numpy', 'pandas') if m in sys.modules))")
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True,
+                            check=True)
+    assert result.stdout.strip() == ''
+
+
+def test_json_publishing_leaves_numpy_unloaded():
+    code = ("import sys; from pipeline.publish import BatchPublisher, unpack_records; "
+            "from pipeline.fakes import FakePublisherClient; "
+            "p = BatchPublisher('projects/p/topics/t', client=FakePublisherClient(), encoding='json'); "
+            "p.publish_records([{'a': 1}]); p.drain(); "
+            "assert unpack_records(b'{\"a\": 1}', {}) == [{'a': 1}]; "
+            "print('numpy' in sys.modules)")
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True,
+                            check=True)
+    assert result.stdout.strip() == 'False'
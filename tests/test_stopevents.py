@@ -0,0 +1,69 @@
+"""Stop-event page parsing: every backend returns what the bs4 parser does."""
+import glob
+import os
+
+import pytest
+
+from pipeline import stub
+from pipeline.stopevents import BACKENDS, CELL_COLUMNS, parse_stop_events
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks',
+                        'fixtures', 'getStopEvents_*.html')
+DATE = '2022-12-08'
+
+
+def table(*rows):
+    header = "<tr>" + "".join(f"<th>{name}</th>" for name in CELL_COLUMNS) + "</tr>"
+    return "<table>" + header + "".join(
+        "<tr>" + "".join(f"<td>{row}-{i}</td>" for i in range(len(CELL_COLUMNS))) + "</tr>"
+        for row in rows) + "</table>\n"
+
+
+# Several h2/table pairs, with headings nested elsewhere on the page that are
+# not the table's preceding sibling and must not name its trip
+NESTED_HEADINGS = (
+    "<html><body><h1>Trimet CAD/AVL stop data for 2022-12-08</h1>\n"
+    "<h2>Stop events for PDX_TRIP 101</h2>\n" + table('a', 'b') +
+    "<div><h2>Notice 999</h2><p>Detour</p></div>\n" + table('c') +
+    "<h2>Stop events for PDX_TRIP 102</h2>\n<div><h2>Sidebar 998</h2></div><br>\n" + table('d') +
+    "<div><h2>Stop events for PDX_TRIP 103</h2>\n" + table('e', 'f') + "</div>\n" +
+    table('g') + "</body></html>\n"
+)
+
+PAGES = {os.path.basename(path): open(path).read() for path in glob.glob(FIXTURES)}
+PAGES['synthetic'] = stub.stop_events_page(3001, trips=3, stops=4)
+PAGES['nested headings'] = NESTED_HEADINGS
+
+
+def _installed(module):
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+# lxml and bs4 are optional; the stream backend is stdlib only
+REQUIRES = {'lxml': 'lxml.html', 'bs4': 'bs4'}
+BACKEND_PARAMS = [
+    pytest.param(backend, marks=pytest.mark.skipif(
+        backend in REQUIRES and not _installed(REQUIRES[backend]),
+        reason=f"{REQUIRES.get(backend)} not installed"))
+    for backend in BACKENDS
+]
+
+
+@pytest.mark.skipif(not _installed('bs4'), reason="bs4 not installed")
+@pytest.mark.parametrize('backend', BACKEND_PARAMS)
+@pytest.mark.parametrize('page', PAGES)
+def test_backends_match_bs4(backend, page):
+    expected = parse_stop_events(PAGES[page], date=DATE, backend='bs4')
+    assert parse_stop_events(PAGES[page], date=DATE, backend=backend) == expected
+
+
+@pytest.mark.parametrize('backend', BACKEND_PARAMS)
+def test_tables_take_the_preceding_sibling_heading(backend):
+    columns = parse_stop_events(NESTED_HEADINGS, date=DATE, backend=backend)
+    assert columns['pdx_trip'] == ['101', '101', '101', '102', '103', '103', '102']
+    assert columns['vehicle_num'] == ['a-0', 'b-0', 'c-0', 'd-0', 'e-0', 'f-0', 'g-0']
+    assert columns['date'] == [DATE] * 7
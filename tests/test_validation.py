@@ -0,0 +1,30 @@
+"""The validation engine: one pass over a frame, per-rule counts and the rows to quarantine."""
+import pandas as pd
+
+from pipeline.breadcrumbs import BREADCRUMB_RULES
+from pipeline.stub import breadcrumbs
+from pipeline.validation import Consistent, InRange, NotNull, PresentPerGroup, gate, validate
+
+
+def test_rules_share_one_pass():
+    df = pd.DataFrame({'v': [1, 1, 2, 2], 't': [None, None, 5, None],
+                       'x': ['1', 'abc', None, '200'], 'c': ['a', 'b', 'c', 'c']})
+    report = validate(df, [PresentPerGroup('v', 't'), InRange('x', high=100),
+                           Consistent('v', 'c', quarantine=False), NotNull(['zz'])])
+    assert report.counts() == {'t present per v': 2, 'x <= 100': 2,
+                               'c consistent per v': 2, 'not null': 4}
+    # A rule over a missing column fails every row
+    assert report.bad.tolist() == [True, True, True, True]
+
+
+def test_per_vehicle_trip_numbers():
+    df = pd.DataFrame(breadcrumbs(3951, 10) + breadcrumbs(4001, 10))
+    df.loc[df['VEHICLE_ID'] == 4001, 'EVENT_NO_STOP'] = None
+    df.loc[0, 'EVENT_NO_TRIP'] = None
+    good, rejected, report = gate(df, BREADCRUMB_RULES)
+    counts = report.counts()
+    # Only vehicle 4001 has no stop numbers at all; 3951 lacks one trip number
+    assert counts['EVENT_NO_TRIP/EVENT_NO_STOP present per VEHICLE_ID'] == 10
+    assert counts['trip and stop numbers present'] == 11
+    assert len(good) == 9 and len(rejected) == 11
+    assert set(rejected['reason']) == {'trip and stop numbers present'}